@@ -534,7 +534,7 @@ def list_chunks():
             )
         kb_ids = KnowledgebaseService.get_kb_ids(tenant_id)
 
-        res = settings.retrievaler.chunk_list(doc_id, tenant_id, kb_ids)
+        res = settings.retrievaler.iter_chunks(doc_id, tenant_id, kb_ids)
         res = [
             {
                 "content": res_item["content_with_weight"],
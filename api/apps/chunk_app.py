@@ -201,14 +201,23 @@ def rm():
         e, doc = DocumentService.get_by_id(req["doc_id"])
         if not e:
             return get_data_error_result(message="Document not found!")
-        if not settings.docStoreConn.delete({"id": req["chunk_ids"]}, search.index_name(current_user.id), doc.kb_id):
+        idxnm = search.index_name(current_user.id)
+        # Images are named by content and may be shared by chunks of the whole KB.
+        img_ids = set(chunk["img_id"] for chunk in settings.docStoreConn.scan(["img_id"], {"id": req["chunk_ids"]}, idxnm, [doc.kb_id])
+                      if chunk.get("img_id"))
+        if not settings.docStoreConn.delete({"id": req["chunk_ids"]}, idxnm, doc.kb_id):
             return get_data_error_result(message="Index updating failure")
         deleted_chunk_ids = req["chunk_ids"]
         chunk_number = len(deleted_chunk_ids)
         DocumentService.decrement_chunk_num(doc.id, doc.kb_id, 1, chunk_number, 0)
-        for cid in deleted_chunk_ids:
-            if STORAGE_IMPL.obj_exist(doc.kb_id, cid):
-                STORAGE_IMPL.rm(doc.kb_id, cid)
+        # A running parse uploads its images before indexing the chunks that use them: they may not be referenced yet.
+        if img_ids and not DocumentService.has_running_docs(doc.kb_id):
+            referenced = set()
+            for chunk in settings.docStoreConn.scan(["img_id"], {"img_id": sorted(img_ids)}, idxnm, [doc.kb_id]):
+                referenced.add(chunk.get("img_id"))
+            for img_id in img_ids - referenced:
+                bkt, nm = img_id.split("-")
+                STORAGE_IMPL.rm(bkt, nm)
         return get_json_result(data=True)
     except Exception as e:
         return server_error_response(e)
@@ -55,7 +55,7 @@ def set_conversation():
             e, conv = ConversationService.get_by_id(conv_id)
             if not e:
                 return get_data_error_result(message="Fail to update a conversation!")
-            conv = conv.to_dict()
+            conv = ConversationService.load_turns(conv.to_dict())
             return get_json_result(data=conv)
         except Exception as e:
             return server_error_response(e)
@@ -89,6 +89,8 @@ def get():
         else:
             return get_json_result(data=False, message="Only owner of conversation authorized for this operation.", code=settings.RetCode.OPERATING_ERROR)
 
+        ConversationService.load_turns(conv)
+
         def get_value(d, k1, k2):
             return d.get(k1, d.get(k2))
 
@@ -167,7 +169,7 @@ def list_convsersation():
             return get_json_result(data=False, message="Only owner of dialog authorized for this operation.", code=settings.RetCode.OPERATING_ERROR)
         convs = ConversationService.query(dialog_id=dialog_id, order_by=ConversationService.model.create_time, reverse=True)
 
-        convs = [d.to_dict() for d in convs]
+        convs = ConversationService.load_turns_many([d.to_dict() for d in convs])
         return get_json_result(data=convs)
     except Exception as e:
         return server_error_response(e)
@@ -190,6 +192,7 @@ def completion():
         e, conv = ConversationService.get_by_id(req["conversation_id"])
         if not e:
             return get_data_error_result(message="Conversation not found!")
+        # The client sends the whole history; only the new turn gets stored.
         conv.message = deepcopy(req["messages"])
         e, dia = DialogService.get_by_id(conv.dialog_id)
         if not e:
@@ -197,33 +200,7 @@ def completion():
         del req["conversation_id"]
         del req["messages"]
 
-        if not conv.reference:
-            conv.reference = []
-        else:
-
-            def get_value(d, k1, k2):
-                return d.get(k1, d.get(k2))
-
-            for ref in conv.reference:
-                if isinstance(ref, list):
-                    continue
-                ref["chunks"] = [
-                    {
-                        "id": get_value(ck, "chunk_id", "id"),
-                        "content": get_value(ck, "content", "content_with_weight"),
-                        "document_id": get_value(ck, "doc_id", "document_id"),
-                        "document_name": get_value(ck, "docnm_kwd", "document_name"),
-                        "dataset_id": get_value(ck, "kb_id", "dataset_id"),
-                        "image_id": get_value(ck, "image_id", "img_id"),
-                        "positions": get_value(ck, "positions", "position_int"),
-                        "doc_type": get_value(ck, "doc_type_kwd", "doc_type_kwd"),
-                    }
-                    for ck in ref.get("chunks", [])
-                ]
-
-        if not conv.reference:
-            conv.reference = []
-        conv.reference.append({"chunks": [], "doc_aggs": []})
+        conv.reference = [{"chunks": [], "doc_aggs": []}]
 
         def stream():
             nonlocal dia, msg, req, conv
@@ -231,7 +208,7 @@ def completion():
                 for ans in chat(dia, msg, True, **req):
                     ans = structure_answer(conv, ans, message_id, conv.id)
                     yield "data:" + json.dumps({"code": 0, "message": "", "data": ans}, ensure_ascii=False) + "\n\n"
-                ConversationService.update_by_id(conv.id, conv.to_dict())
+                ConversationService.append_turn(conv.id, conv.message[-2:], conv.reference[-1])
             except Exception as e:
                 traceback.print_exc()
                 yield "data:" + json.dumps({"code": 500, "message": str(e), "data": {"answer": "**ERROR**: " + str(e), "reference": []}}, ensure_ascii=False) + "\n\n"
@@ -248,8 +225,8 @@ def completion():
         else:
             answer = None
             for ans in chat(dia, msg, **req):
-                answer = structure_answer(conv, ans, message_id, req["conversation_id"])
-                ConversationService.update_by_id(conv.id, conv.to_dict())
+                answer = structure_answer(conv, ans, message_id, conv.id)
+                ConversationService.append_turn(conv.id, conv.message[-2:], conv.reference[-1])
                 break
             return get_json_result(data=answer)
     except Exception as e:
@@ -297,7 +274,7 @@ def delete_msg():
     if not e:
         return get_data_error_result(message="Conversation not found!")
 
-    conv = conv.to_dict()
+    conv = ConversationService.load_turns(conv.to_dict())
     for i, msg in enumerate(conv["message"]):
         if req["message_id"] != msg.get("id", ""):
             continue
@@ -307,7 +284,7 @@ def delete_msg():
         conv["reference"].pop(max(0, i // 2 - 1))
         break
 
-    ConversationService.update_by_id(conv["id"], conv)
+    ConversationService.save_history(conv["id"], conv)
     return get_json_result(data=conv)
 
 
@@ -321,7 +298,7 @@ def thumbup():
         return get_data_error_result(message="Conversation not found!")
     up_down = req.get("thumbup")
     feedback = req.get("feedback", "")
-    conv = conv.to_dict()
+    conv = ConversationService.load_turns(conv.to_dict())
     for i, msg in enumerate(conv["message"]):
         if req["message_id"] == msg.get("id", "") and msg.get("role", "") == "assistant":
             if up_down:
@@ -334,7 +311,7 @@ def thumbup():
                     msg["feedback"] = feedback
             break
 
-    ConversationService.update_by_id(conv["id"], conv)
+    ConversationService.save_history(conv["id"], conv)
     return get_json_result(data=conv)
 
 
@@ -32,6 +32,7 @@ from api.db.db_models import File
 from api.utils.api_utils import get_json_result
 from api import settings
 from rag.nlp import search
+from graphrag.utils import get_graph_overview
 from api.constants import DATASET_NAME_LIMIT
 from rag.settings import PAGERANK_FLD
 
@@ -331,6 +332,10 @@ def knowledge_graph(kb_id):
 
         obj[ty] = content_json
 
+    if "graph" in obj["graph"] and "nodes" not in obj["graph"]:
+        # Graphs are stored as entity and relation rows, the "graph" row only lists their documents.
+        obj["graph"] = get_graph_overview(kb.tenant_id, kb_id)
+
     if "nodes" in obj["graph"]:
         obj["graph"]["nodes"] = sorted(obj["graph"]["nodes"], key=lambda x: x.get("pagerank", 0), reverse=True)[:256]
         if "edges" in obj["graph"]:
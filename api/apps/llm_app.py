@@ -128,6 +128,7 @@ def set_api_key():
                 api_base=llm_config["api_base"],
                 max_tokens=llm_config["max_tokens"]
             )
+    TenantLLMService.invalidate_model_cache(current_user.id)
 
     return get_json_result(data=True)
 
@@ -283,6 +284,7 @@ def add_llm():
             [TenantLLM.tenant_id == current_user.id, TenantLLM.llm_factory == factory,
              TenantLLM.llm_name == llm["llm_name"]], llm):
         TenantLLMService.save(**llm)
+    TenantLLMService.invalidate_model_cache(current_user.id)
 
     return get_json_result(data=True)
 
@@ -295,6 +297,7 @@ def delete_llm():
     TenantLLMService.filter_delete(
         [TenantLLM.tenant_id == current_user.id, TenantLLM.llm_factory == req["llm_factory"],
          TenantLLM.llm_name == req["llm_name"]])
+    TenantLLMService.invalidate_model_cache(current_user.id)
     return get_json_result(data=True)
 
 
@@ -305,6 +308,7 @@ def delete_factory():
     req = request.json
     TenantLLMService.filter_delete(
         [TenantLLM.tenant_id == current_user.id, TenantLLM.llm_factory == req["llm_factory"]])
+    TenantLLMService.invalidate_model_cache(current_user.id)
     return get_json_result(data=True)
 
 
@@ -35,7 +35,9 @@ from api.versions import get_ragflow_version
 from rag.utils.storage_factory import STORAGE_IMPL, STORAGE_IMPL_TYPE
 from timeit import default_timer as timer
 
+from rag.utils.embed_cache import EMBEDDING_CACHE
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.retrieval_cache import RETRIEVAL_CACHE
 
 @manager.route("/version", methods=["GET"])  # noqa: F821
 @login_required
@@ -165,6 +167,8 @@ def status():
     except Exception:
         logging.exception("get task executor heartbeats failed!")
     res["task_executor_heartbeats"] = task_executor_heartbeats
+    res["retrieval_cache"] = RETRIEVAL_CACHE.stats()
+    res["embedding_cache"] = EMBEDDING_CACHE.stats()
 
     return get_json_result(data=res)
 
@@ -727,6 +727,16 @@ class Conversation(DataBaseModel):
         db_table = "conversation"
 
 
+class ConversationTurn(DataBaseModel):
+    id = CharField(max_length=32, primary_key=True)
+    conversation_id = CharField(max_length=32, null=False, index=True)
+    message = JSONField(null=True, default=[], help_text="the question and the answer of the turn")
+    reference = JSONField(null=True, default={})
+
+    class Meta:
+        db_table = "conversation_turn"
+
+
 class APIToken(DataBaseModel):
     tenant_id = CharField(max_length=32, null=False, index=True)
     token = CharField(max_length=255, null=False, index=True)
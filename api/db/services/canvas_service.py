@@ -22,7 +22,7 @@ from api.db import TenantPermission
 from api.db.db_models import DB, CanvasTemplate, User, UserCanvas, API4Conversation
 from api.db.services.api_service import API4ConversationService
 from api.db.services.common_service import CommonService
-from api.db.services.conversation_service import structure_answer
+from api.db.services.conversation_service import DeltaStream, structure_answer
 from api.utils import get_uuid
 from api.utils.api_utils import get_data_openai
 import tiktoken
@@ -121,7 +121,7 @@ class UserCanvasService(CommonService):
         return list(angents.dicts()), count
    
 
-def completion(tenant_id, agent_id, question, session_id=None, stream=True, **kwargs):
+def completion(tenant_id, agent_id, question, session_id=None, stream=True, delta=False, **kwargs):
     e, cvs = UserCanvasService.get_by_id(agent_id)
     assert e, "Agent not found."
     assert cvs.user_id == tenant_id, "You do not own the agent."
@@ -175,9 +175,14 @@ def completion(tenant_id, agent_id, question, session_id=None, stream=True, **kw
 
     final_ans = {"reference": [], "content": ""}
     if stream:
+        delta_stream = DeltaStream(message_id, session_id) if delta else None
         try:
             for ans in canvas.run(stream=stream):
                 if ans.get("running_status"):
+                    if delta_stream:
+                        # A status line, not part of the answer text.
+                        yield delta_stream.event({"answer": ans["content"], "running_status": True})
+                        continue
                     yield "data:" + json.dumps({"code": 0, "message": "",
                                                 "data": {"answer": ans["content"],
                                                          "running_status": True}},
@@ -185,11 +190,18 @@ def completion(tenant_id, agent_id, question, session_id=None, stream=True, **kw
                     continue
                 for k in ans.keys():
                     final_ans[k] = ans[k]
+                if delta_stream:
+                    yield delta_stream.update(ans["content"])
+                    continue
                 ans = {"answer": ans["content"], "reference": ans.get("reference", []), "param": canvas.get_preset_param()}
                 ans = structure_answer(conv, ans, message_id, session_id)
                 yield "data:" + json.dumps({"code": 0, "message": "", "data": ans},
                                            ensure_ascii=False) + "\n\n"
 
+            if delta_stream:
+                ans = {"answer": final_ans["content"], "reference": final_ans.get("reference", []), "param": canvas.get_preset_param()}
+                yield delta_stream.final(structure_answer(conv, ans, message_id, session_id))
+
             canvas.messages.append({"role": "assistant", "content": final_ans["content"], "created_at": time.time(), "id": message_id})
             canvas.history.append(("assistant", final_ans["content"]))
             if final_ans.get("reference"):
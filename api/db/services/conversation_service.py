@@ -13,10 +13,11 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import os
 import time
 from uuid import uuid4
 from api.db import StatusEnum
-from api.db.db_models import Conversation, DB
+from api.db.db_models import Conversation, ConversationTurn, DB
 from api.db.services.api_service import API4ConversationService
 from api.db.services.common_service import CommonService
 from api.db.services.dialog_service import DialogService, chat
@@ -25,6 +26,9 @@ import json
 
 from rag.prompts import chunks_format
 
+# Turns of history loaded to answer a question in a session.
+CONVERSATION_HISTORY_TURNS = int(os.environ.get("CONVERSATION_HISTORY_TURNS", 20))
+
 
 class ConversationService(CommonService):
     model = Conversation
@@ -46,7 +50,81 @@ class ConversationService(CommonService):
 
         sessions = sessions.paginate(page_number, items_per_page)
 
-        return list(sessions.dicts())
+        return cls.load_turns_many(list(sessions.dicts()))
+
+    # The message and reference columns of a conversation only hold what it had before its
+    # first logged turn; each turn since is a row of ConversationTurn, so answering a question
+    # writes one small row instead of the whole session. Readers that need the full session
+    # load the turns, writers that change past messages fold them back in with save_history.
+
+    @classmethod
+    def append_turn(cls, conv_id, message, reference):
+        ConversationTurnService.insert(conversation_id=conv_id, message=message, reference=reference)
+        cls.update_by_id(conv_id, {})
+
+    @classmethod
+    def load_turns(cls, conv, limit=None):
+        turns = ConversationTurnService.get_turns(conv["id"] if isinstance(conv, dict) else conv.id, limit)
+        # A full window of turns is all the history that is asked for, without what came before.
+        return _extend_with_turns(conv, turns, limit is not None and len(turns) >= limit)
+
+    @classmethod
+    def load_turns_many(cls, convs):
+        turns = ConversationTurnService.get_turns_of([c["id"] for c in convs])
+        for c in convs:
+            _extend_with_turns(c, turns.get(c["id"], []))
+        return convs
+
+    @classmethod
+    @DB.connection_context()
+    def save_history(cls, conv_id, conv):
+        with DB.atomic():
+            cls.update_by_id(conv_id, conv)
+            ConversationTurnService.filter_delete([ConversationTurn.conversation_id == conv_id])
+
+    @classmethod
+    @DB.connection_context()
+    def delete_by_id(cls, pid):
+        with DB.atomic():
+            ConversationTurnService.filter_delete([ConversationTurn.conversation_id == pid])
+            return super().delete_by_id(pid)
+
+
+class ConversationTurnService(CommonService):
+    model = ConversationTurn
+
+    @classmethod
+    @DB.connection_context()
+    def get_turns(cls, conversation_id, limit=None):
+        turns = cls.model.select(cls.model.message, cls.model.reference).where(cls.model.conversation_id == conversation_id)
+        if limit is None:
+            return list(turns.order_by(cls.model.create_time.asc()).dicts())
+        return list(turns.order_by(cls.model.create_time.desc()).limit(limit).dicts())[::-1]
+
+    @classmethod
+    @DB.connection_context()
+    def get_turns_of(cls, conversation_ids):
+        res = {}
+        if not conversation_ids:
+            return res
+        turns = cls.model.select(cls.model.conversation_id, cls.model.message, cls.model.reference) \
+            .where(cls.model.conversation_id.in_(conversation_ids)).order_by(cls.model.create_time.asc())
+        for t in turns.dicts():
+            res.setdefault(t["conversation_id"], []).append(t)
+        return res
+
+
+def _extend_with_turns(conv, turns, window_only=False):
+    get = conv.get if isinstance(conv, dict) else lambda k: getattr(conv, k)
+    message, reference = ([], []) if window_only else (get("message") or [], get("reference") or [])
+    for t in turns:
+        message.extend(t["message"])
+        reference.append(t["reference"])
+    if isinstance(conv, dict):
+        conv["message"], conv["reference"] = message, reference
+    else:
+        conv.message, conv.reference = message, reference
+    return conv
 
 
 def structure_answer(conv, ans, message_id, session_id):
@@ -75,7 +153,56 @@ def structure_answer(conv, ans, message_id, session_id):
     return ans
 
 
-def completion(tenant_id, chat_id, question, name="New session", session_id=None, stream=True, **kwargs):
+class DeltaStream:
+    """
+    SSE events of a streamed answer in delta mode (a request with "delta": true).
+
+    The model yields the whole answer so far; an event only carries the text added since the
+    previous one ("delta") and a sequence number ("seq"). If the answer was rewritten rather than
+    extended, the event carries it whole as "answer" and replaces what the client holds. The last
+    event carries the final answer with its reference and "final": true, so chunks are formatted
+    and sent once per answer.
+    """
+
+    def __init__(self, message_id, session_id):
+        self.message_id = message_id
+        self.session_id = session_id
+        self.seq = 0
+        self.sent = ""
+
+    def event(self, data):
+        data.update({"id": self.message_id, "session_id": self.session_id, "seq": self.seq})
+        self.seq += 1
+        return "data:" + json.dumps({"code": 0, "message": "", "data": data}, ensure_ascii=False) + "\n\n"
+
+    def update(self, answer, audio_binary=None):
+        if answer.startswith(self.sent):
+            data = {"delta": answer[len(self.sent):]}
+        else:
+            data = {"answer": answer}
+        self.sent = answer
+        if audio_binary:
+            data["audio_binary"] = audio_binary
+        return self.event(data)
+
+    def final(self, ans):
+        self.sent = ans["answer"]
+        return self.event({**ans, "final": True})
+
+
+def delta_completion(answers, conv, message_id, session_id):
+    """Streams what chat() yields for a session in delta mode, updating conv with the final answer once."""
+    stream = DeltaStream(message_id, session_id)
+    last = None
+    for ans in answers:
+        last = ans
+        if not ans["reference"]:
+            yield stream.update(ans["answer"], ans.get("audio_binary"))
+    if last is not None:
+        yield stream.final(structure_answer(conv, last, message_id, session_id))
+
+
+def completion(tenant_id, chat_id, question, name="New session", session_id=None, stream=True, delta=False, **kwargs):
     assert name, "`name` can not be empty."
     dia = DialogService.query(id=chat_id, tenant_id=tenant_id, status=StatusEnum.VALID.value)
     assert dia, "You do not own the chat."
@@ -107,6 +234,7 @@ def completion(tenant_id, chat_id, question, name="New session", session_id=None
         raise LookupError("Session does not exist")
 
     conv = conv[0]
+    ConversationService.load_turns(conv, CONVERSATION_HISTORY_TURNS)
     msg = []
     question = {
         "content": question,
@@ -128,12 +256,22 @@ def completion(tenant_id, chat_id, question, name="New session", session_id=None
     conv.message.append({"role": "assistant", "content": "", "id": message_id})
     conv.reference.append({"chunks": [], "doc_aggs": []})
 
-    if stream:
+    if stream and delta:
+        try:
+            yield from delta_completion(chat(dia, msg, True, **kwargs), conv, message_id, session_id)
+            ConversationService.append_turn(conv.id, conv.message[-2:], conv.reference[-1])
+        except Exception as e:
+            yield "data:" + json.dumps({"code": 500, "message": str(e),
+                                        "data": {"answer": "**ERROR**: " + str(e), "reference": []}},
+                                       ensure_ascii=False) + "\n\n"
+        yield "data:" + json.dumps({"code": 0, "data": True}, ensure_ascii=False) + "\n\n"
+
+    elif stream:
         try:
             for ans in chat(dia, msg, True, **kwargs):
                 ans = structure_answer(conv, ans, message_id, session_id)
                 yield "data:" + json.dumps({"code": 0, "data": ans}, ensure_ascii=False) + "\n\n"
-            ConversationService.update_by_id(conv.id, conv.to_dict())
+            ConversationService.append_turn(conv.id, conv.message[-2:], conv.reference[-1])
         except Exception as e:
             yield "data:" + json.dumps({"code": 500, "message": str(e),
                                         "data": {"answer": "**ERROR**: " + str(e), "reference": []}},
@@ -144,12 +282,12 @@ def completion(tenant_id, chat_id, question, name="New session", session_id=None
         answer = None
         for ans in chat(dia, msg, False, **kwargs):
             answer = structure_answer(conv, ans, message_id, session_id)
-            ConversationService.update_by_id(conv.id, conv.to_dict())
+            ConversationService.append_turn(conv.id, conv.message[-2:], conv.reference[-1])
             break
         yield answer
 
 
-def iframe_completion(dialog_id, question, session_id=None, stream=True, **kwargs):
+def iframe_completion(dialog_id, question, session_id=None, stream=True, delta=False, **kwargs):
     e, dia = DialogService.get_by_id(dialog_id)
     assert e, "Dialog not found"
     if not session_id:
@@ -202,7 +340,17 @@ def iframe_completion(dialog_id, question, session_id=None, stream=True, **kwarg
         conv.reference = []
     conv.reference.append({"chunks": [], "doc_aggs": []})
 
-    if stream:
+    if stream and delta:
+        try:
+            yield from delta_completion(chat(dia, msg, True, **kwargs), conv, message_id, session_id)
+            API4ConversationService.append_message(conv.id, conv.to_dict())
+        except Exception as e:
+            yield "data:" + json.dumps({"code": 500, "message": str(e),
+                                        "data": {"answer": "**ERROR**: " + str(e), "reference": []}},
+                                       ensure_ascii=False) + "\n\n"
+        yield "data:" + json.dumps({"code": 0, "message": "", "data": True}, ensure_ascii=False) + "\n\n"
+
+    elif stream:
         try:
             for ans in chat(dia, msg, True, **kwargs):
                 ans = structure_answer(conv, ans, message_id, session_id)
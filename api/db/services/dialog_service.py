@@ -15,8 +15,11 @@
 #
 import binascii
 import logging
+import os
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from copy import deepcopy
 from datetime import datetime
 from functools import partial
@@ -38,8 +41,15 @@ from rag.app.tag import label_question
 from rag.nlp.search import index_name
 from rag.prompts import chunks_format, citation_prompt, cross_languages, full_question, kb_prompt, keyword_extraction, llm_id2llm_type, message_fit_in
 from rag.utils import num_tokens_from_string, rmSpace
+from rag.utils.embed_cache import EMBEDDING_CACHE
 from rag.utils.tavily_conn import Tavily
 
+# Seconds each optional retrieval source of a chat gets: one that runs out of time or fails is left out
+# of the answer. The knowledge base is required and searched on the chat's own thread.
+WEB_SEARCH_TIMEOUT = float(os.environ.get("WEB_SEARCH_TIMEOUT", 15))
+KG_RETRIEVAL_TIMEOUT = float(os.environ.get("KG_RETRIEVAL_TIMEOUT", 60))
+RETRIEVAL_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("RETRIEVAL_WORKERS", 32)), thread_name_prefix="retrieval")
+
 
 class DialogService(CommonService):
     model = Dialog
@@ -127,6 +137,63 @@ def chat_solo(dialog, messages, stream=True):
         yield {"answer": answer, "reference": {}, "audio_binary": tts(tts_mdl, answer), "prompt": "", "created_at": time.time()}
 
 
+def label_and_embed(question, kbs, embd_mdl):
+    """
+    The tags of question for the knowledge base search. When the KBs have tag sets, they are labelled
+    on RETRIEVAL_EXECUTOR while the calling thread embeds question into EMBEDDING_CACHE, where the
+    search then finds it. Labelling that hasn't got a thread by then runs on the calling thread.
+    """
+    if not EMBEDDING_CACHE.enabled or not any(kb.parser_config.get("tag_kb_ids") for kb in kbs):
+        return label_question(question, kbs)
+    tags = RETRIEVAL_EXECUTOR.submit(label_question, question, kbs)
+    embd_mdl.encode_queries(question)
+    return label_question(question, kbs) if tags.cancel() else tags.result()
+
+
+def retrieve_concurrently(required, optional):
+    """
+    Runs the required retrieval source, (name, fn), on the calling thread while the optional ones,
+    a list of (name, timeout, fn), run on RETRIEVAL_EXECUTOR. Returns the results of the sources that
+    succeeded in time, and each source's cost in ms ("timed out" or "failed" otherwise).
+
+    The required source raises as it fails; an optional one is logged and left out. An optional source's
+    timeout counts from when it starts running, and one still waiting for a thread once its timeout has
+    gone by is cancelled.
+    """
+    started = {}
+
+    def timed(name, fn):
+        started[name] = timer()
+        return fn(), (timer() - started[name]) * 1000
+
+    def wait(name, timeout, submitted, future):
+        while True:
+            st = started.get(name)
+            try:
+                return future.result(timeout=0.1 if st is None else max(0, timeout - (timer() - st)))
+            except FutureTimeoutError:
+                if name in started:
+                    if timer() - started[name] >= timeout:
+                        raise
+                elif timer() - submitted >= timeout and future.cancel():
+                    raise
+
+    futures = [(name, timeout, timer(), RETRIEVAL_EXECUTOR.submit(timed, name, fn)) for name, timeout, fn in optional]
+    results, costs = {}, {}
+    name, fn = required
+    results[name], costs[name] = timed(name, fn)
+    for name, timeout, submitted, future in futures:
+        try:
+            results[name], costs[name] = wait(name, timeout, submitted, future)
+        except FutureTimeoutError:
+            costs[name] = "timed out"
+            logging.warning(f"{name} retrieval took longer than {timeout}s, answering without it")
+        except Exception:
+            costs[name] = "failed"
+            logging.exception(f"{name} retrieval failed, answering without it")
+    return results, costs
+
+
 def chat(dialog, messages, stream=True, **kwargs):
     assert messages[-1]["role"] == "user", "The last content of this conversation is not from user."
     if not dialog.kb_ids:
@@ -225,6 +292,7 @@ def chat(dialog, messages, stream=True, **kwargs):
 
     bind_reranker_ts = timer()
     generate_keyword_ts = bind_reranker_ts
+    retrieval_costs = {}
     thought = ""
     kbinfos = {"total": 0, "chunks": [], "doc_aggs": []}
 
@@ -252,30 +320,37 @@ def chat(dialog, messages, stream=True, **kwargs):
                 elif stream:
                     yield think
         else:
-            kbinfos = retriever.retrieval(
-                " ".join(questions),
-                embd_mdl,
-                tenant_ids,
-                dialog.kb_ids,
-                1,
-                dialog.top_n,
-                dialog.similarity_threshold,
-                dialog.vector_similarity_weight,
-                doc_ids=attachments,
-                top=dialog.top_k,
-                aggs=False,
-                rerank_mdl=rerank_mdl,
-                rank_feature=label_question(" ".join(questions), kbs),
-            )
+            question = " ".join(questions)
+            optional = []
             if prompt_config.get("tavily_api_key"):
-                tav = Tavily(prompt_config["tavily_api_key"])
-                tav_res = tav.retrieve_chunks(" ".join(questions))
-                kbinfos["chunks"].extend(tav_res["chunks"])
-                kbinfos["doc_aggs"].extend(tav_res["doc_aggs"])
+                optional.append(("Web search", WEB_SEARCH_TIMEOUT,
+                                 lambda: Tavily(prompt_config["tavily_api_key"]).retrieve_chunks(question)))
             if prompt_config.get("use_kg"):
-                ck = settings.kg_retrievaler.retrieval(" ".join(questions), tenant_ids, dialog.kb_ids, embd_mdl, LLMBundle(dialog.tenant_id, LLMType.CHAT))
-                if ck["content_with_weight"]:
-                    kbinfos["chunks"].insert(0, ck)
+                optional.append(("Knowledge graph", KG_RETRIEVAL_TIMEOUT,
+                                 lambda: settings.kg_retrievaler.retrieval(question, tenant_ids, dialog.kb_ids, embd_mdl, LLMBundle(dialog.tenant_id, LLMType.CHAT))))
+            results, retrieval_costs = retrieve_concurrently(("Knowledge base", lambda: retriever.retrieval(
+                    question,
+                    embd_mdl,
+                    tenant_ids,
+                    dialog.kb_ids,
+                    1,
+                    dialog.top_n,
+                    dialog.similarity_threshold,
+                    dialog.vector_similarity_weight,
+                    doc_ids=attachments,
+                    top=dialog.top_k,
+                    aggs=False,
+                    rerank_mdl=rerank_mdl,
+                    rank_feature=label_and_embed(question, kbs, embd_mdl),
+                )), optional)
+
+            # Merged in a fixed order whatever finished first: graph, knowledge base, web.
+            kbinfos = results["Knowledge base"]
+            if results.get("Web search"):
+                kbinfos["chunks"].extend(results["Web search"]["chunks"])
+                kbinfos["doc_aggs"].extend(results["Web search"]["doc_aggs"])
+            if results.get("Knowledge graph") and results["Knowledge graph"]["content_with_weight"]:
+                kbinfos["chunks"].insert(0, results["Knowledge graph"])
 
             knowledges = kb_prompt(kbinfos, max_tokens)
 
@@ -407,6 +482,7 @@ def chat(dialog, messages, stream=True, **kwargs):
             f"  - Bind reranker: {bind_reranker_time_cost:.1f}ms\n"
             f"  - Generate keyword: {generate_keyword_time_cost:.1f}ms\n"
             f"  - Retrieval: {retrieval_time_cost:.1f}ms\n"
+            + "".join(f"    - {name}: {cost if isinstance(cost, str) else f'{cost:.1f}ms'}\n" for name, cost in retrieval_costs.items()) +
             f"  - Generate answer: {generate_result_time_cost:.1f}ms\n\n"
             "## Token usage:\n"
             f"  - Generated tokens(approximately): {tk_num}\n"
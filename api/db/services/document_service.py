@@ -20,11 +20,10 @@ import re
 from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import datetime
-from io import BytesIO
 
 import trio
 import xxhash
-from peewee import fn
+from peewee import Case, fn
 
 from api import settings
 from api.db import FileType, LLMType, ParserType, StatusEnum, TaskStatus, UserTenantRole
@@ -35,10 +34,14 @@ from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.utils import current_timestamp, get_format_time, get_uuid
 from rag.nlp import rag_tokenizer, search
 from rag.settings import get_svr_queue_name
+from rag.utils import image_binary, image_digest
 from rag.utils.redis_conn import REDIS_CONN
 from rag.utils.storage_factory import STORAGE_IMPL
 from rag.utils.doc_store_conn import OrderByExpr
 
+# doc id -> (task count, latest task update_time) as of the last progress update of the document
+PROGRESS_MARKS = {}
+
 
 class DocumentService(CommonService):
     model = Document
@@ -206,6 +209,13 @@ class DocumentService(CommonService):
             cls.model.progress > 0)
         return list(docs.dicts())
 
+    @classmethod
+    @DB.connection_context()
+    def has_running_docs(cls, kb_id):
+        return cls.model.select(cls.model.id).where(
+            cls.model.kb_id == kb_id,
+            cls.model.run == TaskStatus.RUNNING.value).exists()
+
     @classmethod
     @DB.connection_context()
     def increment_chunk_num(cls, doc_id, kb_id, token_num, chunk_num, duation):
@@ -440,51 +450,75 @@ class DocumentService(CommonService):
     def update_meta_fields(cls, doc_id, meta_fields):
         return cls.update_by_id(doc_id, {"meta_fields": meta_fields})
 
+    @classmethod
+    @DB.connection_context()
+    def get_task_progress_stats(cls, doc_ids):
+        """Per-document aggregate of task progress, one grouped query for all doc_ids."""
+        if not doc_ids:
+            return {}
+        stats = Task.select(
+            Task.doc_id,
+            fn.COUNT(Task.id).alias("tasks"),
+            fn.SUM(Case(None, [(Task.progress >= 0, Task.progress)], 0)).alias("progress"),
+            fn.SUM(Case(None, [((Task.progress >= 0) & (Task.progress < 1), 1)], 0)).alias("unfinished"),
+            fn.SUM(Case(None, [(Task.progress == -1, 1)], 0)).alias("bad"),
+            fn.SUM(Case(None, [(Task.task_type == "raptor", 1)], 0)).alias("raptor"),
+            fn.SUM(Case(None, [(Task.task_type == "graphrag", 1)], 0)).alias("graphrag"),
+            fn.MAX(Task.priority).alias("priority"),
+            fn.MAX(Task.update_time).alias("update_time")
+        ).where(Task.doc_id.in_(doc_ids)).group_by(Task.doc_id)
+        return {r["doc_id"]: r for r in stats.dicts()}
+
     @classmethod
     @DB.connection_context()
     def update_progress(cls):
+        """
+        Folds task progress into the unfinished documents. Task stats come from one
+        grouped query per tick, and only documents whose tasks changed since the last
+        tick (task count or latest task update_time) are read further and written.
+        """
         docs = cls.get_unfinished_docs()
+        stats = cls.get_task_progress_stats([d["id"] for d in docs])
+        changed = []
         for d in docs:
+            st = stats.get(d["id"])
+            if not st:
+                continue
+            mark = (st["tasks"], st["update_time"])
+            if PROGRESS_MARKS.get(d["id"]) != mark:
+                changed.append((d, st, mark))
+        for doc_id in set(PROGRESS_MARKS.keys()) - stats.keys():
+            PROGRESS_MARKS.pop(doc_id, None)
+        if not changed:
+            return
+
+        msgs = {}
+        for t in Task.select(Task.doc_id, Task.progress_msg).where(
+                Task.doc_id.in_([d["id"] for d, _, _ in changed])).order_by(Task.create_time).dicts():
+            msgs.setdefault(t["doc_id"], []).append(t["progress_msg"])
+
+        for d, st, mark in changed:
             try:
-                tsks = Task.query(doc_id=d["id"], order_by=Task.create_time)
-                if not tsks:
-                    continue
-                msg = []
-                prg = 0
-                finished = True
-                bad = 0
-                has_raptor = False
-                has_graphrag = False
-                e, doc = DocumentService.get_by_id(d["id"])
-                status = doc.run  # TaskStatus.RUNNING.value
-                priority = 0
-                for t in tsks:
-                    if 0 <= t.progress < 1:
-                        finished = False
-                    if t.progress == -1:
-                        bad += 1
-                    prg += t.progress if t.progress >= 0 else 0
-                    msg.append(t.progress_msg)
-                    if t.task_type == "raptor":
-                        has_raptor = True
-                    elif t.task_type == "graphrag":
-                        has_graphrag = True
-                    priority = max(priority, t.priority)
-                prg /= len(tsks)
+                tsk_num = int(st["tasks"])
+                finished = not int(st["unfinished"] or 0)
+                bad = int(st["bad"] or 0)
+                prg = float(st["progress"] or 0) / tsk_num
+                status = d["run"]
+                priority = int(st["priority"] or 0)
                 if finished and bad:
                     prg = -1
                     status = TaskStatus.FAIL.value
                 elif finished:
-                    if d["parser_config"].get("raptor", {}).get("use_raptor") and not has_raptor:
+                    if d["parser_config"].get("raptor", {}).get("use_raptor") and not int(st["raptor"] or 0):
                         queue_raptor_o_graphrag_tasks(d, "raptor", priority)
-                        prg = 0.98 * len(tsks) / (len(tsks) + 1)
-                    elif d["parser_config"].get("graphrag", {}).get("use_graphrag") and not has_graphrag:
+                        prg = 0.98 * tsk_num / (tsk_num + 1)
+                    elif d["parser_config"].get("graphrag", {}).get("use_graphrag") and not int(st["graphrag"] or 0):
                         queue_raptor_o_graphrag_tasks(d, "graphrag", priority)
-                        prg = 0.98 * len(tsks) / (len(tsks) + 1)
+                        prg = 0.98 * tsk_num / (tsk_num + 1)
                     else:
                         status = TaskStatus.DONE.value
 
-                msg = "\n".join(sorted(msg))
+                msg = "\n".join(sorted([m for m in msgs.get(d["id"], []) if m is not None]))
                 info = {
                     "process_duation": datetime.timestamp(
                         datetime.now()) -
@@ -495,6 +529,7 @@ class DocumentService(CommonService):
                 if msg:
                     info["progress_msg"] = msg
                 cls.update_by_id(d["id"], info)
+                PROGRESS_MARKS[d["id"]] = mark
             except Exception as e:
                 if str(e).find("'0'") < 0:
                     logging.exception("fetch task exception")
@@ -596,6 +631,7 @@ def doc_upload_and_parse(conversation_id, file_objs, user_id):
         }
         threads.append(exe.submit(FACTORY.get(d["parser_id"], naive).chunk, d["name"], blob, **kwargs))
 
+    uploaded_images = set()
     for (docinfo, _), th in zip(files, threads):
         docs = []
         doc = {
@@ -612,14 +648,12 @@ def doc_upload_and_parse(conversation_id, file_objs, user_id):
                 docs.append(d)
                 continue
 
-            output_buffer = BytesIO()
-            if isinstance(d["image"], bytes):
-                output_buffer = BytesIO(d["image"])
-            else:
-                d["image"].save(output_buffer, format='JPEG')
-
-            STORAGE_IMPL.put(kb.id, d["id"], output_buffer.getvalue())
-            d["img_id"] = "{}-{}".format(kb.id, d["id"])
+            # Named by content, as the task executor does, so identical images are stored once per KB.
+            digest = image_digest(d["image"])
+            if digest not in uploaded_images:
+                STORAGE_IMPL.put(kb.id, digest, image_binary(d["image"]))
+                uploaded_images.add(digest)
+            d["img_id"] = "{}-{}".format(kb.id, digest)
             d.pop("image", None)
             docs.append(d)
 
@@ -13,8 +13,13 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import copy
 import logging
+import os
+import threading
+import time
 
+import numpy as np
 from langfuse import Langfuse
 
 from api import settings
@@ -24,6 +29,54 @@ from api.db.services.common_service import CommonService
 from api.db.services.langfuse_service import TenantLangfuseService
 from api.db.services.user_service import TenantService
 from rag.llm import ChatModel, CvModel, EmbeddingModel, RerankModel, Seq2txtModel, TTSModel
+from rag.utils.embed_cache import EMBEDDING_CACHE
+
+# Seconds a tenant's model instance, config and Langfuse client are reused; 0 disables reuse.
+LLM_BUNDLE_CACHE_TTL = int(os.environ.get("LLM_BUNDLE_CACHE_TTL", 300))
+
+
+class TenantModelCache:
+    """
+    Process-wide registry of what LLMBundle resolves for (tenant, type, model):
+    the provider model instance, its config and the tenant's Langfuse client.
+    Reusing the instance reuses its HTTP client and connection pool. Entries expire
+    after `ttl` seconds, which bounds how long other processes keep serving old
+    settings; the process that changes a tenant's settings drops them at once.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, tenant_id=None):
+        with self._lock:
+            if tenant_id is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == tenant_id]:
+                del self._entries[key]
+
+
+TENANT_MODEL_CACHE = TenantModelCache(LLM_BUNDLE_CACHE_TTL)
 
 
 class LLMFactoriesService(CommonService):
@@ -125,8 +178,9 @@ class TenantLLMService(CommonService):
 
     @classmethod
     @DB.connection_context()
-    def model_instance(cls, tenant_id, llm_type, llm_name=None, lang="Chinese"):
-        model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
+    def model_instance(cls, tenant_id, llm_type, llm_name=None, lang="Chinese", model_config=None):
+        if model_config is None:
+            model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
         if llm_type == LLMType.EMBEDDING.value:
             if model_config["llm_factory"] not in EmbeddingModel:
                 return
@@ -160,6 +214,11 @@ class TenantLLMService(CommonService):
                 base_url=model_config["api_base"],
             )
 
+    @staticmethod
+    def invalidate_model_cache(tenant_id=None):
+        """Drops the cached model instances of a tenant, or of every tenant, after its model settings change."""
+        TENANT_MODEL_CACHE.invalidate(tenant_id)
+
     @classmethod
     @DB.connection_context()
     def increase_usage(cls, tenant_id, llm_type, used_tokens, llm_name=None):
@@ -208,42 +267,69 @@ class LLMBundle:
         self.tenant_id = tenant_id
         self.llm_type = llm_type
         self.llm_name = llm_name
-        self.mdl = TenantLLMService.model_instance(tenant_id, llm_type, llm_name, lang=lang)
-        assert self.mdl, "Can't find model for {}/{}/{}".format(tenant_id, llm_type, llm_name)
-        model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
+        cache_key = (tenant_id, llm_type, llm_name, lang)
+        cached = TENANT_MODEL_CACHE.get(cache_key)
+        if cached:
+            self.mdl, model_config, langfuse = cached
+        else:
+            model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
+            self.mdl = TenantLLMService.model_instance(tenant_id, llm_type, llm_name, lang=lang, model_config=model_config)
+            assert self.mdl, "Can't find model for {}/{}/{}".format(tenant_id, llm_type, llm_name)
+            langfuse = None
+            langfuse_keys = TenantLangfuseService.filter_by_tenant(tenant_id=tenant_id)
+            if langfuse_keys:
+                langfuse = Langfuse(public_key=langfuse_keys.public_key, secret_key=langfuse_keys.secret_key, host=langfuse_keys.host)
+                if not langfuse.auth_check():
+                    langfuse = None
+            TENANT_MODEL_CACHE.set(cache_key, (self.mdl, model_config, langfuse))
         self.max_length = model_config.get("max_tokens", 8192)
 
         self.is_tools = model_config.get("is_tools", False)
+        # Self-hosted factories (Ollama, LocalAI, OpenAI-API-Compatible...) can serve different models under one
+        # name: the tenant and the endpoint are part of what identifies the vectors.
+        self.cache_model_name = "{}/{}@{}#{}".format(tenant_id, model_config.get("llm_name") or llm_name,
+                                                    model_config.get("llm_factory", ""), model_config.get("api_base") or "")
 
-        langfuse_keys = TenantLangfuseService.filter_by_tenant(tenant_id=tenant_id)
-        if langfuse_keys:
-            langfuse = Langfuse(public_key=langfuse_keys.public_key, secret_key=langfuse_keys.secret_key, host=langfuse_keys.host)
-            if langfuse.auth_check():
-                self.langfuse = langfuse
-                self.trace = self.langfuse.trace(name=f"{self.llm_type}-{self.llm_name}")
-        else:
-            self.langfuse = None
+        self.langfuse = langfuse
+        if self.langfuse:
+            self.trace = self.langfuse.trace(name=f"{self.llm_type}-{self.llm_name}")
 
     def bind_tools(self, toolcall_session, tools):
         if not self.is_tools:
             logging.warning(f"Model {self.llm_name} does not support tool call, but you have assigned one or more tools to it!")
             return
+        # The model instance is shared through TENANT_MODEL_CACHE; bind tools on a copy that still shares its client.
+        self.mdl = copy.copy(self.mdl)
         self.mdl.bind_tools(toolcall_session, tools)
 
     def encode(self, texts: list):
+        cached = EMBEDDING_CACHE.get_many(self.cache_model_name, texts)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        if texts and not missing:
+            return np.stack(cached), 0
+
         if self.langfuse:
             generation = self.trace.generation(name="encode", model=self.llm_name, input={"texts": texts})
 
-        embeddings, used_tokens = self.mdl.encode(texts)
+        embeddings, used_tokens = self.mdl.encode([texts[i] for i in missing])
         if not TenantLLMService.increase_usage(self.tenant_id, self.llm_type, used_tokens):
             logging.error("LLMBundle.encode can't update token usage for {}/EMBEDDING used_tokens: {}".format(self.tenant_id, used_tokens))
 
         if self.langfuse:
             generation.end(usage_details={"total_tokens": used_tokens})
 
-        return embeddings, used_tokens
+        EMBEDDING_CACHE.set_many(self.cache_model_name, [texts[i] for i in missing], embeddings)
+        if len(missing) == len(texts):
+            return embeddings, used_tokens
+        for i, v in zip(missing, embeddings):
+            cached[i] = np.asarray(v, dtype=np.float32)
+        return np.stack(cached), used_tokens
 
     def encode_queries(self, query: str):
+        emd = EMBEDDING_CACHE.get(self.cache_model_name + "#query", query)
+        if emd is not None:
+            return emd, 0
+
         if self.langfuse:
             generation = self.trace.generation(name="encode_queries", model=self.llm_name, input={"query": query})
 
@@ -254,6 +340,7 @@ class LLMBundle:
         if self.langfuse:
             generation.end(usage_details={"total_tokens": used_tokens})
 
+        EMBEDDING_CACHE.set(self.cache_model_name + "#query", query, emd)
         return emd, used_tokens
 
     def similarity(self, query: str, texts: list):
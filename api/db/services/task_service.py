@@ -13,7 +13,6 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
-import os
 import random
 import xxhash
 from datetime import datetime
@@ -257,9 +256,9 @@ class TaskService(CommonService):
     def update_progress(cls, id, info):
         """Update the progress information for a task.
     
-        This method updates both the progress message and completion percentage of a task.
-        It handles platform-specific behavior (macOS vs others) and uses database locking
-        when necessary to ensure thread safety.
+        This method appends to the progress message and sets the completion percentage
+        of a task in a single update. Progress of a task is written by the one executor
+        that runs it, which coalesces and serializes its writes, so no database lock is taken.
     
         Args:
             id (str): The unique identifier of the task to update.
@@ -267,26 +266,14 @@ class TaskService(CommonService):
                         - progress_msg (str, optional): Progress message to append
                         - progress (float, optional): Progress percentage (0.0 to 1.0)
         """
-        if os.environ.get("MACOS"):
-            if info["progress_msg"]:
-                task = cls.model.get_by_id(id)
-                progress_msg = trim_header_by_lines(task.progress_msg + "\n" + info["progress_msg"], 3000)
-                cls.model.update(progress_msg=progress_msg).where(cls.model.id == id).execute()
-            if "progress" in info:
-                cls.model.update(progress=info["progress"]).where(
-                    cls.model.id == id
-                ).execute()
-            return
-
-        with DB.lock("update_progress", -1):
-            if info["progress_msg"]:
-                task = cls.model.get_by_id(id)
-                progress_msg = trim_header_by_lines(task.progress_msg + "\n" + info["progress_msg"], 3000)
-                cls.model.update(progress_msg=progress_msg).where(cls.model.id == id).execute()
-            if "progress" in info:
-                cls.model.update(progress=info["progress"]).where(
-                    cls.model.id == id
-                ).execute()
+        fields = {}
+        if info.get("progress_msg"):
+            task = cls.model.select(cls.model.progress_msg).where(cls.model.id == id).get()
+            fields["progress_msg"] = trim_header_by_lines(task.progress_msg + "\n" + info["progress_msg"], 3000)
+        if "progress" in info:
+            fields["progress"] = info["progress"]
+        if fields:
+            cls.model.update(**fields).where(cls.model.id == id).execute()
 
 
 def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
@@ -11,6 +11,7 @@
 #  limitations under the License.
 #
 
+import itertools
 import logging
 import sys
 from io import BytesIO
@@ -22,18 +23,23 @@ from rag.nlp import find_codec
 
 
 class RAGFlowExcelParser:
+    # Rows pandas parses at a time when streaming a CSV.
+    CSV_CHUNK_ROWS = 4096
 
     @staticmethod
-    def _load_excel_to_workbook(file_like_object):
-        if isinstance(file_like_object, bytes):
-            file_like_object = BytesIO(file_like_object)
-
+    def _is_excel(file_like_object):
         # Read first 4 bytes to determine file type
         file_like_object.seek(0)
         file_head = file_like_object.read(4)
         file_like_object.seek(0)
+        return file_head.startswith(b'PK\x03\x04') or file_head.startswith(b'\xD0\xCF\x11\xE0')
+
+    @staticmethod
+    def _load_excel_to_workbook(file_like_object):
+        if isinstance(file_like_object, bytes):
+            file_like_object = BytesIO(file_like_object)
 
-        if not (file_head.startswith(b'PK\x03\x04') or file_head.startswith(b'\xD0\xCF\x11\xE0')):
+        if not RAGFlowExcelParser._is_excel(file_like_object):
             logging.info("****wxy: Not an Excel file, converting CSV to Excel Workbook")
 
             try:
@@ -60,68 +66,140 @@ class RAGFlowExcelParser:
         wb = Workbook()
         ws = wb.active
         ws.title = "Data"
+        ws.append(list(df.columns))
+        for row in df.itertuples(index=False, name=None):
+            ws.append(row)
+        return wb
 
-        for col_num, column_name in enumerate(df.columns, 1):
-            ws.cell(row=1, column=col_num, value=column_name)
+    @staticmethod
+    def _worksheet_rows(ws):
+        """
+        Cell values of a read-only worksheet, row by row. Rows shorter than the
+        header are padded with None the way a fully loaded worksheet pads them.
+        """
+        # The dimensions written by some producers are wrong and would cut rows off.
+        ws.reset_dimensions()
+        width = 0
+        for i, row in enumerate(ws.iter_rows(values_only=True)):
+            if i == 0:
+                width = len(row)
+            elif len(row) < width:
+                row = row + (None,) * (width - len(row))
+            yield row
 
-        for row_num, row in enumerate(df.values, 2):
-            for col_num, value in enumerate(row, 1):
-                ws.cell(row=row_num, column=col_num, value=value)
+    @staticmethod
+    def _window(rows, counter, from_row, to_row):
+        for row in rows:
+            counter[0] += 1
+            if counter[0] - 1 < from_row:
+                continue
+            if to_row is not None and counter[0] - 1 >= to_row:
+                break
+            yield row
 
-        return wb
+    @staticmethod
+    def _iter_sheets(file_like_object, from_row=0, to_row=None):
+        """
+        Streams (sheetname, header, rows) for every sheet without loading the workbook.
+        rows iterates the data rows, header excluded, whose index counted across all
+        sheets falls in [from_row, to_row); consume it before advancing to the next sheet.
+        Excel files are read with openpyxl in read-only mode and CSV files in chunks
+        with pandas, which also skips the rows before from_row without parsing them.
+        """
+        if isinstance(file_like_object, bytes):
+            file_like_object = BytesIO(file_like_object)
+
+        if not RAGFlowExcelParser._is_excel(file_like_object):
+            try:
+                reader = pd.read_csv(file_like_object, skiprows=range(1, from_row + 1),
+                                     nrows=None if to_row is None else max(to_row - from_row, 0),
+                                     chunksize=RAGFlowExcelParser.CSV_CHUNK_ROWS)
+                chunk = next(reader, None)
+            except Exception as e_csv:
+                raise Exception(f"****wxy: Failed to parse CSV: {e_csv}")
+            if chunk is None:
+                return
+
+            def csv_rows(chunk):
+                while chunk is not None:
+                    yield from chunk.itertuples(index=False, name=None)
+                    chunk = next(reader, None)
+
+            yield "Data", tuple(chunk.columns), csv_rows(chunk)
+            return
+
+        counter = [0]
+        try:
+            wb = load_workbook(file_like_object, read_only=True, data_only=True)
+        except Exception as e:
+            logging.info(f"****wxy: openpyxl load error: {e}, try pandas instead")
+            try:
+                file_like_object.seek(0)
+                df = pd.read_excel(file_like_object)
+            except Exception as e_pandas:
+                raise Exception(f"****wxy: pandas.read_excel error: {e_pandas}, original openpyxl error: {e}")
+            yield "Data", tuple(df.columns), RAGFlowExcelParser._window(
+                df.itertuples(index=False, name=None), counter, from_row, to_row)
+            return
+
+        try:
+            for ws in wb.worksheets:
+                if to_row is not None and counter[0] >= to_row:
+                    break
+                rows = RAGFlowExcelParser._worksheet_rows(ws)
+                header = next(rows, None)
+                if header is None:
+                    continue
+                yield ws.title, header, RAGFlowExcelParser._window(rows, counter, from_row, to_row)
+        finally:
+            wb.close()
 
     def html(self, fnm, chunk_rows=256):
         file_like_object = BytesIO(fnm) if not isinstance(fnm, str) else fnm
-        wb = RAGFlowExcelParser._load_excel_to_workbook(file_like_object)
         tb_chunks = []
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
-                continue
-
+        for sheetname, header, rows in RAGFlowExcelParser._iter_sheets(file_like_object):
             tb_rows_0 = "<tr>"
-            for t in list(rows[0]):
-                tb_rows_0 += f"<th>{t.value}</th>"
+            for t in header:
+                tb_rows_0 += f"<th>{t}</th>"
             tb_rows_0 += "</tr>"
 
-            for chunk_i in range((len(rows) - 1) // chunk_rows + 1):
+            rows = iter(rows)
+            first = True
+            while True:
+                chunk = list(itertools.islice(rows, chunk_rows))
+                if not chunk and not first:
+                    break
+                first = False
                 tb = ""
                 tb += f"<table><caption>{sheetname}</caption>"
                 tb += tb_rows_0
-                for r in list(
-                    rows[1 + chunk_i * chunk_rows: 1 + (chunk_i + 1) * chunk_rows]
-                ):
+                for r in chunk:
                     tb += "<tr>"
-                    for i, c in enumerate(r):
-                        if c.value is None:
+                    for v in r:
+                        if v is None:
                             tb += "<td></td>"
                         else:
-                            tb += f"<td>{c.value}</td>"
+                            tb += f"<td>{v}</td>"
                     tb += "</tr>"
                 tb += "</table>\n"
                 tb_chunks.append(tb)
+                if len(chunk) < chunk_rows:
+                    break
 
         return tb_chunks
 
     def __call__(self, fnm):
         file_like_object = BytesIO(fnm) if not isinstance(fnm, str) else fnm
-        wb = RAGFlowExcelParser._load_excel_to_workbook(file_like_object)
 
         res = []
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
-                continue
-            ti = list(rows[0])
-            for r in list(rows[1:]):
+        for sheetname, ti, rows in RAGFlowExcelParser._iter_sheets(file_like_object):
+            for r in rows:
                 fields = []
-                for i, c in enumerate(r):
-                    if not c.value:
+                for i, v in enumerate(r):
+                    if not v:
                         continue
-                    t = str(ti[i].value) if i < len(ti) else ""
-                    t += ("：" if t else "") + str(c.value)
+                    t = str(ti[i]) if i < len(ti) else ""
+                    t += ("：" if t else "") + str(v)
                     fields.append(t)
                 line = "; ".join(fields)
                 if sheetname.lower().find("sheet") < 0:
@@ -131,18 +209,26 @@ class RAGFlowExcelParser:
 
     @staticmethod
     def row_number(fnm, binary):
-        if fnm.split(".")[-1].lower().find("xls") >= 0:
-            wb = RAGFlowExcelParser._load_excel_to_workbook(BytesIO(binary))
-            total = 0
-            for sheetname in wb.sheetnames:
-                ws = wb[sheetname]
-                total += len(list(ws.rows))
-            return total
-
-        if fnm.split(".")[-1].lower() in ["csv", "txt"]:
+        ext = fnm.split(".")[-1].lower()
+        if ext.find("xls") >= 0 and RAGFlowExcelParser._is_excel(BytesIO(binary)):
+            try:
+                wb = load_workbook(BytesIO(binary), read_only=True, data_only=True)
+            except Exception as e:
+                logging.info(f"****wxy: openpyxl load error: {e}, try pandas instead")
+                return len(pd.read_excel(BytesIO(binary))) + 1
+            try:
+                total = 0
+                for ws in wb.worksheets:
+                    ws.reset_dimensions()
+                    total += sum(1 for _ in ws.iter_rows(values_only=True))
+                return total
+            finally:
+                wb.close()
+
+        if ext.find("xls") >= 0 or ext in ["csv", "txt"]:
             encoding = find_codec(binary)
             txt = binary.decode(encoding, errors="ignore")
-            return len(txt.split("\n"))
+            return txt.count("\n") + 1
 
 
 if __name__ == "__main__":
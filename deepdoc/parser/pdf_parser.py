@@ -20,6 +20,7 @@ import random
 import re
 import sys
 import threading
+from collections import OrderedDict
 from copy import deepcopy
 from io import BytesIO
 from timeit import default_timer as timer
@@ -34,7 +35,9 @@ from pypdf import PdfReader as pdf2_read
 
 from api import settings
 from api.utils.file_utils import get_project_base_directory
-from deepdoc.vision import OCR, LayoutRecognizer, Recognizer, TableStructureRecognizer
+from deepdoc.vision import OCR, LayoutRecognizer, Recognizer, SpatialIndex, TableStructureRecognizer
+from deepdoc.vision.boxes import Boxes
+from deepdoc.vision.ocr import ONNX_INTRA_OP_THREADS
 from rag.app.picture import vision_llm_chunk as picture_vision_llm_chunk
 from rag.nlp import rag_tokenizer
 from rag.prompts import vision_llm_describe_prompt
@@ -44,6 +47,75 @@ LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
 if LOCK_KEY_pdfplumber not in sys.modules:
     sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
 
+# Pages rendered ahead of OCR, and decoded page images kept in memory. 0 keeps every page decoded.
+PDF_RENDER_AHEAD = int(os.environ.get("PDF_RENDER_AHEAD", 2))
+PDF_PAGE_IMAGE_WINDOW = int(os.environ.get("PDF_PAGE_IMAGE_WINDOW", 4))
+
+# Threads per OCR stage (text detection, text recognition) without parallel devices. The stages
+# are pipelined, so page i+1 is detected while page i is recognized.
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", max(1, (os.cpu_count() or 2) // (2 * ONNX_INTRA_OP_THREADS))))
+# Shared by every parse running on the task executor's event loop, so they bound the whole process.
+OCR_LIMITERS = (trio.CapacityLimiter(OCR_WORKERS), trio.CapacityLimiter(OCR_WORKERS))
+
+
+def in_trio_thread():
+    """Whether the caller is a worker thread started by trio.to_thread, i.e. can use trio.from_thread."""
+    try:
+        trio.from_thread.check_cancelled()
+        return True
+    except RuntimeError:
+        return False
+
+
+class PageImages:
+    """
+    List-like holder of rendered page images.
+
+    Pages are stored PNG-compressed (lossless) and only the `window` most recently
+    used ones stay decoded, so memory stays flat no matter how many pages a task covers.
+    """
+
+    def __init__(self, window=PDF_PAGE_IMAGE_WINDOW):
+        self.window = window
+        self._pages = []
+        self._decoded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def append(self, img):
+        if self.window <= 0:
+            self._pages.append(img)
+            return
+        buf = BytesIO()
+        img.save(buf, format="PNG", compress_level=1)
+        self._pages.append(buf.getvalue())
+
+    def _get(self, i):
+        if self.window <= 0:
+            return self._pages[i]
+        with self._lock:
+            img = self._decoded.get(i)
+            if img is not None:
+                self._decoded.move_to_end(i)
+                return img
+            # decoding is deferred by PIL until pixels are needed, so .size stays cheap
+            img = Image.open(BytesIO(self._pages[i]))
+            self._decoded[i] = img
+            while len(self._decoded) > self.window:
+                self._decoded.popitem(last=False)
+            return img
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._get(j) for j in range(len(self._pages))[i]]
+        return self._get(range(len(self._pages))[i])
+
+    def __len__(self):
+        return len(self._pages)
+
+    def __iter__(self):
+        for i in range(len(self._pages)):
+            yield self._get(i)
+
 
 class RAGFlowPdfParser:
     def __init__(self, **kwargs):
@@ -207,16 +279,16 @@ class RAGFlowPdfParser:
         imgs, pos = [], []
         tbcnt = [0]
         MARGIN = 10
-        self.tb_cpns = []
+        self.tb_cpns = Boxes.empty(self.tbl_det.labels)
         assert len(self.page_layout) == len(self.page_images)
-        for p, tbls in enumerate(self.page_layout):  # for page
-            tbls = [f for f in tbls if f["type"] == "table"]
+        for p, lts in enumerate(self.page_layout):  # for page
+            tbls = lts.take(lts.is_type("table"))
             tbcnt.append(len(tbls))
-            if not tbls:
+            if not len(tbls):
                 continue
-            for tb in tbls:  # for table
-                left, top, right, bott = tb["x0"] - MARGIN, tb["top"] - MARGIN, \
-                    tb["x1"] + MARGIN, tb["bottom"] + MARGIN
+            for x0, x1, tp, btm in zip(tbls.x0.tolist(), tbls.x1.tolist(), tbls.top.tolist(), tbls.bottom.tolist()):  # for table
+                left, top, right, bott = x0 - MARGIN, tp - MARGIN, \
+                    x1 + MARGIN, btm + MARGIN
                 left *= ZM
                 top *= ZM
                 right *= ZM
@@ -227,81 +299,79 @@ class RAGFlowPdfParser:
         assert len(self.page_images) == len(tbcnt) - 1
         if not imgs:
             return
-        recos = self.tbl_det(imgs)
+        recos = self.tbl_det.components(imgs)
         tbcnt = np.cumsum(tbcnt)
+        pgs = []
         for i in range(len(tbcnt) - 1):  # for page
-            pg = []
-            for j, tb_items in enumerate(
+            poss = pos[tbcnt[i]: tbcnt[i + 1]]
+            for j, tb in enumerate(
                     recos[tbcnt[i]: tbcnt[i + 1]]):  # for table
-                poss = pos[tbcnt[i]: tbcnt[i + 1]]
-                for it in tb_items:  # for table components
-                    it["x0"] = (it["x0"] + poss[j][0])
-                    it["x1"] = (it["x1"] + poss[j][0])
-                    it["top"] = (it["top"] + poss[j][1])
-                    it["bottom"] = (it["bottom"] + poss[j][1])
-                    for n in ["x0", "x1", "top", "bottom"]:
-                        it[n] /= ZM
-                    it["top"] += self.page_cum_height[i]
-                    it["bottom"] += self.page_cum_height[i]
-                    it["pn"] = i
-                    it["layoutno"] = j
-                    pg.append(it)
-            self.tb_cpns.extend(pg)
+                ht = self.page_cum_height[i]
+                pgs.append(tb.with_coords((tb.x0 + poss[j][0]) / ZM, (tb.x1 + poss[j][0]) / ZM,
+                                          (tb.top + poss[j][1]) / ZM + ht, (tb.bottom + poss[j][1]) / ZM + ht,
+                                          page=i, layoutno=j))
+        self.tb_cpns = Boxes.concat(pgs, self.tbl_det.labels)
 
         def gather(kwd, fzy=10, ption=0.6):
-            eles = Recognizer.sort_Y_firstly(
-                [r for r in self.tb_cpns if re.match(kwd, r["label"])], fzy)
-            eles = Recognizer.layouts_cleanup(self.boxes, eles, 5, ption)
-            return Recognizer.sort_Y_firstly(eles, 0)
+            eles = self.tb_cpns.take(self.tb_cpns.match(kwd))
+            eles = eles.take(eles.sort_y_firstly(fzy))
+            # table components carry no "type" to tell them apart, so all are compared
+            eles = eles.take(eles.cleanup(self.boxes, 5, ption, same_type=False))
+            return eles.take(eles.sort_y_firstly(0))
 
         # add R,H,C,SP tag to boxes within table layout
         headers = gather(r".*header$")
         rows = gather(r".* (row|header)")
         spans = gather(r".*spanning")
-        clmns = sorted([r for r in self.tb_cpns if re.match(
-            r"table column$", r["label"])], key=lambda x: (x["pn"], x["layoutno"], x["x0"]))
-        clmns = Recognizer.layouts_cleanup(self.boxes, clmns, 5, 0.5)
-        for b in self.boxes:
-            if b.get("layout_type", "") != "table":
-                continue
-            ii = Recognizer.find_overlapped_with_threashold(b, rows, thr=0.3)
+        clmns = self.tb_cpns.take(self.tb_cpns.match(r"table column$"))
+        clmns = clmns.take(np.lexsort((clmns.x0, clmns.layoutno, clmns.page)))
+        clmns = clmns.take(clmns.cleanup(self.boxes, 5, 0.5, same_type=False))
+        tbl_boxes = [b for b in self.boxes if b.get("layout_type", "") == "table"]
+        row_ii = SpatialIndex(rows).find_overlapped_with_threashold_many(tbl_boxes, thr=0.3)
+        header_ii = SpatialIndex(headers).find_overlapped_with_threashold_many(tbl_boxes, thr=0.3)
+        clmn_ii = SpatialIndex(clmns).find_horizontally_tightest_fit_many(tbl_boxes)
+        span_ii = SpatialIndex(spans).find_overlapped_with_threashold_many(tbl_boxes, thr=0.3)
+        for b, r_i, h_i, c_i, sp_i in zip(tbl_boxes, row_ii, header_ii, clmn_ii, span_ii):
+            ii = r_i
             if ii is not None:
                 b["R"] = ii
-                b["R_top"] = rows[ii]["top"]
-                b["R_bott"] = rows[ii]["bottom"]
+                b["R_top"] = float(rows.top[ii])
+                b["R_bott"] = float(rows.bottom[ii])
 
-            ii = Recognizer.find_overlapped_with_threashold(
-                b, headers, thr=0.3)
+            ii = h_i
             if ii is not None:
-                b["H_top"] = headers[ii]["top"]
-                b["H_bott"] = headers[ii]["bottom"]
-                b["H_left"] = headers[ii]["x0"]
-                b["H_right"] = headers[ii]["x1"]
+                b["H_top"] = float(headers.top[ii])
+                b["H_bott"] = float(headers.bottom[ii])
+                b["H_left"] = float(headers.x0[ii])
+                b["H_right"] = float(headers.x1[ii])
                 b["H"] = ii
 
-            ii = Recognizer.find_horizontally_tightest_fit(b, clmns)
+            ii = c_i
             if ii is not None:
                 b["C"] = ii
-                b["C_left"] = clmns[ii]["x0"]
-                b["C_right"] = clmns[ii]["x1"]
+                b["C_left"] = float(clmns.x0[ii])
+                b["C_right"] = float(clmns.x1[ii])
 
-            ii = Recognizer.find_overlapped_with_threashold(b, spans, thr=0.3)
+            ii = sp_i
             if ii is not None:
-                b["H_top"] = spans[ii]["top"]
-                b["H_bott"] = spans[ii]["bottom"]
-                b["H_left"] = spans[ii]["x0"]
-                b["H_right"] = spans[ii]["x1"]
+                b["H_top"] = float(spans.top[ii])
+                b["H_bott"] = float(spans.bottom[ii])
+                b["H_left"] = float(spans.x0[ii])
+                b["H_right"] = float(spans.x1[ii])
                 b["SP"] = ii
 
     def __ocr(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
+        bxs = self.__ocr_detect(pagenum, img, chars, ZM, device_id)
+        self.__ocr_recognize(pagenum, bxs, device_id)
+
+    def __ocr_detect(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
         start = timer()
         bxs = self.ocr.detect(np.array(img), device_id)
         logging.info(f"__ocr detecting boxes of a image cost ({timer() - start}s)")
 
         start = timer()
         if not bxs:
-            self.boxes.append([])
-            return
+            return []
         bxs = [(line[0], line[1][0]) for line in bxs]
         bxs = Recognizer.sort_Y_firstly(
             [{"x0": b[0][0] / ZM, "x1": b[1][0] / ZM,
@@ -313,8 +383,7 @@ class RAGFlowPdfParser:
         )
 
         # merge chars in the same rect
-        for c in chars:
-            ii = Recognizer.find_overlapped(c, bxs)
+        for c, ii in zip(chars, SpatialIndex(bxs).find_overlapped_many(chars)):
             if ii is None:
                 self.lefted_chars.append(c)
                 continue
@@ -349,7 +418,16 @@ class RAGFlowPdfParser:
                 b["box_image"] = self.ocr.get_rotate_crop_image(img_np, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))
                 boxes_to_reg.append(b)
             del b["txt"]
-        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
+        logging.info(f"__ocr cropping {len(boxes_to_reg)} boxes cost {timer() - start}s")
+        return bxs
+
+    def __ocr_recognize(self, pagenum, bxs, device_id: int | None = None):
+        if not bxs:
+            self.boxes[pagenum - 1] = []
+            return
+        start = timer()
+        boxes_to_reg = [b for b in bxs if "box_image" in b]
+        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id) if boxes_to_reg else []
         for i in range(len(boxes_to_reg)):
             boxes_to_reg[i]["text"] = texts[i]
             del boxes_to_reg[i]["box_image"]
@@ -358,7 +436,7 @@ class RAGFlowPdfParser:
         if self.mean_height[pagenum-1] == 0:
             self.mean_height[pagenum-1] = np.median([b["bottom"] - b["top"]
                                               for b in bxs])
-        self.boxes.append(bxs)
+        self.boxes[pagenum - 1] = bxs
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
@@ -788,10 +866,10 @@ class RAGFlowPdfParser:
                     "x1": np.max([b["x1"] for b in bxs]),
                     "bottom": np.max([b["bottom"] for b in bxs]) - ht
                 }
-                louts = [layout for layout in self.page_layout[pn] if layout["type"] == ltype]
-                ii = Recognizer.find_overlapped(b, louts, naive=True)
+                louts = self.page_layout[pn].take(self.page_layout[pn].is_type(ltype))
+                ii = SpatialIndex(louts).find_overlapped(b, naive=True)
                 if ii is not None:
-                    b = louts[ii]
+                    b = louts.record(ii)
                 else:
                     logging.warning(
                         f"Missing layout match: {pn + 1},%s" %
@@ -1010,25 +1088,27 @@ class RAGFlowPdfParser:
         self.page_cum_height = [0]
         self.page_layout = []
         self.page_from = page_from
+        self.page_images = PageImages()
+        self.page_chars = []
+        plumber_pdf = None
         start = timer()
         try:
+            # Only characters are extracted up front; pages are rendered one by one as OCR consumes them.
             with sys.modules[LOCK_KEY_pdfplumber]:
-                with (pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))) as pdf:
-                    self.pdf = pdf
-                    self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in
-                                        enumerate(self.pdf.pages[page_from:page_to])]
-
-                    try:
-                        self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
-                    except Exception as e:
-                        logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
-                        self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
+                plumber_pdf = pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))
+                pages = plumber_pdf.pages[page_from:page_to]
+                try:
+                    self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in pages]
+                except Exception as e:
+                    logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
+                    self.page_chars = [[] for _ in range(len(pages))]  # If failed to extract, using empty list instead.
 
-                    self.total_page = len(self.pdf.pages)
+                self.total_page = len(plumber_pdf.pages)
 
         except Exception:
             logging.exception("RAGFlowPdfParser __images__")
         logging.info(f"__images__ dedupe_chars cost {timer() - start}s")
+        page_num = len(self.page_chars)
 
         self.outlines = []
         try:
@@ -1056,13 +1136,12 @@ class RAGFlowPdfParser:
         self.is_english = [re.search(r"[a-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join(
             random.choices([c["text"] for c in self.page_chars[i]], k=min(100, len(self.page_chars[i]))))) for i in
             range(len(self.page_chars))]
-        if sum([1 if e else 0 for e in self.is_english]) > len(
-                self.page_images) / 2:
+        if sum([1 if e else 0 for e in self.is_english]) > page_num / 2:
             self.is_english = True
         else:
             self.is_english = False
 
-        async def __img_ocr(i, id, img, chars, limiter):
+        async def __img_ocr(i, id, img, chars, limiter, ocr_limiters):
             j = 0
             while j + 1 < len(chars):
                 if chars[j]["text"] and chars[j + 1]["text"] \
@@ -1076,13 +1155,20 @@ class RAGFlowPdfParser:
                 async with limiter:
                     await trio.to_thread.run_sync(lambda: self.__ocr(i + 1, img, chars, zoomin, id))
             else:
-                self.__ocr(i + 1, img, chars, zoomin, id)
+                detect_limiter, recognize_limiter = ocr_limiters
+                bxs = await trio.to_thread.run_sync(lambda: self.__ocr_detect(i + 1, img, chars, zoomin, id),
+                                                    limiter=detect_limiter)
+                await trio.to_thread.run_sync(lambda: self.__ocr_recognize(i + 1, bxs, id), limiter=recognize_limiter)
 
             if callback and i % 6 == 5:
-                callback(prog=(i + 1) * 0.6 / len(self.page_images), msg="")
+                await trio.to_thread.run_sync(lambda: callback(prog=(i + 1) * 0.6 / page_num, msg=""))
 
-        async def __img_ocr_launcher():
-            def __ocr_preprocess():
+        def __render(i):
+            with sys.modules[LOCK_KEY_pdfplumber]:
+                return plumber_pdf.pages[page_from + i].to_image(resolution=72 * zoomin, antialias=True).annotated
+
+        async def __img_ocr_launcher(ocr_limiters):
+            def __ocr_preprocess(i, img):
                 chars = self.page_chars[i] if not self.is_english else []
                 self.mean_height.append(
                     np.median(sorted([c["height"] for c in chars])) if chars else 0
@@ -1091,24 +1177,54 @@ class RAGFlowPdfParser:
                     np.median(sorted([c["width"] for c in chars])) if chars else 8
                 )
                 self.page_cum_height.append(img.size[1] / zoomin)
+                # Pages finish out of order, each one fills its own slot.
+                self.boxes.append([])
                 return chars
 
-            if self.parallel_limiter:
-                async with trio.open_nursery() as nursery:
-                    for i, img in enumerate(self.page_images):
-                        chars = __ocr_preprocess()
-
-                        nursery.start_soon(__img_ocr, i, i % PARALLEL_DEVICES, img, chars,
-                                           self.parallel_limiter[i % PARALLEL_DEVICES])
-                        await trio.sleep(0.1)
-            else:
-                for i, img in enumerate(self.page_images):
-                    chars = __ocr_preprocess()
-                    await __img_ocr(i, 0, img, chars, None)
+            # The bounded channel applies back-pressure: rendering stays at most
+            # PDF_RENDER_AHEAD pages ahead of OCR.
+            send_channel, receive_channel = trio.open_memory_channel(PDF_RENDER_AHEAD)
+            # Enough pages in flight to keep both OCR stages busy.
+            in_flight = trio.Semaphore(2 * ocr_limiters[0].total_tokens)
+
+            async def __renderer():
+                async with send_channel:
+                    for i in range(page_num):
+                        img = await trio.to_thread.run_sync(lambda: __render(i))
+                        await send_channel.send((i, img))
+
+            async def __page_ocr(i, img, chars):
+                try:
+                    await __img_ocr(i, 0, img, chars, None, ocr_limiters)
+                finally:
+                    in_flight.release()
+
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(__renderer)
+                async with receive_channel:
+                    async for i, img in receive_channel:
+                        chars = __ocr_preprocess(i, img)
+                        await trio.to_thread.run_sync(lambda: self.page_images.append(img))
+                        if self.parallel_limiter:
+                            nursery.start_soon(__img_ocr, i, i % PARALLEL_DEVICES, img, chars,
+                                               self.parallel_limiter[i % PARALLEL_DEVICES], None)
+                        else:
+                            await in_flight.acquire()
+                            nursery.start_soon(__page_ocr, i, img, chars)
 
         start = timer()
 
-        trio.run(__img_ocr_launcher)
+        try:
+            if plumber_pdf is not None:
+                if in_trio_thread():
+                    # Called by the task executor through trio.to_thread: schedule on its event loop
+                    # and share its OCR workers with the other tasks.
+                    trio.from_thread.run(__img_ocr_launcher, OCR_LIMITERS)
+                else:
+                    trio.run(__img_ocr_launcher, (trio.CapacityLimiter(OCR_WORKERS), trio.CapacityLimiter(OCR_WORKERS)))
+        finally:
+            if plumber_pdf is not None:
+                plumber_pdf.close()
 
         logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s")
 
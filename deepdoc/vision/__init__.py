@@ -20,6 +20,7 @@ import pdfplumber
 
 from .ocr import OCR
 from .recognizer import Recognizer
+from .spatial_index import SpatialIndex
 from .layout_recognizer import LayoutRecognizer4YOLOv10 as LayoutRecognizer
 from .table_structure_recognizer import TableStructureRecognizer
 
@@ -80,6 +81,7 @@ def init_in_out(args):
 __all__ = [
     "OCR",
     "Recognizer",
+    "SpatialIndex",
     "LayoutRecognizer",
     "TableStructureRecognizer",
     "init_in_out",
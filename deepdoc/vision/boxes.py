@@ -0,0 +1,221 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import re
+from functools import cmp_to_key
+
+import numpy as np
+
+
+class Boxes:
+    """
+    Detection boxes as a structure of arrays: one numpy column each for x0, x1, top, bottom,
+    score, class (an index into labels), page and layoutno, instead of one dict per box.
+
+    Recognizer detections stay in this form through NMS, layout cleanup, the table structure
+    alignment and the overlap queries of SpatialIndex; dicts are only built where boxes become
+    text boxes for the chunkers. Every method returns new boxes or indices and leaves the boxes
+    it is called on untouched.
+    """
+
+    def __init__(self, x0, x1, top, bottom, score, cls, labels, page=None, layoutno=None):
+        n = len(x0)
+        self.x0, self.x1, self.top, self.bottom = np.asarray(x0), np.asarray(x1), np.asarray(top), np.asarray(bottom)
+        self.score = np.asarray(score)
+        self.cls = np.asarray(cls, dtype=np.int64).reshape(n)
+        self.labels = list(labels)
+        # a page or layoutno given as a number applies to every box
+        self.page = np.array(np.broadcast_to(np.asarray(0 if page is None else page, dtype=np.int64), n))
+        self.layoutno = np.array(np.broadcast_to(np.asarray(0 if layoutno is None else layoutno, dtype=np.int64), n))
+        self._types = None
+
+    @classmethod
+    def empty(cls, labels):
+        return cls([], [], [], [], [], [], labels)
+
+    @classmethod
+    def from_xyxy(cls, xyxy, score, class_ids, labels):
+        """Boxes from an (n, 4) array of x0, top, x1, bottom, keeping its dtype."""
+        xyxy = np.asarray(xyxy).reshape(-1, 4)
+        return cls(xyxy[:, 0], xyxy[:, 2], xyxy[:, 1], xyxy[:, 3], score, class_ids, labels)
+
+    @classmethod
+    def from_records(cls, records, labels):
+        """Boxes from Recognizer.__call__ records ({"type", "bbox", "score"}), as DLAClient.predict returns them."""
+        labels = list(labels)
+        index = {lb.lower(): i for i, lb in reversed(list(enumerate(labels)))}
+        for r in records:
+            if r["type"] not in index:
+                index[r["type"]] = len(labels)
+                labels.append(r["type"])
+        xyxy = np.array([r["bbox"] for r in records], dtype=np.float64).reshape(-1, 4)
+        return cls.from_xyxy(xyxy, np.array([float(r["score"]) for r in records]),
+                             [index[r["type"]] for r in records], labels)
+
+    @classmethod
+    def concat(cls, boxes, labels):
+        if not boxes:
+            return cls.empty(labels)
+        return cls(*[np.concatenate([getattr(b, c) for b in boxes]) for c in ["x0", "x1", "top", "bottom", "score", "cls"]],
+                   labels, np.concatenate([b.page for b in boxes]), np.concatenate([b.layoutno for b in boxes]))
+
+    def __len__(self):
+        return len(self.x0)
+
+    def take(self, idx):
+        """The boxes at idx, an index array or a boolean mask, in its order."""
+        return Boxes(self.x0[idx], self.x1[idx], self.top[idx], self.bottom[idx], self.score[idx], self.cls[idx],
+                     self.labels, self.page[idx], self.layoutno[idx])
+
+    def with_coords(self, x0, x1, top, bottom, page=None, layoutno=None):
+        """The same boxes at new coordinates, optionally moved to another page or layout."""
+        return Boxes(x0, x1, top, bottom, self.score, self.cls, self.labels,
+                     self.page if page is None else page, self.layoutno if layoutno is None else layoutno)
+
+    def astype(self, dtype):
+        """The boxes with coordinates and scores cast to dtype."""
+        return Boxes(self.x0.astype(dtype), self.x1.astype(dtype), self.top.astype(dtype), self.bottom.astype(dtype),
+                     self.score.astype(dtype), self.cls, self.labels, self.page, self.layoutno)
+
+    @property
+    def types(self):
+        """The lowercased label of every box."""
+        if self._types is None:
+            names = np.array([lb.lower() for lb in self.labels] or [""], dtype=object)
+            self._types = names[self.cls]
+        return self._types
+
+    @property
+    def area(self):
+        return (self.x1 - self.x0) * (self.bottom - self.top)
+
+    def is_type(self, *types):
+        return np.isin(self.types, list(types))
+
+    def match(self, pattern):
+        """Whether the type of each box matches the regular expression pattern, as re.match does."""
+        return np.array([bool(re.match(pattern, t)) for t in self.types], dtype=bool)
+
+    def iou(self, plus_one=False):
+        """
+        IoU between every two boxes. With plus_one, widths and heights of intersections count
+        one more pixel while areas don't, as operators.nms computes them.
+        """
+        one = 1 if plus_one else 0
+        w = np.maximum(0, np.minimum(self.x1[:, None], self.x1) - np.maximum(self.x0[:, None], self.x0) + one)
+        h = np.maximum(0, np.minimum(self.bottom[:, None], self.bottom) - np.maximum(self.top[:, None], self.top) + one)
+        inter = w * h
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return inter / (self.area[:, None] + self.area - inter)
+
+    def nms(self, iou_thr, plus_one=False, keep_equal=False):
+        """
+        Greedy non-maximum suppression over one IoU matrix per class. Returns the indices kept,
+        class by class in ascending class order, each by descending score, which is the order
+        the per-class loops of Recognizer produced. A box is suppressed by a kept box of its class
+        at IoU >= iou_thr, or > iou_thr with keep_equal; an undefined IoU always suppresses.
+        """
+        keep = []
+        for c in np.unique(self.cls):
+            idx = np.flatnonzero(self.cls == c)
+            order = idx[np.argsort(self.score[idx])[::-1]]
+            iou = self.take(order).iou(plus_one)
+            with np.errstate(invalid="ignore"):
+                sup = ~(iou <= iou_thr) if keep_equal else ~(iou < iou_thr)
+            alive = np.ones(len(order), dtype=bool)
+            for k in range(len(order)):
+                if alive[k]:
+                    keep.append(order[k])
+                    alive[k + 1:] &= ~sup[k, k + 1:]
+        return np.array(keep, dtype=np.int64)
+
+    def sort_y_firstly(self, threshold):
+        """The permutation Recognizer.sort_Y_firstly applies to the same boxes."""
+        top, x0 = self.top.tolist(), self.x0.tolist()
+
+        def cmp(i, j):
+            diff = top[i] - top[j]
+            if abs(diff) < threshold:
+                diff = x0[i] - x0[j]
+            return diff
+        return np.array(sorted(range(len(self)), key=cmp_to_key(cmp)), dtype=np.int64)
+
+    def cleanup(self, text_boxes, far=2, thr=0.7, same_type=True):
+        """
+        Recognizer.layouts_cleanup over these boxes, taken as sorted by Y. Returns the indices kept.
+        Of two neighbours, less than far apart, overlapping by thr or more, the one with the lower score
+        goes, or without scores the one covering less of text_boxes. With same_type, only boxes of the
+        same type are compared.
+        """
+        from .spatial_index import SpatialIndex
+
+        # neighbours only, so pairs are compared as they come rather than as matrices
+        x0, x1, top, bottom = self.x0.tolist(), self.x1.tolist(), self.top.tolist(), self.bottom.tolist()
+        types = self.types.tolist() if same_type else [""] * len(self)
+        score = self.score.tolist()
+
+        def touching(a, b):
+            return not (x1[a] < x0[b] or x0[a] > x1[b] or bottom[a] < top[b] or top[a] > bottom[b])
+
+        def overlapped_area(a, b):
+            if x1[a] - x0[a] == 0 or bottom[a] - top[a] == 0:
+                return 0
+            ov = (min(bottom[b], bottom[a]) - max(top[b], top[a])) * (min(x1[b], x1[a]) - max(x0[b], x0[a]))
+            return ov / ((x1[a] - x0[a]) * (bottom[a] - top[a])) if ov > 0 else ov
+
+        alive = list(range(len(self)))
+        i, index = 0, None
+        while i + 1 < len(alive):
+            a = alive[i]
+            j = i + 1
+            while j < min(i + far, len(alive)) and (types[a] != types[alive[j]] or not touching(a, alive[j])):
+                j += 1
+            if j >= min(i + far, len(alive)):
+                i += 1
+                continue
+            b = alive[j]
+            if overlapped_area(a, b) < thr and overlapped_area(b, a) < thr:
+                i += 1
+                continue
+
+            if score[a] and score[b]:
+                alive.pop(j if score[a] > score[b] else i)
+                continue
+
+            if index is None:
+                index = SpatialIndex(text_boxes)
+            area_a = index.overlapped_area_sum(self.record(a))
+            area_b = index.overlapped_area_sum(self.record(b))
+            alive.pop(j if area_a > area_b else i)
+        return np.array(alive, dtype=np.int64)
+
+    def record(self, i):
+        """Box i as a dict of its coordinates, score and type."""
+        return {"type": self.types[i], "score": float(self.score[i]),
+                "x0": float(self.x0[i]), "x1": float(self.x1[i]),
+                "top": float(self.top[i]), "bottom": float(self.bottom[i])}
+
+    def to_dicts(self, type_key="type"):
+        """The boxes as dicts of their type, score and coordinates, the type keyed by type_key."""
+        return [{type_key: t, "score": s, "x0": x0, "x1": x1, "top": top, "bottom": bottom}
+                for t, s, x0, x1, top, bottom in zip(self.types.tolist(), self.score.tolist(), self.x0.tolist(),
+                                                     self.x1.tolist(), self.top.tolist(), self.bottom.tolist())]
+
+    def to_records(self):
+        """The boxes in the format of Recognizer.__call__: {"type", "bbox", "score"}."""
+        xyxy = np.stack([self.x0, self.top, self.x1, self.bottom], axis=1).tolist()
+        return [{"type": t, "bbox": [float(v) for v in bb], "score": float(s)}
+                for t, bb, s in zip(self.types.tolist(), xyxy, self.score.tolist())]
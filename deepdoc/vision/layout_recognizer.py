@@ -17,15 +17,14 @@
 import os
 import re
 from collections import Counter
-from copy import deepcopy
 
 import cv2
 import numpy as np
 from huggingface_hub import snapshot_download
 
 from api.utils.file_utils import get_project_base_directory
-from deepdoc.vision import Recognizer
-from deepdoc.vision.operators import nms
+from deepdoc.vision import Recognizer, SpatialIndex
+from deepdoc.vision.boxes import Boxes
 
 
 class LayoutRecognizer(Recognizer):
@@ -70,9 +69,9 @@ class LayoutRecognizer(Recognizer):
             return any([re.search(p, b["text"]) for p in patt])
 
         if self.client:
-            layouts = self.client.predict(image_list)
+            layouts = [Boxes.from_records(lts, self.labels) for lts in self.client.predict(image_list)]
         else:
-            layouts = super().__call__(image_list, thr, batch_size)
+            layouts = self.detect(image_list, thr, batch_size)
         # save_results(image_list, layouts, self.labels, output_dir='output/', threshold=0.7)
         assert len(image_list) == len(ocr_res)
         # Tag layout type
@@ -82,21 +81,19 @@ class LayoutRecognizer(Recognizer):
         page_layout = []
         for pn, lts in enumerate(layouts):
             bxs = ocr_res[pn]
-            lts = [{"type": b["type"],
-                    "score": float(b["score"]),
-                    "x0": b["bbox"][0] / scale_factor, "x1": b["bbox"][2] / scale_factor,
-                    "top": b["bbox"][1] / scale_factor, "bottom": b["bbox"][-1] / scale_factor,
-                    "page_number": pn,
-                    } for b in lts if float(b["score"]) >= 0.4 or b["type"] not in self.garbage_layouts]
-            lts = self.sort_Y_firstly(lts, np.mean(
-                [lt["bottom"] - lt["top"] for lt in lts]) / 2)
-            lts = self.layouts_cleanup(bxs, lts)
+            lts = lts.take((lts.score >= 0.4) | ~lts.is_type(*self.garbage_layouts))
+            lts = lts.with_coords(lts.x0 / scale_factor, lts.x1 / scale_factor,
+                                  lts.top / scale_factor, lts.bottom / scale_factor, page=pn)
+            lts = lts.take(lts.sort_y_firstly(np.mean(lts.bottom - lts.top) / 2))
+            lts = lts.take(lts.cleanup(bxs))
             page_layout.append(lts)
+            visited = np.zeros(len(lts), dtype=bool)
 
             # Tag layout type, layouts are ready
             def findLayout(ty):
                 nonlocal bxs, lts, self
-                lts_ = [lt for lt in lts if lt["type"] == ty]
+                lts_ = np.flatnonzero(lts.types == ty)
+                hits = SpatialIndex(lts.take(lts_)).find_overlapped_with_threashold_many(bxs, thr=0.4)
                 i = 0
                 while i < len(bxs):
                     if bxs[i].get("layout_type"):
@@ -104,32 +101,29 @@ class LayoutRecognizer(Recognizer):
                         continue
                     if __is_garbage(bxs[i]):
                         bxs.pop(i)
+                        hits.pop(i)
                         continue
 
-                    ii = self.find_overlapped_with_threashold(bxs[i], lts_,
-                                                              thr=0.4)
+                    ii = hits[i]
                     if ii is None:  # belong to nothing
                         bxs[i]["layout_type"] = ""
                         i += 1
                         continue
-                    lts_[ii]["visited"] = True
+                    visited[lts_[ii]] = True
                     keep_feats = [
-                        lts_[
-                            ii]["type"] == "footer" and bxs[i]["bottom"] < image_list[pn].size[1] * 0.9 / scale_factor,
-                        lts_[
-                            ii]["type"] == "header" and bxs[i]["top"] > image_list[pn].size[1] * 0.1 / scale_factor,
+                        ty == "footer" and bxs[i]["bottom"] < image_list[pn].size[1] * 0.9 / scale_factor,
+                        ty == "header" and bxs[i]["top"] > image_list[pn].size[1] * 0.1 / scale_factor,
                     ]
-                    if drop and lts_[
-                            ii]["type"] in self.garbage_layouts and not any(keep_feats):
-                        if lts_[ii]["type"] not in garbages:
-                            garbages[lts_[ii]["type"]] = []
-                        garbages[lts_[ii]["type"]].append(bxs[i]["text"])
+                    if drop and ty in self.garbage_layouts and not any(keep_feats):
+                        if ty not in garbages:
+                            garbages[ty] = []
+                        garbages[ty].append(bxs[i]["text"])
                         bxs.pop(i)
+                        hits.pop(i)
                         continue
 
                     bxs[i]["layoutno"] = f"{ty}-{ii}"
-                    bxs[i]["layout_type"] = lts_[ii]["type"] if lts_[
-                        ii]["type"] != "equation" else "figure"
+                    bxs[i]["layout_type"] = ty if ty != "equation" else "figure"
                     i += 1
 
             for lt in ["footer", "header", "reference", "figure caption",
@@ -137,12 +131,12 @@ class LayoutRecognizer(Recognizer):
                 findLayout(lt)
 
             # add box to figure layouts which has not text box
-            for i, lt in enumerate(
-                    [lt for lt in lts if lt["type"] in ["figure", "equation"]]):
-                if lt.get("visited"):
+            for i, k in enumerate(np.flatnonzero(lts.is_type("figure", "equation"))):
+                if visited[k]:
                     continue
-                lt = deepcopy(lt)
+                lt = lts.record(k)
                 del lt["type"]
+                lt["page_number"] = pn
                 lt["text"] = ""
                 lt["layout_type"] = "figure"
                 lt["layoutno"] = f"figure-{i}"
@@ -223,7 +217,7 @@ class LayoutRecognizer4YOLOv10(LayoutRecognizer):
         boxes = boxes[scores > thr, :]
         scores = scores[scores > thr]
         if len(boxes) == 0:
-            return []
+            return Boxes.empty(self.label_list)
         class_ids = boxes[:, -1].astype(int)
         boxes = boxes[:, :4]
         boxes[:, 0] -= inputs["scale_factor"][2]
@@ -234,17 +228,6 @@ class LayoutRecognizer4YOLOv10(LayoutRecognizer):
                                 inputs["scale_factor"][1]])
         boxes = np.multiply(boxes, input_shape, dtype=np.float32)
 
-        unique_class_ids = np.unique(class_ids)
-        indices = []
-        for class_id in unique_class_ids:
-            class_indices = np.where(class_ids == class_id)[0]
-            class_boxes = boxes[class_indices, :]
-            class_scores = scores[class_indices]
-            class_keep_boxes = nms(class_boxes, class_scores, 0.45)
-            indices.extend(class_indices[class_keep_boxes])
-
-        return [{
-            "type": self.label_list[class_ids[i]].lower(),
-            "bbox": [float(t) for t in boxes[i].tolist()],
-            "score": float(scores[i])
-        } for i in indices]
+        boxes = Boxes.from_xyxy(boxes, scores, class_ids, self.label_list)
+        # operators.nms: one extra pixel per intersection side, boxes at exactly the threshold kept
+        return boxes.take(boxes.nms(0.45, plus_one=True, keep_equal=True)).astype(np.float64)
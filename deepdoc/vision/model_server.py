@@ -0,0 +1,323 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Node-local server for the deepdoc ONNX models (OCR detection and recognition, layout, table
+structure). Every task executor on the node that sets DEEPDOC_MODEL_SERVER to the server's
+unix socket gets a SharedSession from load_model instead of its own InferenceSession, so the
+models are held once per node and run with threads sized to the machine. Input tensors are
+handed over in shared memory, and concurrent runs of a model with the same input shapes
+(pages of several tasks, for instance) are concatenated into one batch.
+
+Messages are pickles, so only peers holding DEEPDOC_MODEL_SERVER_AUTHKEY are served, the socket
+lives in a directory private to the server's user, and models are only ever read from the
+server's own model directory, whatever path a client names.
+
+    DEEPDOC_MODEL_SERVER_AUTHKEY=... python deepdoc/vision/model_server.py --address /tmp/deepdoc_models/models.sock
+"""
+
+import os
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError, resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+
+import numpy as np
+
+MODEL_SERVER_BATCH_WAIT = float(os.environ.get('DEEPDOC_MODEL_SERVER_BATCH_WAIT', '0.005'))
+MODEL_SERVER_MAX_BATCH = int(os.environ.get('DEEPDOC_MODEL_SERVER_MAX_BATCH', '16'))
+MODEL_SERVER_AUTHKEY = os.environ.get('DEEPDOC_MODEL_SERVER_AUTHKEY', '')
+
+# What get_inputs() and get_outputs() of an InferenceSession describe, without onnxruntime.
+ModelArg = namedtuple("ModelArg", ["name", "shape", "type"])
+
+
+def _to_shm(arr):
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+
+def _from_shm(desc):
+    name, shape, dtype = desc
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        # The client owns and unlinks the block; don't let this process' tracker claim it.
+        resource_tracker.unregister(shm._name, "shared_memory")
+
+
+class SharedSession:
+    """
+    Stands in for the onnxruntime.InferenceSession of a model run by the model server:
+    get_inputs(), get_outputs() and run() keep their signatures, and run_options is ignored.
+    """
+
+    def __init__(self, address, model_file_path, device_id=None):
+        if not MODEL_SERVER_AUTHKEY:
+            raise RuntimeError("DEEPDOC_MODEL_SERVER_AUTHKEY is not set")
+        self.address = address
+        self.model_file_path = model_file_path
+        self.device_id = device_id
+        # Connections are not thread safe and OCR runs in worker threads: one per thread.
+        self._local = threading.local()
+        self.inputs, self.outputs = self._call("meta")
+
+    def _call(self, op, *args):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = Client(self.address, family="AF_UNIX", authkey=MODEL_SERVER_AUTHKEY.encode())
+        try:
+            # The server looks the model up by name in its own model directory.
+            conn.send((op, os.path.basename(self.model_file_path), self.device_id, *args))
+            status, res = conn.recv()
+        except (EOFError, OSError):
+            self._local.conn = None
+            conn.close()
+            raise
+        if status != "ok":
+            raise RuntimeError(f"Model server failed to {op} {self.model_file_path}: {res}")
+        return res
+
+    def get_inputs(self):
+        return self.inputs
+
+    def get_outputs(self):
+        return self.outputs
+
+    def run(self, output_names, input_feed, run_options=None):
+        blocks, descs = [], {}
+        try:
+            for name, arr in input_feed.items():
+                shm, descs[name] = _to_shm(arr)
+                blocks.append(shm)
+            return self._call("run", output_names, descs)
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+
+class _Request:
+    def __init__(self, output_names, feeds):
+        self.output_names = output_names
+        self.feeds = feeds
+        self.size = None
+        shapes = {v.shape[0] if v.ndim else None for v in feeds.values()}
+        if len(shapes) == 1:
+            self.size = shapes.pop()
+        # Requests only share a batch when everything but the batch dimension matches.
+        self.key = (tuple(output_names or []),
+                    tuple(sorted((k, v.shape[1:], v.dtype.str) for k, v in feeds.items())))
+        self.future = Future()
+
+
+class ModelRunner:
+    """One model session and the thread that batches and runs the requests queued for it."""
+
+    def __init__(self, model_file_path, device_id, intra_op_num_threads):
+        from deepdoc.vision.ocr import create_session
+        self.sess, self.run_options = create_session(model_file_path, device_id, intra_op_num_threads)
+        self.name = os.path.basename(model_file_path)
+        self.meta = ([ModelArg(i.name, i.shape, i.type) for i in self.sess.get_inputs()],
+                     [ModelArg(o.name, o.shape, o.type) for o in self.sess.get_outputs()])
+        dims = [i.shape[0] if i.shape else 1 for i in self.meta[0]]
+        # A fixed batch dimension or a scale_factor input (batched per image) rules batching out.
+        self.batchable = all(not isinstance(d, int) or d <= 0 for d in dims) and \
+            not any(i.name == "scale_factor" for i in self.meta[0])
+        self.queue = queue.Queue()
+        self.pending = []
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def run(self, output_names, feeds):
+        req = _Request(output_names, feeds)
+        self.queue.put(req)
+        return req.future.result()
+
+    def _next(self, timeout=None):
+        if self.pending:
+            return self.pending.pop(0)
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _gather(self, first):
+        batch = [first]
+        if not self.batchable or first.size is None:
+            return batch
+        rows = first.size
+        deadline = time.monotonic() + MODEL_SERVER_BATCH_WAIT
+        skipped = []
+        while rows < MODEL_SERVER_MAX_BATCH:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            req = self._next(timeout)
+            if req is None:
+                break
+            if req.key == first.key and req.size is not None and rows + req.size <= MODEL_SERVER_MAX_BATCH:
+                batch.append(req)
+                rows += req.size
+            else:
+                skipped.append(req)
+        self.pending = skipped + self.pending
+        return batch
+
+    def _run_one(self, req):
+        try:
+            req.future.set_result(self.sess.run(req.output_names, req.feeds, self.run_options))
+        except Exception as e:
+            req.future.set_exception(e)
+
+    def _loop(self):
+        while True:
+            batch = self._gather(self._next())
+            if len(batch) == 1:
+                self._run_one(batch[0])
+                continue
+            try:
+                feeds = {k: np.concatenate([r.feeds[k] for r in batch], axis=0) for k in batch[0].feeds}
+                outputs = self.sess.run(batch[0].output_names, feeds, self.run_options)
+                total = sum(r.size for r in batch)
+                if any(np.ndim(o) == 0 or o.shape[0] != total for o in outputs):
+                    raise ValueError("outputs are not batch-major")
+            except Exception:
+                logging.exception(f"ModelRunner {self.name} failed to run a batch of {len(batch)}, run them one by one from now on")
+                self.batchable = False
+                for r in batch:
+                    self._run_one(r)
+                continue
+            j = 0
+            for r in batch:
+                r.future.set_result([o[j:j + r.size] for o in outputs])
+                j += r.size
+
+
+class ModelServer:
+    def __init__(self, address, intra_op_num_threads, model_dir, authkey):
+        self.address = address
+        self.intra_op_num_threads = intra_op_num_threads
+        self.model_dir = os.path.realpath(model_dir)
+        self.authkey = authkey.encode()
+        self.runners = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, model_name):
+        model_file_path = os.path.realpath(os.path.join(self.model_dir, os.path.basename(model_name)))
+        if os.path.dirname(model_file_path) != self.model_dir or not model_file_path.endswith(".onnx") \
+                or not os.path.isfile(model_file_path):
+            raise ValueError(f"no model {model_name} in {self.model_dir}")
+        return model_file_path
+
+    def runner(self, model_name, device_id):
+        model_file_path = self.resolve(model_name)
+        with self.lock:
+            key = (model_file_path, device_id)
+            if key not in self.runners:
+                self.runners[key] = ModelRunner(model_file_path, device_id, self.intra_op_num_threads)
+            return self.runners[key]
+
+    def handle(self, op, model_name, device_id, *args):
+        runner = self.runner(model_name, device_id)
+        if op == "meta":
+            return runner.meta
+        if op == "run":
+            output_names, descs = args
+            return runner.run(output_names, {k: _from_shm(d) for k, d in descs.items()})
+        raise ValueError(f"unknown op {op}")
+
+    def serve_connection(self, conn):
+        with conn:
+            # Authenticated here rather than in accept(), so a peer that stalls doesn't hold up the others.
+            try:
+                deliver_challenge(conn, self.authkey)
+                answer_challenge(conn, self.authkey)
+            except (AuthenticationError, EOFError, OSError) as e:
+                logging.warning(f"ModelServer refused a connection: {e}")
+                return
+            while True:
+                try:
+                    req = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    conn.send(("ok", self.handle(*req)))
+                except Exception as e:
+                    logging.exception(f"ModelServer failed on {req[:2]}")
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+
+    def _private_dir(self):
+        sock_dir = os.path.dirname(os.path.abspath(self.address))
+        os.makedirs(sock_dir, mode=0o700, exist_ok=True)
+        st = os.stat(sock_dir)
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise PermissionError(f"{sock_dir} must belong to uid {os.getuid()} and be private (0700) to hold the model server socket")
+
+    def serve_forever(self):
+        self._private_dir()
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family="AF_UNIX")
+        finally:
+            os.umask(umask)
+        os.chmod(self.address, 0o600)
+        with listener:
+            logging.info(f"ModelServer listening on {self.address} with {self.intra_op_num_threads} threads per model")
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=self.serve_connection, args=(conn,), daemon=True).start()
+
+
+def main(args):
+    if not MODEL_SERVER_AUTHKEY:
+        raise SystemExit("DEEPDOC_MODEL_SERVER_AUTHKEY must be set, to the same value as for the task executors")
+    ModelServer(args.address, args.threads, args.model_dir, MODEL_SERVER_AUTHKEY).serve_forever()
+
+
+if __name__ == "__main__":
+    from api.utils.file_utils import get_project_base_directory
+    from api.utils.log_utils import initRootLogger
+    initRootLogger("model_server")
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--address', help="Unix socket the server listens on, the DEEPDOC_MODEL_SERVER of the executors",
+                        default=os.environ.get('DEEPDOC_MODEL_SERVER', '/tmp/deepdoc_models/models.sock'))
+    parser.add_argument('--threads', help="ONNX intra-op threads per model", type=int,
+                        default=int(os.environ.get('DEEPDOC_MODEL_SERVER_THREADS', str(os.cpu_count() or 4))))
+    parser.add_argument('--model_dir', help="The only directory models are loaded from",
+                        default=os.path.join(get_project_base_directory(), "rag/res/deepdoc"))
+    args = parser.parse_args()
+    # Run the importable module so that what gets pickled for the clients resolves on their side.
+    from deepdoc.vision import model_server
+    model_server.main(args)
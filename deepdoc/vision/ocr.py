@@ -33,6 +33,9 @@ import onnxruntime as ort
 from .postprocess import build_post_process
 
 loaded_models = {}
+ONNX_INTRA_OP_THREADS = int(os.environ.get('ONNX_INTRA_OP_THREADS', '2'))
+# Unix socket of the node-local model server (deepdoc/vision/model_server.py), empty to run models in process.
+MODEL_SERVER_ADDRESS = os.environ.get('DEEPDOC_MODEL_SERVER', '')
 
 def transform(data, ops=None):
     """ transform """
@@ -67,20 +70,7 @@ def create_operators(op_param_list, global_config=None):
     return ops
 
 
-def load_model(model_dir, nm, device_id: int | None = None):
-    model_file_path = os.path.join(model_dir, nm + ".onnx")
-    model_cached_tag = model_file_path + str(device_id) if device_id is not None else model_file_path
-
-    global loaded_models
-    loaded_model = loaded_models.get(model_cached_tag)
-    if loaded_model:
-        logging.info(f"load_model {model_file_path} reuses cached model")
-        return loaded_model
-
-    if not os.path.exists(model_file_path):
-        raise ValueError("not find model file path {}".format(
-            model_file_path))
-
+def create_session(model_file_path, device_id: int | None = None, intra_op_num_threads: int = ONNX_INTRA_OP_THREADS):
     def cuda_is_available():
         try:
             import torch
@@ -93,8 +83,8 @@ def load_model(model_dir, nm, device_id: int | None = None):
     options = ort.SessionOptions()
     options.enable_cpu_mem_arena = False
     options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-    options.intra_op_num_threads = 2
-    options.inter_op_num_threads = 2
+    options.intra_op_num_threads = intra_op_num_threads
+    options.inter_op_num_threads = intra_op_num_threads
 
     # https://github.com/microsoft/onnxruntime/issues/9509#issuecomment-951546580
     # Shrink GPU memory after execution
@@ -120,7 +110,33 @@ def load_model(model_dir, nm, device_id: int | None = None):
             providers=['CPUExecutionProvider'])
         run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "cpu")
         logging.info(f"load_model {model_file_path} uses CPU")
-    loaded_model = (sess, run_options)
+    return sess, run_options
+
+
+def load_model(model_dir, nm, device_id: int | None = None):
+    model_file_path = os.path.join(model_dir, nm + ".onnx")
+    model_cached_tag = model_file_path + str(device_id) if device_id is not None else model_file_path
+
+    global loaded_models
+    loaded_model = loaded_models.get(model_cached_tag)
+    if loaded_model:
+        logging.info(f"load_model {model_file_path} reuses cached model")
+        return loaded_model
+
+    if not os.path.exists(model_file_path):
+        raise ValueError("not find model file path {}".format(
+            model_file_path))
+
+    loaded_model = None
+    if MODEL_SERVER_ADDRESS:
+        from .model_server import SharedSession
+        try:
+            loaded_model = (SharedSession(MODEL_SERVER_ADDRESS, model_file_path, device_id), None)
+            logging.info(f"load_model {model_file_path} uses model server {MODEL_SERVER_ADDRESS}")
+        except Exception:
+            logging.exception(f"load_model {model_file_path} can't reach model server {MODEL_SERVER_ADDRESS}, load it locally")
+    if not loaded_model:
+        loaded_model = create_session(model_file_path, device_id)
     loaded_models[model_cached_tag] = loaded_model
     return loaded_model
 
@@ -27,6 +27,8 @@ from .operators import *  # noqa: F403
 from .operators import preprocess
 from . import operators
 from .ocr import load_model
+from .boxes import Boxes
+from .spatial_index import SpatialIndex
 
 class Recognizer:
     def __init__(self, label_list, task_name, model_dir=None):
@@ -50,6 +52,7 @@ class Recognizer:
         self.output_names = [node.name for node in self.ort_sess.get_outputs()]
         self.input_shape = self.ort_sess.get_inputs()[0].shape[2:4]
         self.label_list = label_list
+        self._batchable = None
 
     @staticmethod
     def sort_Y_firstly(arr, threashold):
@@ -139,7 +142,7 @@ class Recognizer:
                         a["bottom"] < b["top"],
                         a["top"] > b["bottom"]])
 
-        i = 0
+        i, index = 0, None
         while i + 1 < len(layouts):
             j = i + 1
             while j < min(i + far, len(layouts)) \
@@ -161,12 +164,10 @@ class Recognizer:
                     layouts.pop(i)
                 continue
 
-            area_i, area_i_1 = 0, 0
-            for b in boxes:
-                if not notOverlapped(b, layouts[i]):
-                    area_i += Recognizer.overlapped_area(b, layouts[i], False)
-                if not notOverlapped(b, layouts[j]):
-                    area_i_1 += Recognizer.overlapped_area(b, layouts[j], False)
+            if index is None:
+                index = SpatialIndex(boxes)
+            area_i = index.overlapped_area_sum(layouts[i])
+            area_i_1 = index.overlapped_area_sum(layouts[j])
 
             if area_i > area_i_1:
                 layouts.pop(j)
@@ -313,19 +314,11 @@ class Recognizer:
 
     def postprocess(self, boxes, inputs, thr):
         if "scale_factor" in self.input_names:
-            bb = []
-            for b in boxes:
-                clsid, bbox, score = int(b[0]), b[2:], b[1]
-                if score < thr:
-                    continue
-                if clsid >= len(self.label_list):
-                    continue
-                bb.append({
-                    "type": self.label_list[clsid].lower(),
-                    "bbox": [float(t) for t in bbox.tolist()],
-                    "score": float(score)
-                })
-            return bb
+            boxes = np.asarray(boxes).reshape(-1, 6)
+            clsid, score = boxes[:, 0].astype(int), boxes[:, 1]
+            keep = (score >= thr) & (clsid < len(self.label_list))
+            boxes = boxes[keep]
+            return Boxes.from_xyxy(boxes[:, 2:], boxes[:, 1], boxes[:, 0].astype(int), self.label_list).astype(np.float64)
 
         def xywh2xyxy(x):
             # [x, y, w, h] to [x1, y1, x2, y2]
@@ -336,53 +329,13 @@ class Recognizer:
             y[:, 3] = x[:, 1] + x[:, 3] / 2
             return y
 
-        def compute_iou(box, boxes):
-            # Compute xmin, ymin, xmax, ymax for both boxes
-            xmin = np.maximum(box[0], boxes[:, 0])
-            ymin = np.maximum(box[1], boxes[:, 1])
-            xmax = np.minimum(box[2], boxes[:, 2])
-            ymax = np.minimum(box[3], boxes[:, 3])
-
-            # Compute intersection area
-            intersection_area = np.maximum(0, xmax - xmin) * np.maximum(0, ymax - ymin)
-
-            # Compute union area
-            box_area = (box[2] - box[0]) * (box[3] - box[1])
-            boxes_area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
-            union_area = box_area + boxes_area - intersection_area
-
-            # Compute IoU
-            iou = intersection_area / union_area
-
-            return iou
-
-        def iou_filter(boxes, scores, iou_threshold):
-            sorted_indices = np.argsort(scores)[::-1]
-
-            keep_boxes = []
-            while sorted_indices.size > 0:
-                # Pick the last box
-                box_id = sorted_indices[0]
-                keep_boxes.append(box_id)
-
-                # Compute IoU of the picked box with the rest
-                ious = compute_iou(boxes[box_id, :], boxes[sorted_indices[1:], :])
-
-                # Remove boxes with IoU over the threshold
-                keep_indices = np.where(ious < iou_threshold)[0]
-
-                # print(keep_indices.shape, sorted_indices.shape)
-                sorted_indices = sorted_indices[keep_indices + 1]
-
-            return keep_boxes
-
         boxes = np.squeeze(boxes).T
         # Filter out object confidence scores below threshold
         scores = np.max(boxes[:, 4:], axis=1)
         boxes = boxes[scores > thr, :]
         scores = scores[scores > thr]
         if len(boxes) == 0:
-            return []
+            return Boxes.empty(self.label_list)
 
         # Get the class with the highest confidence
         class_ids = np.argmax(boxes[:, 4:], axis=1)
@@ -391,40 +344,68 @@ class Recognizer:
         boxes = np.multiply(boxes, input_shape, dtype=np.float32)
         boxes = xywh2xyxy(boxes)
 
-        unique_class_ids = np.unique(class_ids)
-        indices = []
-        for class_id in unique_class_ids:
-            class_indices = np.where(class_ids == class_id)[0]
-            class_boxes = boxes[class_indices, :]
-            class_scores = scores[class_indices]
-            class_keep_boxes = iou_filter(class_boxes, class_scores, 0.2)
-            indices.extend(class_indices[class_keep_boxes])
-
-        return [{
-            "type": self.label_list[class_ids[i]].lower(),
-            "bbox": [float(t) for t in boxes[i].tolist()],
-            "score": float(scores[i])
-        } for i in indices]
+        boxes = Boxes.from_xyxy(boxes, scores, class_ids, self.label_list)
+        # NMS in the dtype of the model output, so IoUs are the ones the per-class loops computed
+        return boxes.take(boxes.nms(0.2)).astype(np.float64)
 
-    def __call__(self, image_list, thr=0.7, batch_size=16):
-        res = []
-        imgs = []
-        for i in range(len(image_list)):
-            if not isinstance(image_list[i], np.ndarray):
-                imgs.append(np.array(image_list[i]))
+    @property
+    def batchable(self):
+        """Whether the model takes a dynamic batch dimension and yields one output row per image."""
+        if self._batchable is None:
+            dim = self.ort_sess.get_inputs()[0].shape[0]
+            self._batchable = "scale_factor" not in self.input_names and not (isinstance(dim, int) and dim > 0)
+        return self._batchable
+
+    def run_batch(self, inputs):
+        """
+        Runs the model over preprocessed inputs, stacking same-shape tensors into one NCHW batch.
+        Returns the raw output of each input in order, as a run over that input alone gives it.
+        """
+        outputs = [None] * len(inputs)
+        groups = {}
+        for i, ins in enumerate(inputs):
+            if self.batchable:
+                groups.setdefault(tuple(ins[self.input_names[0]].shape), []).append(i)
             else:
-                imgs.append(image_list[i])
+                groups[i] = [i]
+        for idxs in groups.values():
+            feeds = {k: np.concatenate([inputs[i][k] for i in idxs], axis=0) for k in self.input_names if k in inputs[idxs[0]]}
+            try:
+                out = self.ort_sess.run(None, feeds, self.run_options)[0]
+            except Exception:
+                if len(idxs) == 1:
+                    raise
+                logging.exception(f"{self.__class__.__name__} batched inference failed, falling back to one image per run")
+                self._batchable = False
+                for i in idxs:
+                    outputs[i] = self.ort_sess.run(None, {k: v for k, v in inputs[i].items() if k in self.input_names}, self.run_options)[0]
+                continue
+            if len(idxs) == 1:
+                # the whole output of a run over one input, batched or not
+                outputs[idxs[0]] = out
+                continue
+            for j, i in enumerate(idxs):
+                outputs[i] = out[j:j + 1]
+        return outputs
 
-        batch_loop_cnt = math.ceil(float(len(imgs)) / batch_size)
+    def detect(self, image_list, thr=0.7, batch_size=16):
+        """The boxes detected on each image, as Boxes with float64 coordinates and scores."""
+        res = []
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for i in range(batch_loop_cnt):
             start_index = i * batch_size
-            end_index = min((i + 1) * batch_size, len(imgs))
-            batch_image_list = imgs[start_index:end_index]
+            end_index = min((i + 1) * batch_size, len(image_list))
+            # convert per batch so that only one batch of pages is held as arrays
+            batch_image_list = [img if isinstance(img, np.ndarray) else np.array(img) for img in image_list[start_index:end_index]]
             inputs = self.preprocess(batch_image_list)
             logging.debug("preprocess")
-            for ins in inputs:
-                bb = self.postprocess(self.ort_sess.run(None, {k:v for k,v in ins.items() if k in self.input_names}, self.run_options)[0], ins, thr)
-                res.append(bb)
+            for ins, out in zip(inputs, self.run_batch(inputs)):
+                res.append(self.postprocess(out, ins, thr))
+
+        return res
+
+    def __call__(self, image_list, thr=0.7, batch_size=16):
+        res = [boxes.to_records() for boxes in self.detect(image_list, thr, batch_size)]
 
         #seeit.save_results(image_list, res, self.label_list, threshold=thr)
 
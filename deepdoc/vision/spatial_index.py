@@ -0,0 +1,185 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import numpy as np
+
+from .boxes import Boxes
+
+
+class SpatialIndex:
+    """
+    Column-oriented view over a list of boxes (dicts with x0, x1, top and bottom),
+    or over Boxes, that answers the overlap queries of Recognizer with numpy instead
+    of per-pair dict lookups. Boxes keep their list order, so every returned index
+    addresses the list the index was built from, and ties resolve the way Recognizer does.
+    """
+
+    # Rows of the query-by-box overlap matrix computed at a time.
+    CHUNK_SIZE = 1024
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+        self.x0, self.x1, self.top, self.bottom = self._coords(boxes)
+        self.area = (self.x1 - self.x0) * (self.bottom - self.top)
+        # Boxes ordered by top edge: every box touching [top, bottom] has its top edge
+        # in [top - max_height, bottom], which bounds the candidates of a query.
+        self._order = np.argsort(self.top, kind="stable")
+        self._sorted_tops = self.top[self._order]
+        self._max_height = float(np.max(self.bottom - self.top, initial=0))
+        self._layoutno = None
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @staticmethod
+    def _coords(boxes):
+        if isinstance(boxes, Boxes):
+            return [np.ascontiguousarray(c, dtype=np.float64) for c in [boxes.x0, boxes.x1, boxes.top, boxes.bottom]]
+        coords = np.array([[b["x0"], b["x1"], b["top"], b["bottom"]] for b in boxes],
+                          dtype=np.float64).reshape(len(boxes), 4)
+        return [np.ascontiguousarray(c) for c in coords.T]
+
+    def _intersections(self, x0, x1, top, bottom, j=slice(None)):
+        """
+        Intersection areas between query boxes and the indexed boxes j, zero where
+        they do not touch. Arguments broadcast against each other.
+        """
+        bx0, bx1, btop, bbottom = self.x0[j], self.x1[j], self.top[j], self.bottom[j]
+        touching = ~((x0 > bx1) | (x1 < bx0) | (bottom < btop) | (top > bbottom))
+        inter = (np.minimum(bbottom, bottom) - np.maximum(btop, top)) * \
+                (np.minimum(bx1, x1) - np.maximum(bx0, x0))
+        return np.where(touching, inter, 0.)
+
+    def _ratios(self, queries):
+        """
+        For each query row and indexed column, Recognizer.overlapped_area(query, b)
+        and Recognizer.overlapped_area(b, query).
+        """
+        x0, x1, top, bottom = [c[:, None] for c in self._coords(queries)]
+        inter = self._intersections(x0, x1, top, bottom)
+        area = (x1 - x0) * (bottom - top)
+        of_query = np.divide(inter, area, out=np.zeros_like(inter), where=(inter > 0) & (area != 0))
+        of_box = np.divide(inter, self.area, out=np.zeros_like(inter), where=(inter > 0) & (self.area != 0))
+        return of_query, of_box
+
+    def overlapped_area_sum(self, box):
+        """Total area of the indexed boxes covered by box, summed in list order."""
+        x0, x1, top, bottom = [c[0] for c in self._coords([box])]
+        inter = self._intersections(x0, x1, top, bottom)
+        inter = inter[(inter != 0) & (self.area != 0)]
+        return sum(inter.tolist())
+
+    def _search_ranges(self, top, bottom, naive):
+        """
+        The [s, e) slice Recognizer.find_overlapped scans for each query: a binary
+        search for a vertically overlapping box, then one step of narrowing per side.
+        """
+        m, n = len(top), len(self)
+        s, e, ii = np.zeros(m, dtype=np.int64), np.full(m, n, dtype=np.int64), np.zeros(m, dtype=np.int64)
+        active = np.zeros(m, dtype=bool) if naive else np.ones(m, dtype=bool)
+        while True:
+            active &= s < e
+            if not active.any():
+                break
+            mid = (e + s) // 2
+            ii[active] = mid[active]
+            mid = np.minimum(mid, n - 1)
+            left = active & (bottom < self.top[mid])
+            right = active & ~left & (top > self.bottom[mid])
+            e[left] = mid[left]
+            s[right] = mid[right] + 1
+            active &= left | right
+        s += (s < ii) & (top > self.bottom[np.minimum(s, n - 1)])
+        e -= (e - 1 > ii) & (bottom < self.top[np.clip(e - 1, 0, n - 1)])
+        return s, e
+
+    def find_overlapped_many(self, queries, naive=False):
+        """
+        Recognizer.find_overlapped for each query against the indexed boxes, which
+        must be sorted by Y unless naive is set. Returns a list of indices or None.
+        """
+        res = [None] * len(queries)
+        if not len(self) or not queries:
+            return res
+        for start in range(0, len(queries), self.CHUNK_SIZE):
+            x0, x1, top, bottom = self._coords(queries[start:start + self.CHUNK_SIZE])
+            s, e = self._search_ranges(top, bottom, naive)
+            # (query, box) pairs whose boxes may touch the query vertically
+            lo = np.searchsorted(self._sorted_tops, top - self._max_height, side="left")
+            hi = np.searchsorted(self._sorted_tops, bottom, side="right")
+            counts = np.maximum(hi - lo, 0)
+            qi = np.repeat(np.arange(len(top)), counts)
+            pos = np.arange(len(qi)) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+            bj = self._order[pos]
+            inter = self._intersections(x0[qi], x1[qi], top[qi], bottom[qi], bj)
+            ov = np.divide(inter, self.area[bj], out=np.zeros_like(inter), where=(inter > 0) & (self.area[bj] != 0))
+            keep = (ov > 0) & (bj >= s[qi]) & (bj < e[qi])
+            qi, bj, ov = qi[keep], bj[keep], ov[keep]
+            # the largest overlap per query, the first box in list order on ties
+            order = np.lexsort((bj, -ov, qi))
+            qi, bj = qi[order], bj[order]
+            first = np.flatnonzero(np.r_[True, qi[1:] != qi[:-1]]) if len(qi) else []
+            for i in first:
+                res[start + int(qi[i])] = int(bj[i])
+        return res
+
+    def find_overlapped(self, box, naive=False):
+        return self.find_overlapped_many([box], naive)[0]
+
+    def find_overlapped_with_threashold_many(self, queries, thr=0.3):
+        """Recognizer.find_overlapped_with_threashold(box, boxes, thr) for each query box."""
+        res = [None] * len(queries)
+        if not len(self) or not queries:
+            return res
+        n = len(self)
+        for start in range(0, len(queries), self.CHUNK_SIZE):
+            ov, _ov = self._ratios(queries[start:start + self.CHUNK_SIZE])
+            # the last box holding the lexicographic max of (ov, _ov) among ov >= thr
+            cand = ov >= thr
+            sel = cand & (ov == np.where(cand, ov, -np.inf).max(axis=1, keepdims=True))
+            sel &= _ov == np.where(sel, _ov, -np.inf).max(axis=1, keepdims=True)
+            last = n - 1 - sel[:, ::-1].argmax(axis=1)
+            for i in np.flatnonzero(cand.any(axis=1)):
+                res[start + i] = int(last[i])
+        return res
+
+    def find_overlapped_with_threashold(self, box, thr=0.3):
+        return self.find_overlapped_with_threashold_many([box], thr)[0]
+
+    def find_horizontally_tightest_fit_many(self, queries):
+        """Recognizer.find_horizontally_tightest_fit(box, boxes) for each query box."""
+        res = [None] * len(queries)
+        if not len(self) or not queries:
+            return res
+        if self._layoutno is None:
+            self._codes = {}
+            layoutnos = self.boxes.layoutno.tolist() if isinstance(self.boxes, Boxes) \
+                else [b.get("layoutno", "0") for b in self.boxes]
+            self._layoutno = np.array([self._codes.setdefault(no, len(self._codes)) for no in layoutnos])
+        for start in range(0, len(queries), self.CHUNK_SIZE):
+            chunk = queries[start:start + self.CHUNK_SIZE]
+            x0, x1, _, _ = [c[:, None] for c in self._coords(chunk)]
+            codes = np.array([self._codes.get(b.get("layoutno", "0"), -1) for b in chunk])
+            dis = np.minimum(np.minimum(np.abs(x0 - self.x0), np.abs(x1 - self.x1)),
+                             np.abs(x0 + x1 - self.x1 - self.x0) / 2)
+            dis = np.where(codes[:, None] == self._layoutno, dis, np.inf)
+            best = dis.argmin(axis=1)
+            for i in np.flatnonzero(dis[np.arange(len(chunk)), best] < 1000000):
+                res[start + i] = int(best[i])
+        return res
+
+    def find_horizontally_tightest_fit(self, box):
+        return self.find_horizontally_tightest_fit_many([box])[0]
@@ -0,0 +1,75 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+from deepdoc.vision import LayoutRecognizer, TableStructureRecognizer, init_in_out
+import argparse
+import time
+
+
+def run(detr, images, thr, batch_size, batched, rounds=1):
+    detr._batchable = None if batched else False
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if isinstance(detr, LayoutRecognizer):
+            detr.forward(images, thr=thr, batch_size=batch_size)
+        else:
+            detr(images, thr=thr, batch_size=batch_size)
+    return time.perf_counter() - start
+
+
+def main(args):
+    images, _ = init_in_out(args)
+    if args.mode.lower() == "layout":
+        detr = LayoutRecognizer("layout")
+    else:
+        detr = TableStructureRecognizer()
+    thr = float(args.threshold)
+
+    # Warm up the session so the first timing does not include graph initialization.
+    run(detr, images[:1], thr, 1, False)
+    per_image = run(detr, images, thr, args.batch_size, False, args.rounds)
+    batched = run(detr, images, thr, args.batch_size, True, args.rounds)
+    pages = len(images) * args.rounds
+    print(f"{args.mode}: {len(images)} pages x {args.rounds} rounds, batch_size={args.batch_size}, batchable={detr.batchable}")
+    print(f"  one image per run: {pages / per_image:.2f} pages/s")
+    print(f"  batched runs:      {pages / batched:.2f} pages/s ({per_image / batched:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--inputs',
+                        help="Directory where to store images or PDFs, or a file path to a single image or PDF",
+                        required=True)
+    parser.add_argument('--output_dir', help="Directory where to store the output images. Default: './layouts_outputs'",
+                        default="./layouts_outputs")
+    parser.add_argument('--threshold', help="A threshold to filter out detections. Default: 0.2", default=0.2)
+    parser.add_argument('--mode', help="Task mode: layout recognition or table structure recognition", choices=["layout", "tsr"],
+                        default="layout")
+    parser.add_argument('--batch_size', help="Images per inference batch. Default: 16", type=int, default=16)
+    parser.add_argument('--rounds', help="How many times to run over the inputs. Default: 1", type=int, default=1)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,201 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+from deepdoc.vision.boxes import Boxes
+from deepdoc.vision.operators import nms
+from deepdoc.vision.recognizer import Recognizer
+import argparse
+import random
+import re
+import time
+
+import numpy as np
+
+LABELS = ["title", "Text", "Reference", "Figure", "Figure caption", "Table", "Table caption", "Table caption",
+          "Equation", "Figure caption"]
+
+
+def detections(pages, per_page, seed=0):
+    """Raw model output of a layout page: x0, top, x1, bottom in float32, with near duplicates per class."""
+    rnd = np.random.default_rng(seed)
+    res = []
+    for _ in range(pages):
+        base = rnd.uniform(0, 2000, (per_page, 2)).astype(np.float32)
+        size = rnd.uniform(20, 600, (per_page, 2)).astype(np.float32)
+        xyxy = np.concatenate([base, base + size], axis=1)
+        dup = xyxy[rnd.integers(0, per_page, per_page * 2)] + rnd.normal(0, 8, (per_page * 2, 4)).astype(np.float32)
+        xyxy = np.concatenate([xyxy, dup]).astype(np.float32)
+        scores = rnd.uniform(0.1, 1, len(xyxy)).astype(np.float32)
+        class_ids = rnd.integers(0, len(LABELS), len(xyxy))
+        res.append((xyxy, scores, class_ids))
+    return res
+
+
+def text_boxes(pages, per_page, seed=0):
+    rnd = random.Random(seed)
+    res = []
+    for _ in range(pages):
+        bxs = []
+        for _ in range(per_page):
+            x0, top = rnd.uniform(0, 600), rnd.uniform(0, 800)
+            bxs.append({"x0": x0, "x1": x0 + rnd.uniform(10, 200), "top": top, "bottom": top + rnd.uniform(5, 12),
+                        "text": "x"})
+        res.append(bxs)
+    return res
+
+
+def timed(name, f):
+    start = time.perf_counter()
+    res = f()
+    print(f"  {name:<40}{(time.perf_counter() - start) * 1000:10.1f} ms")
+    return res
+
+
+def iou_filter(boxes, scores, iou_threshold):
+    """The per-class NMS loop Recognizer.postprocess ran before Boxes."""
+    sorted_indices = np.argsort(scores)[::-1]
+    keep_boxes = []
+    while sorted_indices.size > 0:
+        box_id = sorted_indices[0]
+        keep_boxes.append(box_id)
+        box, rest = boxes[box_id, :], boxes[sorted_indices[1:], :]
+        inter = np.maximum(0, np.minimum(box[2], rest[:, 2]) - np.maximum(box[0], rest[:, 0])) * \
+            np.maximum(0, np.minimum(box[3], rest[:, 3]) - np.maximum(box[1], rest[:, 1]))
+        ious = inter / ((box[2] - box[0]) * (box[3] - box[1]) + (rest[:, 2] - rest[:, 0]) * (rest[:, 3] - rest[:, 1]) - inter)
+        sorted_indices = sorted_indices[np.where(ious < iou_threshold)[0] + 1]
+    return keep_boxes
+
+
+def per_class(pages, f, thr):
+    res = []
+    for xyxy, scores, class_ids in pages:
+        indices = []
+        for class_id in np.unique(class_ids):
+            class_indices = np.where(class_ids == class_id)[0]
+            indices.extend(class_indices[f(xyxy[class_indices, :], scores[class_indices], thr)])
+        res.append([{"type": LABELS[class_ids[i]].lower(), "bbox": [float(t) for t in xyxy[i].tolist()],
+                     "score": float(scores[i])} for i in indices])
+    return res
+
+
+def boxes_nms(pages, thr, **kwargs):
+    res = []
+    for xyxy, scores, class_ids in pages:
+        b = Boxes.from_xyxy(xyxy, scores, class_ids, LABELS)
+        res.append(b.take(b.nms(thr, **kwargs)).astype(np.float64))
+    return res
+
+
+def dict_layouts(layouts, ocr, scale_factor=3):
+    """LayoutRecognizer.__call__ up to page_layout, on dicts."""
+    res = []
+    for pn, lts in enumerate(layouts):
+        lts = [{"type": b["type"], "score": float(b["score"]),
+                "x0": b["bbox"][0] / scale_factor, "x1": b["bbox"][2] / scale_factor,
+                "top": b["bbox"][1] / scale_factor, "bottom": b["bbox"][-1] / scale_factor,
+                } for b in lts if float(b["score"]) >= 0.4 or b["type"] not in ["reference"]]
+        lts = Recognizer.sort_Y_firstly(lts, np.mean([lt["bottom"] - lt["top"] for lt in lts]) / 2)
+        res.append(Recognizer.layouts_cleanup(ocr[pn], lts))
+    return res
+
+
+def boxes_layouts(layouts, ocr, scale_factor=3):
+    res = []
+    for pn, lts in enumerate(layouts):
+        lts = lts.take((lts.score >= 0.4) | ~lts.is_type("reference"))
+        lts = lts.with_coords(lts.x0 / scale_factor, lts.x1 / scale_factor,
+                              lts.top / scale_factor, lts.bottom / scale_factor, page=pn)
+        lts = lts.take(lts.sort_y_firstly(np.mean(lts.bottom - lts.top) / 2))
+        res.append(lts.take(lts.cleanup(ocr[pn])))
+    return res
+
+
+def dict_gather(tb_cpns, boxes, kwd, fzy=10, ption=0.6):
+    """RAGFlowPdfParser._table_transformer_job gathering table components, on dicts."""
+    eles = Recognizer.sort_Y_firstly([r for r in tb_cpns if re.match(kwd, r["label"])], fzy)
+    eles = Recognizer.layouts_cleanup(boxes, eles, 5, ption)
+    return Recognizer.sort_Y_firstly(eles, 0)
+
+
+def boxes_gather(tb_cpns, boxes, kwd, fzy=10, ption=0.6):
+    eles = tb_cpns.take(tb_cpns.match(kwd))
+    eles = eles.take(eles.sort_y_firstly(fzy))
+    eles = eles.take(eles.cleanup(boxes, 5, ption, same_type=False))
+    return eles.take(eles.sort_y_firstly(0))
+
+
+def same(dicts, boxes):
+    return [{k: d[k] for k in ["type", "score", "x0", "x1", "top", "bottom"]} for d in dicts] == boxes.to_dicts()
+
+
+def main(args):
+    pages = detections(args.pages, args.per_page)
+    ocr = text_boxes(args.pages, args.text_boxes)
+    print(f"{args.pages} pages, {sum(len(p[0]) for p in pages)} raw detections, {args.text_boxes} text boxes a page")
+
+    print("NMS (Recognizer.postprocess)")
+    a = timed("per-class iou_filter on arrays", lambda: per_class(pages, iou_filter, 0.2))
+    b = timed("Boxes.nms", lambda: boxes_nms(pages, 0.2))
+    assert a == [p.to_records() for p in b]
+
+    print("NMS (LayoutRecognizer4YOLOv10.postprocess)")
+    a = timed("per-class operators.nms on arrays", lambda: per_class(pages, nms, 0.45))
+    b = timed("Boxes.nms", lambda: boxes_nms(pages, 0.45, plus_one=True, keep_equal=True))
+    assert a == [p.to_records() for p in b]
+
+    print("layout filter, sort and cleanup (LayoutRecognizer.__call__)")
+    for p in b:
+        # no scores on some layouts, to fall back to the text boxes they cover
+        p.score[::7] = 0
+    a = timed("dicts", lambda: dict_layouts([p.to_records() for p in b], ocr))
+    c = timed("Boxes", lambda: boxes_layouts(b, ocr))
+    assert all(same(x, y) for x, y in zip(a, c))
+
+    print("table components (RAGFlowPdfParser._table_transformer_job)")
+    tsr = ["table", "table column", "table row", "table column header", "table projected row header",
+           "table spanning cell"]
+    rnd = np.random.default_rng(1)
+    n = args.pages * 40
+    x0, top = rnd.uniform(0, 600, n), rnd.uniform(0, 800 * args.pages, n)
+    tb_cpns = Boxes(x0, x0 + rnd.uniform(20, 500, n), top, top + rnd.uniform(5, 30, n), rnd.uniform(0.2, 1, n),
+                    rnd.integers(0, len(tsr), n), tsr, rnd.integers(0, args.pages, n), rnd.integers(0, 3, n))
+    tb_cpns.score[::5] = 0
+    boxes = [b for p in ocr for b in p]
+    dicts = tb_cpns.to_dicts("label")
+    for kwd in [r".*header$", r".* (row|header)", r".*spanning"]:
+        a = timed(f"dicts {kwd}", lambda: dict_gather(dicts, boxes, kwd))
+        c = timed(f"Boxes {kwd}", lambda: boxes_gather(tb_cpns, boxes, kwd))
+        assert [{k: d[k] for k in ["label", "score", "x0", "x1", "top", "bottom"]} for d in a] == c.to_dicts("label")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', help="Pages of layouts. Default: 50", type=int, default=50)
+    parser.add_argument('--per_page', help="Distinct layouts detected on a page. Default: 40", type=int, default=40)
+    parser.add_argument('--text_boxes', help="OCR text boxes on a page. Default: 200", type=int, default=200)
+    args = parser.parse_args()
+    main(args)
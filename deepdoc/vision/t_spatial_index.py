@@ -0,0 +1,91 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+from deepdoc.vision.recognizer import Recognizer
+from deepdoc.vision.spatial_index import SpatialIndex
+import argparse
+import random
+import time
+
+
+def dense_page(rows, cols, chars_per_cell, seed=0):
+    """A synthetic financial-table page: one OCR box per cell and jittered chars inside each."""
+    rnd = random.Random(seed)
+    boxes, chars = [], []
+    for r in range(rows):
+        top = 20 + r * 10
+        for c in range(cols):
+            x0 = 20 + c * 70
+            boxes.append({"x0": x0, "x1": x0 + 60, "top": top, "bottom": top + 8, "layoutno": "table-0"})
+            for k in range(chars_per_cell):
+                cx = x0 + k * 60 / chars_per_cell + rnd.uniform(-2, 2)
+                ct = top + rnd.uniform(-2, 2)
+                chars.append({"x0": cx, "x1": cx + 5, "top": ct, "bottom": ct + 8, "layoutno": "table-0"})
+    boxes = Recognizer.sort_Y_firstly(boxes, 3)
+    rnd.shuffle(chars)
+    row_lts = [{"x0": 15, "x1": 20 + cols * 70, "top": 18 + r * 10, "bottom": 29 + r * 10} for r in range(rows)]
+    col_lts = [{"x0": 15 + c * 70, "x1": 85 + c * 70, "top": 15, "bottom": 30 + rows * 10, "layoutno": "table-0"}
+               for c in range(cols)]
+    return boxes, chars, row_lts, col_lts
+
+
+def timed(name, f):
+    start = time.perf_counter()
+    res = f()
+    print(f"  {name:<40}{(time.perf_counter() - start) * 1000:10.1f} ms")
+    return res
+
+
+def main(args):
+    boxes, chars, rows, clmns = dense_page(args.rows, args.cols, args.chars_per_cell)
+    print(f"{len(chars)} chars, {len(boxes)} OCR boxes, {len(rows)} rows, {len(clmns)} columns")
+
+    print("char to OCR box (find_overlapped)")
+    a = timed("Recognizer", lambda: [Recognizer.find_overlapped(c, boxes) for c in chars])
+    b = timed("SpatialIndex", lambda: SpatialIndex(boxes).find_overlapped_many(chars))
+    assert a == b
+
+    print("box to row (find_overlapped_with_threashold)")
+    a = timed("Recognizer", lambda: [Recognizer.find_overlapped_with_threashold(x, rows, thr=0.3) for x in boxes])
+    idx = SpatialIndex(rows)
+    b = timed("SpatialIndex", lambda: idx.find_overlapped_with_threashold_many(boxes, thr=0.3))
+    assert a == b
+
+    print("box to column (find_horizontally_tightest_fit)")
+    a = timed("Recognizer", lambda: [Recognizer.find_horizontally_tightest_fit(x, clmns) for x in boxes])
+    idx = SpatialIndex(clmns)
+    b = timed("SpatialIndex", lambda: idx.find_horizontally_tightest_fit_many(boxes))
+    assert a == b
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', help="Table rows on the page. Default: 80", type=int, default=80)
+    parser.add_argument('--cols', help="Table columns on the page. Default: 8", type=int, default=8)
+    parser.add_argument('--chars_per_cell', help="Chars in each cell. Default: 8", type=int, default=8)
+    args = parser.parse_args()
+    main(args)
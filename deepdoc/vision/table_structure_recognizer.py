@@ -46,49 +46,37 @@ class TableStructureRecognizer(Recognizer):
                                               local_dir=os.path.join(get_project_base_directory(), "rag/res/deepdoc"),
                                               local_dir_use_symlinks=False))
 
-    def __call__(self, images, thr=0.2):
-        tbls = super().__call__(images, thr)
+    def __call__(self, images, thr=0.2, batch_size=16):
+        return [tbl.to_dicts("label") for tbl in self.components(images, thr, batch_size)]
+
+    def components(self, images, thr=0.2, batch_size=16):
+        """
+        The table components detected on each image as Boxes, rows aligned left&right and
+        columns top&bottom. Images without any row or header are left out.
+        """
         res = []
         # align left&right for rows, align top&bottom for columns
-        for tbl in tbls:
-            lts = [{"label": b["type"],
-                    "score": b["score"],
-                    "x0": b["bbox"][0], "x1": b["bbox"][2],
-                    "top": b["bbox"][1], "bottom": b["bbox"][-1]
-                    } for b in tbl]
-            if not lts:
+        for tbl in self.detect(images, thr, batch_size):
+            if not len(tbl):
                 continue
+            x0, x1, top, bottom = tbl.x0, tbl.x1, tbl.top, tbl.bottom
 
-            left = [b["x0"] for b in lts if b["label"].find(
-                "row") > 0 or b["label"].find("header") > 0]
-            right = [b["x1"] for b in lts if b["label"].find(
-                "row") > 0 or b["label"].find("header") > 0]
-            if not left:
+            rows = np.array([t.find("row") > 0 or t.find("header") > 0 for t in tbl.types], dtype=bool)
+            if not rows.any():
                 continue
-            left = np.mean(left) if len(left) > 4 else np.min(left)
-            right = np.mean(right) if len(right) > 4 else np.max(right)
-            for b in lts:
-                if b["label"].find("row") > 0 or b["label"].find("header") > 0:
-                    if b["x0"] > left:
-                        b["x0"] = left
-                    if b["x1"] < right:
-                        b["x1"] = right
-
-            top = [b["top"] for b in lts if b["label"] == "table column"]
-            bottom = [b["bottom"] for b in lts if b["label"] == "table column"]
-            if not top:
-                res.append(lts)
-                continue
-            top = np.median(top) if len(top) > 4 else np.min(top)
-            bottom = np.median(bottom) if len(bottom) > 4 else np.max(bottom)
-            for b in lts:
-                if b["label"] == "table column":
-                    if b["top"] > top:
-                        b["top"] = top
-                    if b["bottom"] < bottom:
-                        b["bottom"] = bottom
-
-            res.append(lts)
+            left = np.mean(x0[rows]) if rows.sum() > 4 else np.min(x0[rows])
+            right = np.mean(x1[rows]) if rows.sum() > 4 else np.max(x1[rows])
+            x0 = np.where(rows & (x0 > left), left, x0)
+            x1 = np.where(rows & (x1 < right), right, x1)
+
+            clmns = tbl.types == "table column"
+            if clmns.any():
+                tp = np.median(top[clmns]) if clmns.sum() > 4 else np.min(top[clmns])
+                btm = np.median(bottom[clmns]) if clmns.sum() > 4 else np.max(bottom[clmns])
+                top = np.where(clmns & (top > tp), tp, top)
+                bottom = np.where(clmns & (bottom < btm), btm, bottom)
+
+            res.append(tbl.with_coords(x0, x1, top, bottom))
         return res
 
     @staticmethod
@@ -511,29 +499,20 @@ class TableStructureRecognizer(Recognizer):
                 for row in rows]
         rbtm = [np.mean([c.get("R_btm", c["bottom"])
                          for c in row]) for row in rows]
+        clft, crgt = np.array(clft, dtype=np.float64), np.array(crgt, dtype=np.float64)
+        rtop, rbtm = np.array(rtop, dtype=np.float64), np.array(rbtm, dtype=np.float64)
+        # column and row centers, computed from each side as the spans compare them
+        cl_mid, cr_mid = clft + (crgt - clft) / 2, crgt - (crgt - clft) / 2
+        rt_mid, rb_mid = rtop + (rbtm - rtop) / 2, rbtm - (rbtm - rtop) / 2
         for b in boxes:
             if "SP" not in b:
                 continue
-            b["colspan"] = [b["cn"]]
-            b["rowspan"] = [b["rn"]]
             # col span
-            for j in range(0, len(clft)):
-                if j == b["cn"]:
-                    continue
-                if clft[j] + (crgt[j] - clft[j]) / 2 < b["H_left"]:
-                    continue
-                if crgt[j] - (crgt[j] - clft[j]) / 2 > b["H_right"]:
-                    continue
-                b["colspan"].append(j)
+            cs = np.flatnonzero((cl_mid >= b["H_left"]) & (cr_mid <= b["H_right"]))
+            b["colspan"] = [b["cn"]] + [int(j) for j in cs if j != b["cn"]]
             # row span
-            for j in range(0, len(rtop)):
-                if j == b["rn"]:
-                    continue
-                if rtop[j] + (rbtm[j] - rtop[j]) / 2 < b["H_top"]:
-                    continue
-                if rbtm[j] - (rbtm[j] - rtop[j]) / 2 > b["H_bott"]:
-                    continue
-                b["rowspan"].append(j)
+            rs = np.flatnonzero((rt_mid >= b["H_top"]) & (rb_mid <= b["H_bott"]))
+            b["rowspan"] = [b["rn"]] + [int(j) for j in rs if j != b["rn"]]
 
         def join(arr):
             if not arr:
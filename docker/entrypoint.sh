@@ -11,6 +11,7 @@ function usage() {
     echo "  --disable-webserver             Disables the web server (nginx + ragflow_server)."
     echo "  --disable-taskexecutor          Disables task executor workers."
     echo "  --enable-mcpserver              Enables the MCP server."
+    echo "  --enable-modelserver            Serves the deepdoc models to all task executors from one process."
     echo "  --consumer-no-beg=<num>         Start range for consumers (if using range-based)."
     echo "  --consumer-no-end=<num>         End range for consumers (if using range-based)."
     echo "  --workers=<num>                 Number of task executors to run (if range is not used)."
@@ -27,6 +28,7 @@ function usage() {
 ENABLE_WEBSERVER=1 # Default to enable web server
 ENABLE_TASKEXECUTOR=1  # Default to enable task executor
 ENABLE_MCP_SERVER=0
+ENABLE_MODEL_SERVER=0
 CONSUMER_NO_BEG=0
 CONSUMER_NO_END=0
 WORKERS=1
@@ -67,6 +69,10 @@ for arg in "$@"; do
       ENABLE_MCP_SERVER=1
       shift
       ;;
+    --enable-modelserver)
+      ENABLE_MODEL_SERVER=1
+      shift
+      ;;
     --mcp-host=*)
       MCP_HOST="${arg#*=}"
       shift
@@ -172,6 +178,21 @@ if [[ "${ENABLE_MCP_SERVER}" -eq 1 ]]; then
     start_mcp_server
 fi
 
+if [[ "${ENABLE_MODEL_SERVER}" -eq 1 && "${ENABLE_TASKEXECUTOR}" -eq 1 ]]; then
+    export DEEPDOC_MODEL_SERVER="${DEEPDOC_MODEL_SERVER:-/tmp/deepdoc_models/models.sock}"
+    # Shared by the model server and the task executors started below, nothing else knows it.
+    export DEEPDOC_MODEL_SERVER_AUTHKEY="${DEEPDOC_MODEL_SERVER_AUTHKEY:-$("$PY" -c 'import secrets; print(secrets.token_hex(32))')}"
+    echo "Starting deepdoc model server on ${DEEPDOC_MODEL_SERVER}..."
+    while true; do
+        "$PY" deepdoc/vision/model_server.py --address="${DEEPDOC_MODEL_SERVER}"
+    done &
+    # Executors that start before the socket exists load the models themselves.
+    for _ in $(seq 60); do
+        [[ -S "${DEEPDOC_MODEL_SERVER}" ]] && break
+        sleep 1
+    done
+fi
+
 if [[ "${ENABLE_TASKEXECUTOR}" -eq 1 ]]; then
     if [[ "${CONSUMER_NO_END}" -gt "${CONSUMER_NO_BEG}" ]]; then
         echo "Starting task executors on host '${HOST_ID}' for IDs in [${CONSUMER_NO_BEG}, ${CONSUMER_NO_END})..."
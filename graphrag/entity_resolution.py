@@ -66,8 +66,12 @@ class EntityResolution(Extractor):
     async def __call__(self, graph: nx.Graph,
                        subgraph_nodes: set[str],
                        prompt_variables: dict[str, Any] | None = None,
-                       callback: Callable | None = None) -> EntityResolutionResult:
-        """Call method definition."""
+                       callback: Callable | None = None,
+                       hydrate: Callable | None = None) -> EntityResolutionResult:
+        """
+        Call method definition. The graph may carry only names and entity types; hydrate,
+        if given, is awaited with the nodes about to be merged to load their attributes and edges.
+        """
         if prompt_variables is None:
             prompt_variables = {}
 
@@ -109,6 +113,8 @@ class EntityResolution(Extractor):
         change = GraphChange()
         connect_graph = nx.Graph()
         connect_graph.add_edges_from(resolution_result)
+        if hydrate and connect_graph.number_of_nodes():
+            await hydrate(set(connect_graph.nodes()))
         async with trio.open_nursery() as nursery:
             for sub_connect_graph in nx.connected_components(connect_graph):
                 merging_nodes = list(sub_connect_graph)
@@ -218,6 +218,7 @@ class Extractor:
                         edge0_attrs["description"] = await self._handle_entity_relation_summary(f"({nodes[0]}, {neighbor})", edge0_attrs["description"])
                         graph.add_edge(nodes[0], neighbor, **edge0_attrs)
                     else:
+                        change.added_updated_edges.add(get_from_to(nodes[0], neighbor))
                         graph.add_edge(nodes[0], neighbor, **edge1_attrs)
             graph.remove_node(node1)
         node0_attrs["description"] = await self._handle_entity_relation_summary(nodes[0], node0_attrs["description"])
@@ -28,8 +28,10 @@ from graphrag.general.extractor import Extractor
 from graphrag.utils import (
     graph_merge,
     get_graph,
+    get_graph_neighbourhood,
+    graph_row_id,
+    hydrate_graph,
     set_graph,
-    chunk_id,
     does_graph_contains,
     tidy_graph,
     GraphChange,
@@ -50,7 +52,7 @@ async def run_graphrag(
     start = trio.current_time()
     tenant_id, kb_id, doc_id = row["tenant_id"], str(row["kb_id"]), row["doc_id"]
     chunks = []
-    for d in settings.retrievaler.chunk_list(
+    for d in settings.retrievaler.iter_chunks(
         doc_id, tenant_id, [kb_id], fields=["content_with_weight", "doc_id"]
     ):
         chunks.append(d["content_with_weight"])
@@ -107,6 +109,8 @@ async def run_graphrag(
         if with_community:
             await graphrag_task_lock.spin_acquire()
             callback(msg=f"run_graphrag {doc_id} graphrag_task_lock acquired")
+            # Communities span the whole graph, while merge and resolution only loaded the part they touched.
+            new_graph = await get_graph(tenant_id, kb_id)
             await extract_community(
                 new_graph,
                 tenant_id,
@@ -169,7 +173,9 @@ async def generate_subgraph(
     tidy_graph(subgraph, callback)
 
     subgraph.graph["source_id"] = [doc_id]
+    # Kept per document, so the graph can be rebuilt without it once a document is removed.
     chunk = {
+        "id": graph_row_id(kb_id, "subgraph", doc_id),
         "content_with_weight": json.dumps(
             nx.node_link_data(subgraph, edges="edges"), ensure_ascii=False
         ),
@@ -179,7 +185,6 @@ async def generate_subgraph(
         "available_int": 0,
         "removed_kwd": "N",
     }
-    cid = chunk_id(chunk)
     await trio.to_thread.run_sync(
         lambda: settings.docStoreConn.delete(
             {"knowledge_graph_kwd": "subgraph", "source_id": doc_id}, search.index_name(tenant_id), kb_id
@@ -187,7 +192,7 @@ async def generate_subgraph(
     )
     await trio.to_thread.run_sync(
         lambda: settings.docStoreConn.insert(
-            [{"id": cid, **chunk}], search.index_name(tenant_id), kb_id
+            [chunk], search.index_name(tenant_id), kb_id
         )
     )
     now = trio.current_time()
@@ -204,10 +209,11 @@ async def merge_subgraph(
 ):
     start = trio.current_time()
     change = GraphChange()
-    old_graph = await get_graph(tenant_id, kb_id, subgraph.graph["source_id"])
+    old_graph = await get_graph_neighbourhood(tenant_id, kb_id, subgraph.nodes(), subgraph.graph["source_id"])
     if old_graph is not None:
         logging.info("Merge with an exiting graph...................")
-        tidy_graph(old_graph, callback)
+        if old_graph.graph.get("rewrite_rows"):
+            tidy_graph(old_graph, callback)
         new_graph = graph_merge(old_graph, subgraph, change)
     else:
         new_graph = subgraph
@@ -239,7 +245,11 @@ async def resolve_entities(
     er = EntityResolution(
         llm_bdl,
     )
-    reso = await er(graph, subgraph_nodes, callback=callback)
+    async def hydrate(nodes):
+        if not graph.graph.get("rewrite_rows"):
+            await hydrate_graph(tenant_id, kb_id, graph, nodes)
+
+    reso = await er(graph, subgraph_nodes, callback=callback, hydrate=hydrate)
     graph = reso.graph
     change = reso.change
     callback(msg=f"Graph resolution removed {len(change.removed_nodes)} nodes and {len(change.removed_edges)} edges.")
@@ -15,7 +15,9 @@
 #
 import json
 import logging
+import os
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 import json_repair
 import pandas as pd
@@ -23,12 +25,20 @@ import trio
 
 from api.utils import get_uuid
 from graphrag.query_analyze_prompt import PROMPTS
-from graphrag.utils import get_entity_type2sampels, get_llm_cache, set_llm_cache, get_relation
+from graphrag.utils import get_entity_type2sampels, get_llm_cache, set_llm_cache
 from rag.utils import num_tokens_from_string, get_float
 from rag.utils.doc_store_conn import OrderByExpr
+from rag.utils.retrieval_cache import RetrievalCache, kb_versions
 
 from rag.nlp.search import Dealer, index_name
 
+# Runs the searches of a KG retrieval side by side. Kept apart from the chat's retrieval pool,
+# whose threads wait on KGSearch.retrieval.
+KG_SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("KG_SEARCH_WORKERS", 16)), thread_name_prefix="kg_search")
+# Entity type samples and query rewrites, both keyed by the versions of the knowledge bases.
+TY2ENTS_CACHE = RetrievalCache(max_bytes=int(os.environ.get("KG_TY2ENTS_CACHE_MB", 16)) * 1024 * 1024)
+QUERY_REWRITE_CACHE = RetrievalCache(max_bytes=int(os.environ.get("KG_QUERY_REWRITE_CACHE_MB", 8)) * 1024 * 1024)
+
 
 class KGSearch(Dealer):
     def _chat(self, llm_bdl, system, history, gen_conf):
@@ -41,8 +51,31 @@ class KGSearch(Dealer):
         set_llm_cache(llm_bdl.llm_name, system, response, history, gen_conf)
         return response
 
+    def entity_type2samples(self, idxnms, kb_ids):
+        versions = kb_versions(sorted(kb_ids)) if TY2ENTS_CACHE.enabled else None
+        if versions is None:
+            return trio.run(lambda: get_entity_type2sampels(idxnms, kb_ids))
+        key = RetrievalCache.digest("ty2ents", [sorted(idxnms), sorted(kb_ids), versions])
+        ty2ents = TY2ENTS_CACHE.get(key)
+        if ty2ents is None:
+            ty2ents = trio.run(lambda: get_entity_type2sampels(idxnms, kb_ids))
+            TY2ENTS_CACHE.set(key, ty2ents)
+        return ty2ents
+
     def query_rewrite(self, llm, question, idxnms, kb_ids):
-        ty2ents = trio.run(lambda: get_entity_type2sampels(idxnms, kb_ids))
+        versions = kb_versions(sorted(kb_ids)) if QUERY_REWRITE_CACHE.enabled else None
+        if versions is None:
+            return self._query_rewrite(llm, question, idxnms, kb_ids)
+        key = RetrievalCache.digest("kg_query_rewrite", [getattr(llm, "cache_model_name", llm.llm_name),
+                                                         RetrievalCache.normalize(question), sorted(idxnms), sorted(kb_ids), versions])
+        rewrite = QUERY_REWRITE_CACHE.get(key)
+        if rewrite is None:
+            rewrite = self._query_rewrite(llm, question, idxnms, kb_ids)
+            QUERY_REWRITE_CACHE.set(key, rewrite)
+        return rewrite
+
+    def _query_rewrite(self, llm, question, idxnms, kb_ids):
+        ty2ents = self.entity_type2samples(idxnms, kb_ids)
         hint_prompt = PROMPTS["minirag_query2kwd"].format(query=question,
                                                           TYPE_POOL=json.dumps(ty2ents, ensure_ascii=False, indent=2))
         result = self._chat(llm, hint_prompt, [{"role": "user", "content": "Output:"}], {"temperature": .5})
@@ -137,6 +170,34 @@ class KGSearch(Dealer):
                                        idxnms, kb_ids)
         return self._ent_info_from_(es_res, 0)
 
+    def get_relation_descriptions(self, pairs, filters, idxnms, kb_ids):
+        """Descriptions of the relations between the given entity pairs, in one search."""
+        if not pairs:
+            return {}
+        ents = list({e for pair in pairs for e in pair})
+        filters = deepcopy(filters)
+        filters["knowledge_graph_kwd"] = "relation"
+        filters["from_entity_kwd"] = ents
+        filters["to_entity_kwd"] = ents
+        es_res = self.dataStore.search(["content_with_weight", "from_entity_kwd", "to_entity_kwd"], [], filters, [],
+                                       OrderByExpr(), 0, len(ents) * len(ents), idxnms, kb_ids)
+        wanted = {tuple(sorted(pair)) for pair in pairs}
+        res = {}
+        for _, rel in self.dataStore.getFields(es_res, ["content_with_weight", "from_entity_kwd", "to_entity_kwd"]).items():
+            f, t = rel.get("from_entity_kwd"), rel.get("to_entity_kwd")
+            if isinstance(f, list):
+                f = f[0]
+            if isinstance(t, list):
+                t = t[0]
+            pair = tuple(sorted([f, t]))
+            if pair not in wanted or pair in res:
+                continue
+            try:
+                res[pair] = json.loads(rel["content_with_weight"])["description"]
+            except Exception:
+                continue
+        return res
+
     def retrieval(self, question: str,
                tenant_ids: str | list[str],
                kb_ids: list[str],
@@ -155,18 +216,21 @@ class KGSearch(Dealer):
         if isinstance(tenant_ids, str):
             tenant_ids = tenant_ids.split(",")
         idxnms = [index_name(tid) for tid in tenant_ids]
+        # The relations only depend on the question: search them while the question is rewritten.
+        rels_future = KG_SEARCH_EXECUTOR.submit(self.get_relevant_relations_by_txt, qst, filters, idxnms, kb_ids, emb_mdl, rel_sim_threshold)
         ty_kwds = []
         try:
-            ty_kwds, ents = self.query_rewrite(llm, qst, [index_name(tid) for tid in tenant_ids], kb_ids)
+            ty_kwds, ents = self.query_rewrite(llm, qst, idxnms, kb_ids)
             logging.info(f"Q: {qst}, Types: {ty_kwds}, Entities: {ents}")
         except Exception as e:
             logging.exception(e)
             ents = [qst]
             pass
 
+        types_future = KG_SEARCH_EXECUTOR.submit(self.get_relevant_ents_by_types, ty_kwds, filters, idxnms, kb_ids, 10000)
         ents_from_query = self.get_relevant_ents_by_keywords(ents, filters, idxnms, kb_ids, emb_mdl, ent_sim_threshold)
-        ents_from_types = self.get_relevant_ents_by_types(ty_kwds, filters, idxnms, kb_ids, 10000)
-        rels_from_txt = self.get_relevant_relations_by_txt(qst, filters, idxnms, kb_ids, emb_mdl, rel_sim_threshold)
+        ents_from_types = types_future.result()
+        rels_from_txt = rels_future.result()
         nhop_pathes = defaultdict(dict)
         for _, ent in ents_from_query.items():
             nhops = ent.get("n_hop_ents", [])
@@ -237,15 +301,13 @@ class KGSearch(Dealer):
                 ents = ents[:-1]
                 break
 
+        descriptions = self.get_relation_descriptions([(f, t) for (f, t), rel in rels_from_txt if not rel.get("description")],
+                                                      filters, idxnms, kb_ids)
         for (f, t), rel in rels_from_txt:
             if not rel.get("description"):
-                for tid in tenant_ids:
-                    rela = get_relation(tid, kb_ids, f, t)
-                    if rela:
-                        break
-                else:
+                if tuple(sorted([f, t])) not in descriptions:
                     continue
-                rel["description"] = rela["description"]
+                rel["description"] = descriptions[tuple(sorted([f, t]))]
             desc = rel["description"]
             try:
                 desc = json.loads(desc).get("description", "")
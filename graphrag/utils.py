@@ -19,19 +19,22 @@ import trio
 from typing import Set, Tuple
 
 import networkx as nx
-import numpy as np
 import xxhash
 from networkx.readwrite import json_graph
 import dataclasses
 
 from api import settings
-from api.utils import get_uuid
 from rag.nlp import search, rag_tokenizer
 from rag.utils.doc_store_conn import OrderByExpr
+from rag.utils.embed_cache import EmbeddingCache
 from rag.utils.redis_conn import REDIS_CONN
 
 GRAPH_FIELD_SEP = "<SEP>"
 
+# Entity and relation vectors are shared by the executors through Redis, under the keys of LLMBundle's own cache.
+# Nothing is kept in process: LLMBundle.encode already does that.
+GRAPH_EMBEDDING_CACHE = EmbeddingCache(cache_type="redis", max_bytes=0, ttl=24 * 3600)
+
 ErrorHandlerFn = Callable[[BaseException | None, str | None, dict | None], None]
 
 chat_limiter = trio.CapacityLimiter(int(os.environ.get('MAX_CONCURRENT_CHATS', 10)))
@@ -118,25 +121,11 @@ def set_llm_cache(llmnm, txt, v, history, genconf):
 
 
 def get_embed_cache(llmnm, txt):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
-
-    k = hasher.hexdigest()
-    bin = REDIS_CONN.get(k)
-    if not bin:
-        return
-    return np.array(json.loads(bin))
+    return GRAPH_EMBEDDING_CACHE.get(llmnm, txt)
 
 
 def set_embed_cache(llmnm, txt, arr):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
-
-    k = hasher.hexdigest()
-    arr = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
-    REDIS_CONN.set(k, arr.encode("utf-8"), 24*3600)
+    GRAPH_EMBEDDING_CACHE.set(llmnm, txt, arr)
 
 
 def get_tags_from_cache(kb_ids):
@@ -299,9 +288,24 @@ def chunk_id(chunk):
     return xxhash.xxh64((chunk["content_with_weight"] + chunk["kb_id"]).encode("utf-8")).hexdigest()
 
 
+def graph_row_id(kb_id, *key):
+    """Stable id of a graph row, so writing a node or an edge again replaces its row in place."""
+    return xxhash.xxh64("\0".join([kb_id, *key]).encode("utf-8")).hexdigest()
+
+
+def rank_value(pagerank):
+    """The pagerank stored in rank_flt, to 3 significant digits: nodes of the same rank share a value and are updated together."""
+    return float(f"{pagerank:.3g}")
+
+
+def stored_pageranks(graph: nx.Graph, entities: list[dict]):
+    """Records the rank_flt of the loaded entity rows, for set_graph to only update the ones pagerank moved."""
+    graph.graph["stored_pagerank"] = {d["entity_kwd"]: float(d.get("rank_flt") or 0) for d in entities if "entity_kwd" in d}
+
+
 async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
     chunk = {
-        "id": get_uuid(),
+        "id": graph_row_id(kb_id, "entity", ent_name),
         "important_kwd": [ent_name],
         "title_tks": rag_tokenizer.tokenize(ent_name),
         "entity_kwd": ent_name,
@@ -310,15 +314,16 @@ async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
         "content_with_weight": json.dumps(meta, ensure_ascii=False),
         "content_ltks": rag_tokenizer.tokenize(meta["description"]),
         "source_id": meta["source_id"],
+        "rank_flt": rank_value(meta.get("pagerank", 0)),
         "kb_id": kb_id,
         "available_int": 0
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
-    ebd = get_embed_cache(embd_mdl.llm_name, ent_name)
+    ebd = get_embed_cache(embd_mdl.cache_model_name, ent_name)
     if ebd is None:
         ebd, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([ent_name]))
         ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, ent_name, ebd)
+        set_embed_cache(embd_mdl.cache_model_name, ent_name, ebd)
     assert ebd is not None
     chunk["q_%d_vec" % len(ebd)] = ebd
     chunks.append(chunk)
@@ -353,7 +358,7 @@ def get_relation(tenant_id, kb_id, from_ent_name, to_ent_name, size=1):
 
 async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta, chunks):
     chunk = {
-        "id": get_uuid(),
+        "id": graph_row_id(kb_id, "relation", *get_from_to(from_ent_name, to_ent_name)),
         "from_entity_kwd": from_ent_name,
         "to_entity_kwd": to_ent_name,
         "knowledge_graph_kwd": "relation",
@@ -366,12 +371,13 @@ async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta,
         "available_int": 0
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
-    txt = f"{from_ent_name}->{to_ent_name}"
-    ebd = get_embed_cache(embd_mdl.llm_name, txt)
+    # Keyed by the text embedded, as LLMBundle does, so the description is part of the key.
+    txt = f"{from_ent_name}->{to_ent_name}: {meta['description']}"
+    ebd = get_embed_cache(embd_mdl.cache_model_name, txt)
     if ebd is None:
-        ebd, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([txt+f": {meta['description']}"]))
+        ebd, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([txt]))
         ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, txt, ebd)
+        set_embed_cache(embd_mdl.cache_model_name, txt, ebd)
     assert ebd is not None
     chunk["q_%d_vec" % len(ebd)] = ebd
     chunks.append(chunk)
@@ -406,75 +412,223 @@ async def get_graph_doc_ids(tenant_id, kb_id) -> list[str]:
     return doc_ids
 
 
-async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
+async def get_graph_meta(tenant_id, kb_id):
+    """The KB's "graph" row: the documents in the graph, and the whole graph for KBs built before rows were incremental."""
     conds = {
         "fields": ["content_with_weight", "removed_kwd", "source_id"],
         "size": 1,
         "knowledge_graph_kwd": ["graph"]
     }
     res = await trio.to_thread.run_sync(lambda: settings.retrievaler.search(conds, search.index_name(tenant_id), [kb_id]))
-    if not res.total == 0:
-        for id in res.ids:
-            try:
-                if res.field[id]["removed_kwd"] == "N":
-                    g = json_graph.node_link_graph(json.loads(res.field[id]["content_with_weight"]), edges="edges")
-                    if "source_id" not in g.graph:
-                        g.graph["source_id"] = res.field[id]["source_id"]
-                else:
-                    g = await rebuild_graph(tenant_id, kb_id, exclude_rebuild)
-                return g
-            except Exception:
-                continue
-    result = None
-    return result
+    for id in res.ids:
+        try:
+            return {**res.field[id], "content_with_weight": json.loads(res.field[id]["content_with_weight"])}
+        except Exception:
+            continue
+    return None
+
+
+async def search_graph_rows(tenant_id, kb_id, condition, fields, bs=1024):
+    # Through the doc store cursor: offset paging stops at the engine's result window (10,000 rows on ES).
+    return await trio.to_thread.run_sync(lambda: list(settings.docStoreConn.scan(fields, {"kb_id": kb_id, **condition},
+                                                                                 search.index_name(tenant_id), [kb_id], bs)))
+
+
+def _graph_row_meta(d):
+    try:
+        meta = json.loads(d["content_with_weight"])
+    except Exception:
+        return None
+    if "source_id" in d:
+        meta["source_id"] = d["source_id"] if isinstance(d["source_id"], list) else [d["source_id"]]
+    if "description" not in meta or not meta.get("source_id"):
+        return None
+    return meta
+
+
+def add_graph_rows(graph: nx.Graph, entities: list[dict], relations: list[dict], nodes=None):
+    """
+    Loads entity and relation rows into graph, in place. Relations are kept only when both
+    ends are in the graph, and, if nodes is given, at least one end is in nodes.
+
+    The source_id field of a row wins over the one in its content: removing a document only
+    updates the field, and rows left without any source are dropped.
+    """
+    for d in entities:
+        meta = _graph_row_meta(d)
+        if meta is None:
+            continue
+        graph.add_node(d["entity_kwd"], **meta)
+    for d in relations:
+        f, t = d["from_entity_kwd"], d["to_entity_kwd"]
+        if not graph.has_node(f) or not graph.has_node(t):
+            continue
+        if nodes is not None and f not in nodes and t not in nodes:
+            continue
+        meta = _graph_row_meta(d)
+        if meta is None:
+            continue
+        meta.setdefault("keywords", [])
+        graph.add_edge(f, t, **meta)
+    return graph
+
+
+async def get_graph_topology(tenant_id, kb_id) -> nx.Graph:
+    """
+    Every entity with only its entity_type, and every relation without attributes.
+    Enough for pagerank and entity resolution candidates, without reading descriptions.
+    """
+    graph = nx.Graph()
+    entities = await search_graph_rows(tenant_id, kb_id, {"knowledge_graph_kwd": ["entity"]}, ["entity_kwd", "entity_type_kwd", "rank_flt"])
+    for d in entities:
+        graph.add_node(d["entity_kwd"], entity_type=d.get("entity_type_kwd", "-"))
+    stored_pageranks(graph, entities)
+    for d in await search_graph_rows(tenant_id, kb_id, {"knowledge_graph_kwd": ["relation"]}, ["from_entity_kwd", "to_entity_kwd"]):
+        if graph.has_node(d["from_entity_kwd"]) and graph.has_node(d["to_entity_kwd"]):
+            graph.add_edge(d["from_entity_kwd"], d["to_entity_kwd"])
+    return graph
+
+
+async def hydrate_graph(tenant_id, kb_id, graph: nx.Graph, nodes, incident=True, bs=256):
+    """
+    Loads the full attributes of nodes, and of the relations between them, into graph.
+    With incident, relations from nodes to any node of graph are loaded as well.
+    """
+    nodes = sorted(set(nodes))
+    flds = ["entity_kwd", "from_entity_kwd", "to_entity_kwd", "content_with_weight", "source_id"]
+    entities, relations = [], []
+    for i in range(0, len(nodes), bs):
+        names = nodes[i:i + bs]
+        entities.extend(await search_graph_rows(tenant_id, kb_id, {"knowledge_graph_kwd": ["entity"], "entity_kwd": names}, flds))
+        relations.extend(await search_graph_rows(tenant_id, kb_id, {"knowledge_graph_kwd": ["relation"], "from_entity_kwd": names}, flds))
+        relations.extend(await search_graph_rows(tenant_id, kb_id, {"knowledge_graph_kwd": ["relation"], "to_entity_kwd": names}, flds))
+    names = set(nodes)
+    if not incident:
+        relations = [d for d in relations if d["from_entity_kwd"] in names and d["to_entity_kwd"] in names]
+    add_graph_rows(graph, entities, relations)
+    # Rows missing essential attributes stay unloaded; drop them as tidy_graph would.
+    graph.remove_nodes_from([n for n in names if graph.has_node(n) and "description" not in graph.nodes[n]])
+    graph.remove_edges_from([(f, t) for n in names if graph.has_node(n) for f, t, attr in graph.edges(n, data=True)
+                             if "description" not in attr and (incident or (f in names and t in names))])
+    return graph
+
+
+async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
+    """The whole graph of the KB with all attributes, or None if the KB has no graph."""
+    meta = await get_graph_meta(tenant_id, kb_id)
+    if meta is None:
+        return None
+    content = meta["content_with_weight"]
+    if meta["removed_kwd"] != "N":
+        # Documents were removed since the graph was written: their text can't be told apart in the merged
+        # descriptions, so the graph is rebuilt from the subgraphs of the documents left, and rewritten.
+        g = await rebuild_graph(tenant_id, kb_id, exclude_rebuild)
+        if g is not None:
+            g.graph["rewrite_rows"] = True
+        return g
+    if "nodes" in content:
+        # The whole graph stored in one blob by earlier versions, rewritten as rows by the next set_graph.
+        g = json_graph.node_link_graph(content, edges="edges")
+        if "source_id" not in g.graph:
+            g.graph["source_id"] = meta["source_id"]
+        g.graph["rewrite_rows"] = True
+        return g
+
+    flds = ["entity_kwd", "from_entity_kwd", "to_entity_kwd", "content_with_weight", "source_id", "rank_flt"]
+    entities = await search_graph_rows(tenant_id, kb_id, {"knowledge_graph_kwd": ["entity"]}, flds)
+    graph = add_graph_rows(nx.Graph(), entities,
+                           await search_graph_rows(tenant_id, kb_id, {"knowledge_graph_kwd": ["relation"]}, flds))
+    if len(graph.nodes) == 0:
+        return None
+    stored_pageranks(graph, entities)
+    graph.graph.update(content.get("graph", {}))
+    graph.graph["source_id"] = list(meta["source_id"])
+    return graph
+
+
+async def get_graph_neighbourhood(tenant_id, kb_id, nodes, exclude_rebuild=None):
+    """
+    The graph topology with full attributes only on nodes and the relations among them,
+    which is what merging a subgraph over nodes touches. None if the KB has no graph.
+    """
+    meta = await get_graph_meta(tenant_id, kb_id)
+    if meta is None:
+        return None
+    if meta["removed_kwd"] != "N" or "nodes" in meta["content_with_weight"]:
+        return await get_graph(tenant_id, kb_id, exclude_rebuild)
+    graph = await get_graph_topology(tenant_id, kb_id)
+    await hydrate_graph(tenant_id, kb_id, graph, nodes, incident=False)
+    graph.graph.update(meta["content_with_weight"].get("graph", {}))
+    graph.graph["source_id"] = list(meta["source_id"])
+    return graph
+
+
+def get_graph_overview(tenant_id, kb_id, max_nodes=256, max_edges=128):
+    """Top entities by pagerank and the heaviest relations among them, in node-link form."""
+    flds = ["entity_kwd", "from_entity_kwd", "to_entity_kwd", "content_with_weight"]
+    ordr = OrderByExpr()
+    ordr.desc("rank_flt")
+    es_res = settings.docStoreConn.search(flds, [], {"kb_id": kb_id, "knowledge_graph_kwd": ["entity"]}, [], ordr,
+                                          0, max_nodes, search.index_name(tenant_id), [kb_id])
+    graph = add_graph_rows(nx.Graph(), list(settings.docStoreConn.getFields(es_res, flds).values()), [])
+    if graph.number_of_nodes():
+        ordr = OrderByExpr()
+        ordr.desc("weight_int")
+        names = sorted(graph.nodes())
+        es_res = settings.docStoreConn.search(flds, [], {"kb_id": kb_id, "knowledge_graph_kwd": ["relation"],
+                                                         "from_entity_kwd": names, "to_entity_kwd": names}, [], ordr,
+                                              0, max_edges * 2, search.index_name(tenant_id), [kb_id])
+        add_graph_rows(graph, [], list(settings.docStoreConn.getFields(es_res, flds).values()))
+    return nx.node_link_data(graph, edges="edges")
 
 
 async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, change: GraphChange, callback):
+    """
+    Applies change to the KB's graph rows in place: one row per entity and relation, keyed by
+    graph_row_id, plus the "graph" row listing the documents in the graph. Only the changed
+    nodes and edges need attributes in graph.
+
+    Pagerank is computed over the whole graph, so every other entity row whose stored rank_flt
+    it moved is updated in place as well.
+    """
     start = trio.current_time()
 
-    await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "subgraph"]}, search.index_name(tenant_id), kb_id))
+    if graph.graph.pop("rewrite_rows", False):
+        # The graph was loaded whole from a legacy blob or rebuilt from subgraphs: drop the blob and every row, then write every row.
+        # Subgraphs stay, they are what the graph is rebuilt from once documents are removed.
+        await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "entity", "relation"]}, search.index_name(tenant_id), kb_id))
+        change = GraphChange(added_updated_nodes=set(graph.nodes()),
+                             added_updated_edges=set(get_from_to(f, t) for f, t in graph.edges()))
 
     if change.removed_nodes:
         await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"knowledge_graph_kwd": ["entity"], "entity_kwd": sorted(change.removed_nodes)}, search.index_name(tenant_id), kb_id))
 
     if change.removed_edges:
-        async with trio.open_nursery() as nursery:
-            for from_node, to_node in change.removed_edges:
-                 nursery.start_soon(lambda from_node=from_node, to_node=to_node: trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"knowledge_graph_kwd": ["relation"], "from_entity_kwd": from_node, "to_entity_kwd": to_node}, search.index_name(tenant_id), kb_id)))
+        edge_ids = sorted(set(graph_row_id(kb_id, "relation", *get_from_to(f, t)) for f, t in change.removed_edges))
+        await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": edge_ids}, search.index_name(tenant_id), kb_id))
     now = trio.current_time()
     if callback:
         callback(msg=f"set_graph removed {len(change.removed_nodes)} nodes and {len(change.removed_edges)} edges from index in {now - start:.2f}s.")
     start = now
 
     chunks = [{
-        "id": get_uuid(),
-        "content_with_weight": json.dumps(nx.node_link_data(graph, edges="edges"), ensure_ascii=False),
+        "id": graph_row_id(kb_id, "graph"),
+        "content_with_weight": json.dumps({"graph": {k: v for k, v in graph.graph.items() if k not in ["source_id", "stored_pagerank"]}}, ensure_ascii=False),
         "knowledge_graph_kwd": "graph",
         "kb_id": kb_id,
-        "source_id": graph.graph.get("source_id", []),
+        "source_id": sorted(set(graph.graph.get("source_id", []))),
         "available_int": 0,
         "removed_kwd": "N"
     }]
-    
-    # generate updated subgraphs
-    for source in graph.graph["source_id"]:
-        subgraph = graph.subgraph([n for n in graph.nodes if source in graph.nodes[n]["source_id"]]).copy()
-        subgraph.graph["source_id"] = [source]
-        for n in subgraph.nodes:
-            subgraph.nodes[n]["source_id"] = [source]
-        chunks.append({
-            "id": get_uuid(),
-            "content_with_weight": json.dumps(nx.node_link_data(subgraph, edges="edges"), ensure_ascii=False),
-            "knowledge_graph_kwd": "subgraph",
-            "kb_id": kb_id,
-            "source_id": [source],
-            "available_int": 0,
-            "removed_kwd": "N"
-        })
-    
+
     async with trio.open_nursery() as nursery:
         for node in change.added_updated_nodes:
+            if not graph.has_node(node):
+                continue
             node_attrs = graph.nodes[node]
+            if "description" not in node_attrs:
+                logging.warning(f"set_graph skipped node {node} which was changed without being loaded.")
+                continue
             nursery.start_soon(graph_node_to_chunk, kb_id, embd_mdl, node, node_attrs, chunks)
         for from_node, to_node in change.added_updated_edges:
             edge_attrs = graph.get_edge_data(from_node, to_node)
@@ -496,6 +650,25 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
     now = trio.current_time()
     if callback:
         callback(msg=f"set_graph added/updated {len(change.added_updated_nodes)} nodes and {len(change.added_updated_edges)} edges from index in {now - start:.2f}s.")
+    start = now
+
+    written = set(c["entity_kwd"] for c in chunks if c["knowledge_graph_kwd"] == "entity")
+    stored = graph.graph.setdefault("stored_pagerank", {})
+    stale = defaultdict(list)
+    for node, pagerank in graph.nodes(data="pagerank"):
+        if pagerank is None:
+            continue
+        rank = rank_value(pagerank)
+        if node not in written and stored.get(node) != rank:
+            stale[rank].append(graph_row_id(kb_id, "entity", node))
+        stored[node] = rank
+    for rank, ids in stale.items():
+        for b in range(0, len(ids), 1024):
+            await trio.to_thread.run_sync(lambda: settings.docStoreConn.update({"id": ids[b:b + 1024]}, {"rank_flt": rank}, search.index_name(tenant_id), kb_id))
+    if stale:
+        now = trio.current_time()
+        if callback:
+            callback(msg=f"set_graph updated the pagerank of {sum(len(ids) for ids in stale.values())} other nodes in {now - start:.2f}s.")
 
 
 def is_continuous_subsequence(subseq, seq):
@@ -573,42 +746,29 @@ def flat_uniq_list(arr, key):
 
 
 async def rebuild_graph(tenant_id, kb_id, exclude_rebuild=None):
+    """The graph merged back from the subgraph of every document in it, but those in exclude_rebuild."""
     graph = nx.Graph()
     flds = ["knowledge_graph_kwd", "content_with_weight", "source_id"]
-    bs = 256
-    for i in range(0, 1024*bs, bs):
-        es_res = await trio.to_thread.run_sync(lambda: settings.docStoreConn.search(flds, [],
-                                 {"kb_id": kb_id, "knowledge_graph_kwd": ["subgraph"]},
-                                 [],
-                                 OrderByExpr(),
-                                 i, bs, search.index_name(tenant_id), [kb_id]
-                                 ))
-        # tot = settings.docStoreConn.getTotal(es_res)
-        es_res = settings.docStoreConn.getFields(es_res, flds)
-
-        if len(es_res) == 0:
-            break
-
-        for id, d in es_res.items():
-            assert d["knowledge_graph_kwd"] == "subgraph"
-            if isinstance(exclude_rebuild, list):
-                if sum([n in d["source_id"] for n in exclude_rebuild]):
-                    continue
-            elif exclude_rebuild in d["source_id"]:
+    for d in await search_graph_rows(tenant_id, kb_id, {"knowledge_graph_kwd": ["subgraph"]}, flds, bs=256):
+        assert d["knowledge_graph_kwd"] == "subgraph"
+        if isinstance(exclude_rebuild, list):
+            if sum([n in d["source_id"] for n in exclude_rebuild]):
                 continue
-            
-            next_graph = json_graph.node_link_graph(json.loads(d["content_with_weight"]), edges="edges")
-            merged_graph = nx.compose(graph, next_graph)
-            merged_source = {
-                n: graph.nodes[n]["source_id"] + next_graph.nodes[n]["source_id"]
-                for n in graph.nodes & next_graph.nodes
-            }
-            nx.set_node_attributes(merged_graph, merged_source, "source_id")
-            if "source_id" in graph.graph:
-                merged_graph.graph["source_id"] = graph.graph["source_id"] + next_graph.graph["source_id"]
-            else:
-                merged_graph.graph["source_id"] = next_graph.graph["source_id"]
-            graph = merged_graph
+        elif exclude_rebuild in d["source_id"]:
+            continue
+
+        next_graph = json_graph.node_link_graph(json.loads(d["content_with_weight"]), edges="edges")
+        merged_graph = nx.compose(graph, next_graph)
+        merged_source = {
+            n: graph.nodes[n]["source_id"] + next_graph.nodes[n]["source_id"]
+            for n in graph.nodes & next_graph.nodes
+        }
+        nx.set_node_attributes(merged_graph, merged_source, "source_id")
+        if "source_id" in graph.graph:
+            merged_graph.graph["source_id"] = graph.graph["source_id"] + next_graph.graph["source_id"]
+        else:
+            merged_graph.graph["source_id"] = next_graph.graph["source_id"]
+        graph = merged_graph
 
     if len(graph.nodes) == 0:
         return None
@@ -14,7 +14,7 @@
 #  limitations under the License.
 #
 
-import copy
+import math
 import re
 from io import BytesIO
 from xpinyin import Pinyin
@@ -32,41 +32,24 @@ from deepdoc.parser import ExcelParser
 class Excel(ExcelParser):
     def __call__(self, fnm, binary=None, from_page=0,
                  to_page=10000000000, callback=None):
-        if not binary:
-            wb = Excel._load_excel_to_workbook(fnm)
-        else:
-            wb = Excel._load_excel_to_workbook(BytesIO(binary))
-        total = 0
-        for sheetname in wb.sheetnames:
-            total += len(list(wb[sheetname].rows))
-
         res, fails, done = [], [], 0
-        rn = 0
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
-                continue
-            headers = [cell.value for cell in rows[0]]
+        rn = from_page
+        sheets = Excel._iter_sheets(BytesIO(binary) if binary else fnm, from_row=from_page, to_row=to_page)
+        for sheetname, headers, rows in sheets:
+            width = len(headers)
             missed = set([i for i, h in enumerate(headers) if h is None])
-            headers = [
-                cell.value for i,
-                cell in enumerate(
-                    rows[0]) if i not in missed]
-            if not headers:
-                continue
+            headers = [h for i, h in enumerate(headers) if i not in missed]
             data = []
-            for i, r in enumerate(rows[1:]):
+            for r in rows:
                 rn += 1
-                if rn - 1 < from_page:
+                r = list(r)
+                # read-only rows are padded, or not, to the sheet width: only values past the header fail the row
+                if any(v is not None for v in r[width:]):
+                    fails.append(str(rn))
                     continue
-                if rn - 1 >= to_page:
-                    break
-                row = [
-                    cell.value for ii,
-                    cell in enumerate(r) if ii not in missed]
-                if len(row) != len(headers):
-                    fails.append(str(i))
+                r = (r + [None] * width)[:width]
+                row = [v for ii, v in enumerate(r) if ii not in missed]
+                if not headers:
                     continue
                 data.append(row)
                 done += 1
@@ -74,7 +57,7 @@ class Excel(ExcelParser):
                 continue
             res.append(pd.DataFrame(np.array(data), columns=headers))
 
-        callback(0.3, ("Extract records: {}~{}".format(from_page + 1, min(to_page, from_page + rn)) + (
+        callback(0.3, ("Extract records: {}~{}".format(from_page + 1, rn) + (
             f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
         return res
 
@@ -188,6 +171,9 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000,
         "float": "_flt",
         "datetime": "_dt",
         "bool": "_kwd"}
+    title_tks = rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))
+    eng = lang.lower() == "english"  # is_english(txts)
+    field_map = {}
     for df in dfs:
         for n in ["id", "_id", "index", "idx"]:
             if n in df.columns:
@@ -196,7 +182,6 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000,
         if len(clmns) != len(set(clmns)):
             duplicates = [col for col in clmns if list(clmns).count(col) > 1]
             raise ValueError(f"Duplicate column names detected: {set(duplicates)}")
-        txts = list(copy.deepcopy(clmns))
         py_clmns = [
             PY.get_pinyins(
                 re.sub(
@@ -205,40 +190,40 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000,
                     str(n)),
                 '_')[0] for n in clmns]
         clmn_tys = []
+        # Per column: the field value of every row, None where the cell is empty,
+        # and the "column:value" text it contributes to the row.
+        clmn_flds, clmn_txts = [], []
         for j in range(len(clmns)):
             cln, ty = column_data_type(df[clmns[j]])
             clmn_tys.append(ty)
-            df[clmns[j]] = cln
+            cln = [None if c is None or (isinstance(c, float) and math.isnan(c)) or not str(c) else c
+                   for c in cln]
             if ty == "text":
-                txts.extend([str(c) for c in cln if c])
+                # categorical columns repeat a handful of values, tokenize each once
+                tks = {c: rag_tokenizer.tokenize(c) for c in set(cln) if c is not None}
+                clmn_flds.append([None if c is None else tks[c] for c in cln])
+            else:
+                clmn_flds.append(cln)
+            clmn_txts.append([None if c is None else "{}:{}".format(clmns[j], c) for c in cln])
         clmns_map = [(py_clmns[i].lower() + fieds_map[clmn_tys[i]], str(clmns[i]).replace("_", " "))
                      for i in range(len(clmns))]
 
-        eng = lang.lower() == "english"  # is_english(txts)
-        for ii, row in df.iterrows():
+        flds = [f for f, _ in clmns_map]
+        for row_flds, row_txts in zip(zip(*clmn_flds), zip(*clmn_txts)):
+            row_txt = [t for t in row_txts if t is not None]
+            if not row_txt:
+                continue
             d = {
                 "docnm_kwd": filename,
-                "title_tks": rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))
+                "title_tks": title_tks
             }
-            row_txt = []
-            for j in range(len(clmns)):
-                if row[clmns[j]] is None:
-                    continue
-                if not str(row[clmns[j]]):
-                    continue
-                if not isinstance(row[clmns[j]], pd.Series) and pd.isna(row[clmns[j]]):
-                    continue
-                fld = clmns_map[j][0]
-                d[fld] = row[clmns[j]] if clmn_tys[j] != "text" else rag_tokenizer.tokenize(
-                    row[clmns[j]])
-                row_txt.append("{}:{}".format(clmns[j], row[clmns[j]]))
-            if not row_txt:
-                continue
+            d.update((f, v) for f, v in zip(flds, row_flds) if v is not None)
             tokenize(d, "; ".join(row_txt), eng)
             res.append(d)
 
-        KnowledgebaseService.update_parser_config(
-            kwargs["kb_id"], {"field_map": {k: v for k, v in clmns_map}})
+        field_map.update(clmns_map)
+    if field_map:
+        KnowledgebaseService.update_parser_config(kwargs["kb_id"], {"field_map": field_map})
     callback(0.35, "")
 
     return res
@@ -248,11 +248,18 @@ def is_chinese(text):
     return False
 
 
+def strip_table_tags(t):
+    return re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", t)
+
+
+def set_tokens(d, ltks):
+    d["content_ltks"] = ltks
+    d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(ltks)
+
+
 def tokenize(d, t, eng):
     d["content_with_weight"] = t
-    t = re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", t)
-    d["content_ltks"] = rag_tokenizer.tokenize(t)
-    d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+    set_tokens(d, rag_tokenizer.tokenize(strip_table_tags(t)))
 
 
 def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
@@ -272,8 +279,12 @@ def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
                 pass
         else:
             add_positions(d, [[ii]*5])
-        tokenize(d, ck, eng)
+        d["content_with_weight"] = ck
         res.append(d)
+    # tokenize as one batch so that it can fan out to the tokenizer's process pool
+    ltks = rag_tokenizer.tokenize_many([strip_table_tags(d["content_with_weight"]) for d in res])
+    for d, tks in zip(res, ltks):
+        set_tokens(d, tks)
     return res
 
 def tokenize_chunks_with_images(chunks, doc, eng, images):
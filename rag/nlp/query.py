@@ -19,6 +19,8 @@ import json
 import re
 from collections import defaultdict
 
+import numpy as np
+
 from rag.utils.doc_store_conn import MatchTextExpr
 from rag.nlp import rag_tokenizer, term_weight, synonym
 
@@ -205,28 +207,45 @@ class FulltextQueryer:
         return None, keywords
 
     def hybrid_similarity(self, avec, bvecs, atks, btkss, tkweight=0.3, vtweight=0.7):
-        from sklearn.metrics.pairwise import cosine_similarity as CosineSimilarity
-        import numpy as np
-
-        sims = CosineSimilarity([avec], bvecs)
+        sims = self.vector_similarity(avec, bvecs)
         tksim = self.token_similarity(atks, btkss)
-        if np.sum(sims[0]) == 0:
-            return np.array(tksim), tksim, sims[0]
-        return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
+        if np.sum(sims) == 0:
+            return np.array(tksim), tksim, sims
+        return sims * vtweight + np.array(tksim) * tkweight, tksim, sims
+
+    @staticmethod
+    def vector_similarity(avec, bvecs):
+        """Cosine similarity of one query vector against a (n, d) matrix of candidates in a single matmul."""
+        avec = np.asarray(avec, dtype=np.float32).reshape(-1)
+        bvecs = np.asarray(bvecs, dtype=np.float32)
+        if bvecs.ndim == 1:
+            bvecs = bvecs.reshape(1, -1)
+        anorm = np.linalg.norm(avec)
+        bnorm = np.linalg.norm(bvecs, axis=1)
+        bnorm[bnorm == 0] = 1.
+        return (bvecs @ avec) / bnorm / (anorm if anorm else 1.)
 
     def token_similarity(self, atks, btkss):
-        def toDict(tks):
+        if isinstance(atks, str):
+            atks = atks.split()
+        qtwt = defaultdict(int)
+        for t, c in self.tw.weights(atks, preprocess=False):
+            qtwt[t] += c
+        # Only the presence of a query term in a candidate counts, so candidates
+        # are reduced to token sets instead of being weighted term by term.
+        q = 1e-9 + sum(qtwt.values())
+        sims = []
+        for tks in btkss:
             if isinstance(tks, str):
-                tks = tks.split()
-            d = defaultdict(int)
-            wts = self.tw.weights(tks, preprocess=False)
-            for i, (t, c) in enumerate(wts):
-                d[t] += c
-            return d
-
-        atks = toDict(atks)
-        btkss = [toDict(tks) for tks in btkss]
-        return [self.similarity(atks, btks) for btks in btkss]
+                tks = set(tks.split())
+            elif not isinstance(tks, (set, frozenset)):
+                tks = set(tks)
+            s = 1e-9
+            for t, w in qtwt.items():
+                if t in tks:
+                    s += w
+            sims.append(s / q)
+        return sims
 
     def similarity(self, qtwt, dtwt):
         if isinstance(dtwt, type("")):
@@ -18,15 +18,26 @@ import logging
 import copy
 import datrie
 import math
+import multiprocessing
 import os
 import re
 import string
 import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from hanziconv import HanziConv
 from nltk import word_tokenize
 from nltk.stem import PorterStemmer, WordNetLemmatizer
 from api.utils.file_utils import get_project_base_directory
 
+ENGLISH_CACHE_SIZE = int(os.environ.get("TOKENIZER_ENGLISH_CACHE_SIZE", 100000))
+TOKENIZER_PROCESSES = int(os.environ.get("TOKENIZER_PROCESSES", 0))
+
+# Full-width forms (U+FF00~U+FF5E) map to ASCII by an offset of 0xFEE0, and the ideographic space to a space.
+Q2B_TABLE = {c: c - 0xfee0 for c in range(0xff00, 0xff5f)}
+Q2B_TABLE[0x3000] = 0x0020
+
 
 class RagTokenizer:
     def key_(self, line):
@@ -65,6 +76,8 @@ class RagTokenizer:
 
         self.stemmer = PorterStemmer()
         self.lemmatizer = WordNetLemmatizer()
+        # English words repeat heavily across chunks, and lemmatize+stem dominates tokenizing English text.
+        self.stem_lemma_ = lru_cache(maxsize=ENGLISH_CACHE_SIZE)(lambda t: self.stemmer.stem(self.lemmatizer.lemmatize(t)))
 
         self.SPLIT_CHAR = r"([ ,\.<>/?;:'\[\]\\`!@#$%^&*\(\)\{\}\|_+=《》，。？、；‘’：“”【】~！￥%……（）——-]+|[a-zA-Z0-9,\.-]+)"
 
@@ -100,18 +113,7 @@ class RagTokenizer:
 
     def _strQ2B(self, ustring):
         """Convert full-width characters to half-width characters"""
-        rstring = ""
-        for uchar in ustring:
-            inside_code = ord(uchar)
-            if inside_code == 0x3000:
-                inside_code = 0x0020
-            else:
-                inside_code -= 0xfee0
-            if inside_code < 0x0020 or inside_code > 0x7e:  # After the conversion, if it's not a half-width character, return the original character.
-                rstring += uchar
-            else:
-                rstring += chr(inside_code)
-        return rstring
+        return ustring.translate(Q2B_TABLE)
 
     def _tradi2simp(self, line):
         return HanziConv.toSimplified(line)
@@ -294,7 +296,7 @@ class RagTokenizer:
         return self.score_(res[::-1])
 
     def english_normalize_(self, tks):
-        return [self.stemmer.stem(self.lemmatizer.lemmatize(t)) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
+        return [self.stem_lemma_(t) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
 
     def _split_by_lang(self, line):
         txt_lang_pairs = []
@@ -328,7 +330,7 @@ class RagTokenizer:
         res = []
         for L,lang in arr:
             if not lang:
-                res.extend([self.stemmer.stem(self.lemmatizer.lemmatize(t)) for t in word_tokenize(L)])
+                res.extend([self.stem_lemma_(t) for t in word_tokenize(L)])
                 continue
             if len(L) < 2 or re.match(
                     r"[a-z\.-]+$", L) or re.match(r"[0-9\.-]+$", L):
@@ -466,6 +468,36 @@ def naiveQie(txt):
 
 tokenizer = RagTokenizer()
 tokenize = tokenizer.tokenize
+_tokenize_pool = None
+_tokenize_pool_lock = threading.Lock()
+
+
+def _tokenize_line(line):
+    # module-level so that the pool pickles it by reference instead of pickling the tokenizer
+    return tokenize(line)
+
+
+def tokenize_many(lines, processes=None, chunksize=64):
+    """
+    Tokenizes many lines, fanning out to a process pool when `processes` (or TOKENIZER_PROCESSES) is above 1.
+    Results are identical to calling tokenize() line by line, in the same order.
+    """
+    global _tokenize_pool
+    processes = processes if processes is not None else TOKENIZER_PROCESSES
+    if processes <= 1 or len(lines) < chunksize * 2:
+        return [tokenize(line) for line in lines]
+    with _tokenize_pool_lock:
+        if _tokenize_pool is None or _tokenize_pool._max_workers != processes:
+            if _tokenize_pool is not None:
+                _tokenize_pool.shutdown(wait=False)
+            # workers are not forked from this process, whose other threads may hold locks
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _tokenize_pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context(method))
+        # map submits every chunk before returning, so no other thread can shut the pool down under it
+        results = _tokenize_pool.map(_tokenize_line, lines, chunksize=chunksize)
+    return list(results)
+
+
 fine_grained_tokenize = tokenizer.fine_grained_tokenize
 tag = tokenizer.tag
 freq = tokenizer.freq
@@ -13,10 +13,10 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import itertools
 import logging
 import re
 import math
-from collections import OrderedDict
 from dataclasses import dataclass
 
 from rag.settings import TAG_FLD, PAGERANK_FLD
@@ -24,6 +24,7 @@ from rag.utils import rmSpace, get_float
 from rag.nlp import rag_tokenizer, query
 import numpy as np
 from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr
+from rag.utils.retrieval_cache import RETRIEVAL_CACHE
 
 
 def index_name(uid): return f"ragflow_{uid}"
@@ -211,6 +212,7 @@ class Dealer:
 
         assert len(ans_v[0]) == len(chunk_v[0]), "The dimension of query and chunk do not match: {} vs. {}".format(
             len(ans_v[0]), len(chunk_v[0]))
+        chunk_v = np.asarray(chunk_v, dtype=np.float32)
 
         chunks_tks = [rag_tokenizer.tokenize(self.qryr.rmWWW(ck)).split()
                       for ck in chunks]
@@ -284,26 +286,32 @@ class Dealer:
         _, keywords = self.qryr.question(query)
         vector_size = len(sres.query_vector)
         vector_column = f"q_{vector_size}_vec"
-        zero_vector = [0.0] * vector_size
-        ins_embd = []
-        for chunk_id in sres.ids:
-            vector = sres.field[chunk_id].get(vector_column, zero_vector)
-            if isinstance(vector, str):
-                vector = [get_float(v) for v in vector.split("\t")]
-            ins_embd.append(vector)
-        if not ins_embd:
+        if not sres.ids:
             return [], [], []
+        # one contiguous matrix for all candidates, scored with a single matmul
+        ins_embd = np.zeros((len(sres.ids), vector_size), dtype=np.float32)
+        for i, chunk_id in enumerate(sres.ids):
+            vector = sres.field[chunk_id].get(vector_column)
+            if vector is None:
+                continue
+            if isinstance(vector, str):
+                try:
+                    vector = np.array(vector.split("\t"), dtype=np.float32)
+                except ValueError:
+                    vector = [get_float(v) for v in vector.split("\t")]
+            ins_embd[i] = vector
 
         for i in sres.ids:
             if isinstance(sres.field[i].get("important_kwd", []), str):
                 sres.field[i]["important_kwd"] = [sres.field[i]["important_kwd"]]
+        # Token similarity only checks whether a query term occurs in the chunk,
+        # so each chunk is reduced to the set of its indexed terms.
         ins_tw = []
         for i in sres.ids:
-            content_ltks = list(OrderedDict.fromkeys(sres.field[i][cfield].split()))
-            title_tks = [t for t in sres.field[i].get("title_tks", "").split() if t]
-            question_tks = [t for t in sres.field[i].get("question_tks", "").split() if t]
-            important_kwd = sres.field[i].get("important_kwd", [])
-            tks = content_ltks + title_tks * 2 + important_kwd * 5 + question_tks * 6
+            tks = set(sres.field[i][cfield].split())
+            tks.update(sres.field[i].get("title_tks", "").split())
+            tks.update(sres.field[i].get("question_tks", "").split())
+            tks.update(sres.field[i].get("important_kwd", []))
             ins_tw.append(tks)
 
         ## For rank feature(tag_fea) scores.
@@ -353,6 +361,20 @@ class Dealer:
         if not question:
             return ranks
 
+        if isinstance(tenant_ids, str):
+            tenant_ids = tenant_ids.split(",")
+
+        cache_key = None
+        if RETRIEVAL_CACHE.enabled:
+            cache_key = RETRIEVAL_CACHE.key(question, tenant_ids, kb_ids, embd_mdl, rerank_mdl,
+                                            doc_ids=doc_ids, page=page, page_size=page_size,
+                                            similarity_threshold=similarity_threshold,
+                                            vector_similarity_weight=vector_similarity_weight, top=top,
+                                            aggs=aggs, highlight=highlight, rank_feature=rank_feature)
+            cached = RETRIEVAL_CACHE.get(cache_key) if cache_key else None
+            if cached is not None:
+                return cached
+
         RERANK_LIMIT = 64
         RERANK_LIMIT = int(RERANK_LIMIT//page_size + ((RERANK_LIMIT%page_size)/(page_size*1.) + 0.5)) * page_size if page_size>1 else 1
         if RERANK_LIMIT < 1: ## when page_size is very large the RERANK_LIMIT will be 0.
@@ -362,10 +384,6 @@ class Dealer:
                "similarity": similarity_threshold,
                "available_int": 1}
 
-
-        if isinstance(tenant_ids, str):
-            tenant_ids = tenant_ids.split(",")
-
         sres = self.search(req, [index_name(tid) for tid in tenant_ids],
                            kb_ids, embd_mdl, highlight, rank_feature=rank_feature)
 
@@ -435,6 +453,8 @@ class Dealer:
                                                                    key=lambda x: x[1]["count"] * -1)]
         ranks["chunks"] = ranks["chunks"][:page_size]
 
+        if cache_key:
+            RETRIEVAL_CACHE.set(cache_key, ranks)
         return ranks
 
     def sql_retrieval(self, sql, fetch_size=128, format="json"):
@@ -445,20 +465,12 @@ class Dealer:
                    kb_ids: list[str], max_count=1024,
                    offset=0,
                    fields=["docnm_kwd", "content_with_weight", "img_id"]):
-        condition = {"doc_id": doc_id}
-        res = []
-        bs = 128
-        for p in range(offset, max_count, bs):
-            es_res = self.dataStore.search(fields, [], condition, [], OrderByExpr(), p, bs, index_name(tenant_id),
-                                           kb_ids)
-            dict_chunks = self.dataStore.getFields(es_res, fields)
-            for id, doc in dict_chunks.items():
-                doc["id"] = id
-            if dict_chunks:
-                res.extend(dict_chunks.values())
-            if len(dict_chunks.values()) < bs:
-                break
-        return res
+        return list(itertools.islice(self.iter_chunks(doc_id, tenant_id, kb_ids, fields), offset, max_count))
+
+    def iter_chunks(self, doc_id: str, tenant_id: str, kb_ids: list[str],
+                    fields=["docnm_kwd", "content_with_weight", "img_id"], batch_size=1024):
+        """Yields every chunk of a document lazily, with a cursor on engines that have one."""
+        yield from self.dataStore.scan(fields, {"doc_id": doc_id}, index_name(tenant_id), kb_ids, batch_size)
 
     def all_tags(self, tenant_id: str, kb_ids: list[str], S=1000):
         if not self.dataStore.indexExist(index_name(tenant_id), kb_ids[0]):
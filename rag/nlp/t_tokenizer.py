@@ -0,0 +1,60 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Corpus-level throughput benchmark of RagTokenizer.tokenize and tokenize_many.
+
+    python rag/nlp/t_tokenizer.py corpus.txt --processes 4
+"""
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+from timeit import default_timer as timer
+
+from rag.nlp import rag_tokenizer
+
+
+def main(args):
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    chars = sum(len(line) for line in lines)
+
+    st = timer()
+    sequential = [rag_tokenizer.tokenize(line) for line in lines]
+    el = timer() - st
+    print(f"tokenize:      {len(lines)} lines, {chars / el / 1024:.1f} K chars/s")
+
+    st = timer()
+    batched = rag_tokenizer.tokenize_many(lines, processes=args.processes)
+    el = timer() - st
+    print(f"tokenize_many: {len(lines)} lines, {chars / el / 1024:.1f} K chars/s ({args.processes} processes)")
+
+    assert batched == sequential, "tokenize_many output differs from tokenize"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('corpus', help="text file, one passage per line")
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    main(parser.parse_args())
@@ -57,6 +57,20 @@ except Exception:
     pass
 DOC_MAXIMUM_SIZE = int(os.environ.get("MAX_CONTENT_LENGTH", 128 * 1024 * 1024))
 
+# Embedding cache: "memory" keeps a per-process LRU, "redis" adds a shared tier behind it, "none" disables it.
+# Shared by default when Redis is configured, so a re-parse picked up by another task executor still hits.
+EMBEDDING_CACHE_TYPE = os.environ.get("EMBEDDING_CACHE_TYPE", "redis" if REDIS else "memory").lower()
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_MB", 256)) * 1024 * 1024
+EMBEDDING_CACHE_TTL = int(os.environ.get("EMBEDDING_CACHE_TTL", 7 * 24 * 3600))
+
+# Retrieval cache: "memory" keeps a per-process LRU of Dealer.retrieval results, "none" disables it.
+RETRIEVAL_CACHE_TYPE = os.environ.get("RETRIEVAL_CACHE_TYPE", "memory").lower()
+RETRIEVAL_CACHE_MAX_BYTES = int(os.environ.get("RETRIEVAL_CACHE_MAX_MB", 64)) * 1024 * 1024
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", 600))
+# Writes become searchable on the next index refresh (refresh_interval in conf/mapping.json): KB versions are bumped
+# again this many seconds after a write, so results cached in between go stale too.
+RETRIEVAL_CACHE_REBUMP_DELAY = float(os.environ.get("RETRIEVAL_CACHE_REBUMP_DELAY", 2))
+
 SVR_QUEUE_NAME = "rag_flow_svr_queue"
 SVR_CONSUMER_GROUP_NAME = "rag_flow_svr_task_broker"
 PAGERANK_FLD = "pagerank_fea"
@@ -32,9 +32,9 @@ from datetime import datetime
 import json
 import xxhash
 import copy
+import itertools
 import re
 from functools import partial
-from io import BytesIO
 from multiprocessing.context import TimeoutError
 from timeit import default_timer as timer
 import tracemalloc
@@ -59,7 +59,8 @@ from rag.app import laws, paper, presentation, manual, qa, table, book, resume,
 from rag.nlp import search, rag_tokenizer
 from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
 from rag.settings import DOC_MAXIMUM_SIZE, SVR_CONSUMER_GROUP_NAME, get_svr_queue_name, get_svr_queue_names, print_rag_settings, TAG_FLD, PAGERANK_FLD
-from rag.utils import num_tokens_from_string, truncate
+from rag.utils import num_tokens_from_string, encoder, image_digest, image_binary
+from rag.utils.embed_cache import EMBEDDING_CACHE
 from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
 from rag.utils.storage_factory import STORAGE_IMPL
 from graphrag.utils import chat_limiter
@@ -103,7 +104,22 @@ MAX_CONCURRENT_MINIO = int(os.environ.get('MAX_CONCURRENT_MINIO', '10'))
 task_limiter = trio.CapacityLimiter(MAX_CONCURRENT_TASKS)
 chunk_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
 minio_limiter = trio.CapacityLimiter(MAX_CONCURRENT_MINIO)
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', '64'))
+EMBEDDING_BATCH_TOKENS = int(os.environ.get('EMBEDDING_BATCH_TOKENS', '32768'))
+MAX_CONCURRENT_EMBEDDINGS = int(os.environ.get('MAX_CONCURRENT_EMBEDDINGS', '4'))
+DOC_BULK_SIZE = int(os.environ.get('DOC_BULK_SIZE', '1024'))
+DOC_BULK_BYTES = int(os.environ.get('DOC_BULK_BYTES', str(16 * 1024 * 1024)))
+MAX_CONCURRENT_BULKS = int(os.environ.get('MAX_CONCURRENT_BULKS', '2'))
+embedding_limiters = {}
 WORKER_HEARTBEAT_TIMEOUT = int(os.environ.get('WORKER_HEARTBEAT_TIMEOUT', '120'))
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', '2'))
+CANCEL_CHECK_INTERVAL = float(os.environ.get('CANCEL_CHECK_INTERVAL', '3'))
+# task id -> {"msgs": [...], "progress": latest progress or None}, written by flush_progress
+PENDING_PROGRESS = {}
+PROGRESS_FLUSHED_AT = {}
+CANCEL_FLAGS = {}
+progress_lock = threading.Lock()
+progress_flush_lock = threading.Lock()
 stop_event = threading.Event()
 
 
@@ -151,11 +167,53 @@ class TaskCanceledException(Exception):
         self.msg = msg
 
 
+def is_canceled(task_id):
+    """Whether the task's document was canceled, looked up at most once per CANCEL_CHECK_INTERVAL."""
+    now = time.monotonic()
+    checked = CANCEL_FLAGS.get(task_id)
+    if checked and (checked[1] or now - checked[0] < CANCEL_CHECK_INTERVAL):
+        return checked[1]
+    canceled = TaskService.do_cancel(task_id)
+    CANCEL_FLAGS[task_id] = (now, canceled)
+    return canceled
+
+
+def flush_progress(task_id=None, force=True):
+    """
+    Writes the buffered progress of a task, or of every task not flushed within
+    PROGRESS_FLUSH_INTERVAL, as one update per task.
+    """
+    with progress_flush_lock:
+        now = time.monotonic()
+        with progress_lock:
+            task_ids = [task_id] if task_id else list(PENDING_PROGRESS.keys())
+            due = {}
+            for tid in task_ids:
+                if tid not in PENDING_PROGRESS:
+                    continue
+                if not force and now - PROGRESS_FLUSHED_AT.get(tid, 0) < PROGRESS_FLUSH_INTERVAL:
+                    continue
+                due[tid] = PENDING_PROGRESS.pop(tid)
+                PROGRESS_FLUSHED_AT[tid] = now
+        for tid, pending in due.items():
+            d = {"progress_msg": "\n".join(pending["msgs"])}
+            if pending["progress"] is not None:
+                d["progress"] = pending["progress"]
+            try:
+                TaskService.update_progress(tid, d)
+            except DoesNotExist:
+                logging.warning(f"flush_progress({tid}) got exception DoesNotExist")
+            except Exception:
+                logging.exception(f"flush_progress({tid}), progress: {d.get('progress')}, progress_msg: {d['progress_msg']}, got exception")
+        if due:
+            close_connection()
+
+
 def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing..."):
     try:
         if prog is not None and prog < 0:
             msg = "[ERROR]" + msg
-        cancel = TaskService.do_cancel(task_id)
+        cancel = is_canceled(task_id)
 
         if cancel:
             msg += " [Canceled]"
@@ -167,13 +225,18 @@ def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing...
                     msg = f"Page({from_page + 1}~{to_page + 1}): " + msg
         if msg:
             msg = datetime.now().strftime("%H:%M:%S") + " " + msg
-        d = {"progress_msg": msg}
-        if prog is not None:
-            d["progress"] = prog
 
-        TaskService.update_progress(task_id, d)
+        with progress_lock:
+            pending = PENDING_PROGRESS.setdefault(task_id, {"msgs": [], "progress": None})
+            if msg:
+                pending["msgs"].append(msg)
+            if prog is not None:
+                pending["progress"] = prog
+            due = time.monotonic() - PROGRESS_FLUSHED_AT.get(task_id, 0) >= PROGRESS_FLUSH_INTERVAL
+        # Failures and completion are written right away, everything else coalesces until the next flush.
+        if due or (prog is not None and (prog < 0 or prog >= 1)):
+            flush_progress(task_id)
 
-        close_connection()
         if cancel:
             raise TaskCanceledException(msg)
         logging.info(f"set_progress({task_id}), progress: {prog}, progress_msg: {msg}")
@@ -182,6 +245,13 @@ def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing...
     except Exception:
         logging.exception(f"set_progress({task_id}), progress: {prog}, progress_msg: {msg}, got exception")
 
+
+async def progress_flusher():
+    while not stop_event.is_set():
+        await trio.sleep(PROGRESS_FLUSH_INTERVAL)
+        await trio.to_thread.run_sync(lambda: flush_progress(force=False))
+
+
 async def collect():
     global CONSUMER_NAME, DONE_TASKS, FAILED_TASKS
     global UNACKED_ITERATOR
@@ -274,30 +344,38 @@ async def build_chunks(task, progress_callback):
         doc[PAGERANK_FLD] = int(task["pagerank"])
     st = timer()
 
+    # Chunks cut from the same figure or page region carry the same picture: objects are named
+    # after the content, and each distinct image is encoded and put once per task.
+    image_uploads = {}
+
+    async def upload_image(name, image):
+        binary = await trio.to_thread.run_sync(image_binary, image)
+        async with minio_limiter:
+            await trio.to_thread.run_sync(lambda: STORAGE_IMPL.put(task["kb_id"], name, binary))
+
     async def upload_to_minio(document, chunk):
         try:
-            async with minio_limiter:
-                d = copy.deepcopy(document)
-                d.update(chunk)
-                d["id"] = xxhash.xxh64((chunk["content_with_weight"] + str(d["doc_id"])).encode("utf-8")).hexdigest()
-                d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
-                d["create_timestamp_flt"] = datetime.now().timestamp()
-                if not d.get("image"):
-                    _ = d.pop("image", None)
-                    d["img_id"] = ""
-                    docs.append(d)
-                    return
-
-                output_buffer = BytesIO()
-                if isinstance(d["image"], bytes):
-                    output_buffer = BytesIO(d["image"])
-                else:
-                    d["image"].save(output_buffer, format='JPEG')
-                await trio.to_thread.run_sync(lambda: STORAGE_IMPL.put(task["kb_id"], d["id"], output_buffer.getvalue()))
-
-                d["img_id"] = "{}-{}".format(task["kb_id"], d["id"])
-                del d["image"]
+            d = copy.deepcopy(document)
+            d.update(chunk)
+            d["id"] = xxhash.xxh64((chunk["content_with_weight"] + str(d["doc_id"])).encode("utf-8")).hexdigest()
+            d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
+            d["create_timestamp_flt"] = datetime.now().timestamp()
+            image = d.pop("image", None)
+            if not image:
+                d["img_id"] = ""
                 docs.append(d)
+                return
+
+            name = await trio.to_thread.run_sync(image_digest, image)
+            if name in image_uploads:
+                await image_uploads[name].wait()
+            else:
+                image_uploads[name] = trio.Event()
+                await upload_image(name, image)
+                image_uploads[name].set()
+
+            d["img_id"] = "{}-{}".format(task["kb_id"], name)
+            docs.append(d)
         except Exception:
             logging.exception(
                 "Saving image of chunk {}/{}/{} got exception".format(task["location"], task["name"], d["id"]))
@@ -399,10 +477,36 @@ def init_kb(row, vector_size: int):
     return settings.docStoreConn.createIdx(idxnm, row.get("kb_id", ""), vector_size)
 
 
+def embedding_batches(texts, max_length, batch_size=None, batch_tokens=None):
+    """Packs consecutive texts into (start, end, truncated_texts) batches bounded by input count and token budget."""
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    batch_tokens = batch_tokens or EMBEDDING_BATCH_TOKENS
+    start, batch, tokens = 0, [], 0
+    for i, t in enumerate(texts):
+        tks = encoder.encode(t)
+        if len(tks) > max_length - 10:
+            tks = tks[:max_length - 10]
+            t = encoder.decode(tks)
+        n = len(tks)
+        if batch and (len(batch) >= batch_size or tokens + n > batch_tokens):
+            yield start, i, batch
+            start, batch, tokens = i, [], 0
+        batch.append(t)
+        tokens += n
+    if batch:
+        yield start, len(texts), batch
+
+
+def get_embedding_limiter(mdl):
+    key = (getattr(mdl, "tenant_id", ""), getattr(mdl, "llm_name", ""))
+    if key not in embedding_limiters:
+        embedding_limiters[key] = trio.CapacityLimiter(MAX_CONCURRENT_EMBEDDINGS)
+    return embedding_limiters[key]
+
+
 async def embedding(docs, mdl, parser_config=None, callback=None):
     if parser_config is None:
         parser_config = {}
-    batch_size = 16
     tts, cnts = [], []
     for d in docs:
         tts.append(d.get("docnm_kwd", "Title"))
@@ -415,40 +519,52 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
         cnts.append(c)
 
     tk_count = 0
+    title_vec = None
     if len(tts) == len(cnts):
         vts, c = await trio.to_thread.run_sync(lambda: mdl.encode(tts[0: 1]))
-        tts = np.concatenate([vts for _ in range(len(tts))], axis=0)
+        title_vec = np.asarray(vts[0], dtype=np.float32)
         tk_count += c
 
-    cnts_ = np.array([])
-    for i in range(0, len(cnts), batch_size):
-        vts, c = await trio.to_thread.run_sync(lambda: mdl.encode([truncate(c, mdl.max_length-10) for c in cnts[i: i + batch_size]]))
-        if len(cnts_) == 0:
-            cnts_ = vts
-        else:
-            cnts_ = np.concatenate((cnts_, vts), axis=0)
+    # All batches write into one preallocated matrix, sized once the first batch reveals the dimension.
+    vects = None
+    done = 0
+    limiter = get_embedding_limiter(mdl)
+
+    async def encode_batch(start, end, batch):
+        nonlocal vects, tk_count, done
+        async with limiter:
+            vts, c = await trio.to_thread.run_sync(lambda: mdl.encode(batch))
+        vts = np.asarray(vts, dtype=np.float32)
+        if vects is None:
+            vects = np.empty((len(cnts), vts.shape[1]), dtype=np.float32)
+        vects[start:end] = vts
         tk_count += c
-        callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
-    cnts = cnts_
+        done += end - start
+        if callback:
+            callback(prog=0.7 + 0.2 * done / len(cnts), msg="")
+
+    async with trio.open_nursery() as nursery:
+        batches = await trio.to_thread.run_sync(lambda: list(embedding_batches(cnts, mdl.max_length)))
+        for start, end, batch in batches:
+            nursery.start_soon(encode_batch, start, end, batch)
 
-    title_w = float(parser_config.get("filename_embd_weight", 0.1))
-    vects = (title_w * tts + (1 - title_w) *
-             cnts) if len(tts) == len(cnts) else cnts
+    if title_vec is not None:
+        title_w = float(parser_config.get("filename_embd_weight", 0.1))
+        vects *= (1 - title_w)
+        vects += title_w * title_vec
 
     assert len(vects) == len(docs)
-    vector_size = 0
+    vector_size = vects.shape[1]
     for i, d in enumerate(docs):
-        v = vects[i].tolist()
-        vector_size = len(v)
-        d["q_%d_vec" % len(v)] = v
+        d["q_%d_vec" % vector_size] = vects[i].tolist()
     return tk_count, vector_size
 
 
 async def run_raptor(row, chat_mdl, embd_mdl, vector_size, callback=None):
     chunks = []
     vctr_nm = "q_%d_vec"%vector_size
-    for d in settings.retrievaler.chunk_list(row["doc_id"], row["tenant_id"], [str(row["kb_id"])],
-                                             fields=["content_with_weight", vctr_nm]):
+    for d in settings.retrievaler.iter_chunks(row["doc_id"], row["tenant_id"], [str(row["kb_id"])],
+                                              fields=["content_with_weight", vctr_nm]):
         chunks.append((d["content_with_weight"], np.array(d[vctr_nm])))
 
     raptor = Raptor(
@@ -485,6 +601,69 @@ async def run_raptor(row, chat_mdl, embd_mdl, vector_size, callback=None):
     return res, tk_count
 
 
+def estimate_chunk_bytes(chunk):
+    """Cheap upper-bound estimate of a chunk's serialized size, used to cut bulk requests."""
+    size = 0
+    for k, v in chunk.items():
+        size += len(k) + 4
+        if isinstance(v, str):
+            size += len(v.encode("utf-8"))
+        elif isinstance(v, (list, tuple)):
+            size += sum(len(x.encode("utf-8")) if isinstance(x, str) else 24 for x in v)
+        else:
+            size += 24
+    return size
+
+
+def bulk_batches(chunks, bulk_size=None, bulk_bytes=None):
+    """Groups consecutive chunks into bulk requests bounded by document count and estimated bytes."""
+    bulk_size = bulk_size or DOC_BULK_SIZE
+    bulk_bytes = bulk_bytes or DOC_BULK_BYTES
+    batch, size = [], 0
+    for ck in chunks:
+        n = estimate_chunk_bytes(ck)
+        if batch and (len(batch) >= bulk_size or size + n > bulk_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(ck)
+        size += n
+    if batch:
+        yield batch
+
+
+async def index_chunks(task, chunks, progress_callback):
+    """
+    Streams chunks into the doc store with size-bounded bulk requests, keeping up to
+    MAX_CONCURRENT_BULKS requests in flight. Chunk ids are checkpointed to the task row
+    once per flush window, i.e. after each group of concurrent bulk requests completes.
+    """
+    idxnm = search.index_name(task["tenant_id"])
+    indexed_ids = []
+    done = 0
+
+    async def insert_bulk(batch):
+        nonlocal done
+        doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(batch, idxnm, task["kb_id"]))
+        if doc_store_result:
+            error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
+            progress_callback(-1, msg=error_message)
+            raise Exception(error_message)
+        done += len(batch)
+
+    batches = bulk_batches(chunks)
+    while True:
+        window = list(itertools.islice(batches, MAX_CONCURRENT_BULKS))
+        if not window:
+            break
+        async with trio.open_nursery() as nursery:
+            for batch in window:
+                nursery.start_soon(insert_bulk, batch)
+        for batch in window:
+            indexed_ids.extend([ck["id"] for ck in batch])
+        progress_callback(prog=0.8 + 0.1 * done / len(chunks), msg="")
+        TaskService.update_chunk_ids(task["id"], " ".join(indexed_ids))
+
+
 async def do_handle_task(task):
     task_id = task["id"]
     task_from_page = task["from_page"]
@@ -575,24 +754,13 @@ async def do_handle_task(task):
 
     chunk_count = len(set([chunk["id"] for chunk in chunks]))
     start_ts = timer()
-    doc_store_result = ""
-    es_bulk_size = 4
-    for b in range(0, len(chunks), es_bulk_size):
-        doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b:b + es_bulk_size], search.index_name(task_tenant_id), task_dataset_id))
-        if b % 128 == 0:
-            progress_callback(prog=0.8 + 0.1 * (b + 1) / len(chunks), msg="")
-        if doc_store_result:
-            error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
-            progress_callback(-1, msg=error_message)
-            raise Exception(error_message)
-        chunk_ids = [chunk["id"] for chunk in chunks[:b + es_bulk_size]]
-        chunk_ids_str = " ".join(chunk_ids)
-        try:
-            TaskService.update_chunk_ids(task["id"], chunk_ids_str)
-        except DoesNotExist:
-            logging.warning(f"do_handle_task update_chunk_ids failed since task {task['id']} is unknown.")
-            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id), task_dataset_id))
-            return
+    try:
+        await index_chunks(task, chunks, progress_callback)
+    except DoesNotExist:
+        logging.warning(f"do_handle_task update_chunk_ids failed since task {task['id']} is unknown.")
+        chunk_ids = [chunk["id"] for chunk in chunks]
+        await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id), task_dataset_id))
+        return
     logging.info("Indexing doc({}), page({}-{}), chunks({}), elapsed: {:.2f}".format(task_document_name, task_from_page,
                                                                                      task_to_page, len(chunks),
                                                                                      timer() - start_ts))
@@ -633,6 +801,10 @@ async def handle_task():
         except Exception:
             pass
         logging.exception(f"handle_task got exception for task {json.dumps(task)}")
+    finally:
+        await trio.to_thread.run_sync(lambda: flush_progress(task["id"]))
+        PROGRESS_FLUSHED_AT.pop(task["id"], None)
+        CANCEL_FLAGS.pop(task["id"], None)
     redis_msg.ack()
 
 
@@ -658,6 +830,7 @@ async def report_status():
                 "done": DONE_TASKS,
                 "failed": FAILED_TASKS,
                 "current": current,
+                "embedding_cache": EMBEDDING_CACHE.stats(),
             })
             REDIS_CONN.zadd(CONSUMER_NAME, heartbeat, now.timestamp())
             logging.info(f"{CONSUMER_NAME} reported heartbeat: {heartbeat}")
@@ -744,6 +917,7 @@ async def main():
 
     async with trio.open_nursery() as nursery:
         nursery.start_soon(report_status)
+        nursery.start_soon(progress_flusher)
         while not stop_event.is_set():
             nursery.start_soon(task_manager)
             await trio.sleep(0.1)
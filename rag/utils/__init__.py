@@ -16,8 +16,10 @@
 
 import os
 import re
+from io import BytesIO
 
 import tiktoken
+import xxhash
 
 from api.utils.file_utils import get_project_base_directory
 
@@ -108,3 +110,19 @@ def get_float(v):
     except Exception:
         return float('-inf')
 
+
+def image_digest(image):
+    """Content hash of a chunk image, which names its object in the KB's bucket so identical images are stored once."""
+    if isinstance(image, bytes):
+        return xxhash.xxh64(image).hexdigest()
+    h = xxhash.xxh64("{}{}".format(image.mode, image.size).encode("utf-8"))
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def image_binary(image):
+    if isinstance(image, bytes):
+        return image
+    output_buffer = BytesIO()
+    image.save(output_buffer, format='JPEG')
+    return output_buffer.getvalue()
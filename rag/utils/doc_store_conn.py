@@ -14,7 +14,9 @@
 #  limitations under the License.
 #
 
+import copy
 from abc import ABC, abstractmethod
+from collections.abc import Iterator
 from dataclasses import dataclass
 import numpy as np
 
@@ -236,6 +238,26 @@ class DocStoreConnection(ABC):
         """
         raise NotImplementedError("Not implemented")
 
+    def scan(self, selectFields: list[str], condition: dict, indexName: str, knowledgebaseIds: list[str],
+             batchSize: int = 1000) -> Iterator[dict]:
+        """
+        Iterate lazily over every row matching the conjunctive equivalent filtering condition,
+        yielding the selected fields of one row at a time (as getFields formats them) plus its id.
+        This default pages with offsets, ordered by id so that pages don't overlap; engines with a
+        cursor should override it.
+        """
+        offset = 0
+        while True:
+            res = self.search(selectFields, [], copy.deepcopy(condition), [], OrderByExpr().asc("id"), offset, batchSize,
+                              indexName, knowledgebaseIds)
+            rows = self.getFields(res, selectFields)
+            for id, row in rows.items():
+                row["id"] = id
+                yield row
+            if len(self.getChunkIds(res)) < batchSize:
+                break
+            offset += batchSize
+
     """
     Helper functions for search result
     """
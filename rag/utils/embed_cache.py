@@ -0,0 +1,92 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import logging
+
+import numpy as np
+import xxhash
+
+from rag import settings
+from rag.utils.lru_cache import LRUCache
+from rag.utils.redis_conn import REDIS_CONN
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache keyed by (model, xxhash of text).
+
+    Vectors are stored as raw float32 bytes in a size-bounded in-process LRU and,
+    when EMBEDDING_CACHE_TYPE is "redis", in a shared Redis tier behind it.
+    """
+
+    def __init__(self, cache_type=None, max_bytes=None, ttl=None):
+        self.cache_type = cache_type or settings.EMBEDDING_CACHE_TYPE
+        self.max_bytes = max_bytes if max_bytes is not None else settings.EMBEDDING_CACHE_MAX_BYTES
+        self.ttl = ttl or settings.EMBEDDING_CACHE_TTL
+        self._lru = LRUCache(self.max_bytes)
+
+    @property
+    def enabled(self):
+        return self.cache_type in ("memory", "redis")
+
+    @staticmethod
+    def key(model, txt):
+        hasher = xxhash.xxh64()
+        hasher.update(str(model).encode("utf-8"))
+        hasher.update(b"\0")
+        hasher.update(str(txt).encode("utf-8"))
+        return "embd:" + hasher.hexdigest()
+
+    def get_many(self, model, texts: list) -> list:
+        """Returns one float32 vector or None per text."""
+        if not self.enabled:
+            return [None] * len(texts)
+        keys = [self.key(model, t) for t in texts]
+        raws = [self._lru.get(k) for k in keys]
+        missing = [i for i, r in enumerate(raws) if r is None]
+        if missing and self.cache_type == "redis":
+            for i, r in zip(missing, REDIS_CONN.mget_raw([keys[i] for i in missing])):
+                if r:
+                    raws[i] = r
+                    self._lru.put(keys[i], r, len(r))
+        res = [np.frombuffer(r, dtype=np.float32) if r else None for r in raws]
+        hits = sum(1 for r in res if r is not None)
+        self._lru.count(hits, len(res) - hits)
+        return res
+
+    def set_many(self, model, texts: list, vectors):
+        if not self.enabled:
+            return
+        mapping = {}
+        for t, v in zip(texts, vectors):
+            k = self.key(model, t)
+            raw = np.asarray(v, dtype=np.float32).tobytes()
+            self._lru.put(k, raw, len(raw))
+            mapping[k] = raw
+        if mapping and self.cache_type == "redis":
+            if not REDIS_CONN.mset_raw(mapping, self.ttl):
+                logging.warning("EmbeddingCache.set_many failed to write {} vectors to redis".format(len(mapping)))
+
+    def get(self, model, txt):
+        return self.get_many(model, [txt])[0]
+
+    def set(self, model, txt, vector):
+        self.set_many(model, [txt], [vector])
+
+    def stats(self):
+        return {"type": self.cache_type, **self._lru.stats()}
+
+
+EMBEDDING_CACHE = EmbeddingCache()
@@ -27,6 +27,7 @@ from elastic_transport import ConnectionTimeout
 from rag import settings
 from rag.settings import TAG_FLD, PAGERANK_FLD
 from rag.utils import singleton, get_float
+from rag.utils.retrieval_cache import bumps_kb_version
 from api.utils.file_utils import get_project_base_directory
 from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
     FusionExpr
@@ -102,6 +103,7 @@ class ESConnection(DocStoreConnection):
         except Exception:
             logger.exception("ESConnection.createIndex error %s" % (indexName))
 
+    @bumps_kb_version
     def deleteIdx(self, indexName: str, knowledgebaseId: str):
         if len(knowledgebaseId) > 0:
             # The index need to be alive after any kb deletion since all kb under this tenant are in one index.
@@ -129,6 +131,32 @@ class ESConnection(DocStoreConnection):
     CRUD operations
     """
 
+    def __filterQuery(self, condition: dict, knowledgebaseIds: list[str]):
+        bqry = Q("bool", must=[])
+        condition["kb_id"] = knowledgebaseIds
+        for k, v in condition.items():
+            if k == "available_int":
+                if v == 0:
+                    bqry.filter.append(Q("range", available_int={"lt": 1}))
+                else:
+                    bqry.filter.append(
+                        Q("bool", must_not=Q("range", available_int={"lt": 1})))
+                continue
+            if not v:
+                continue
+            if k == "id":
+                # Chunk ids are the document _id, not a field.
+                bqry.filter.append(Q("ids", values=v if isinstance(v, list) else [v]))
+                continue
+            if isinstance(v, list):
+                bqry.filter.append(Q("terms", **{k: v}))
+            elif isinstance(v, str) or isinstance(v, int):
+                bqry.filter.append(Q("term", **{k: v}))
+            else:
+                raise Exception(
+                    f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+        return bqry
+
     def search(
             self, selectFields: list[str],
             highlightFields: list[str],
@@ -150,25 +178,7 @@ class ESConnection(DocStoreConnection):
         assert isinstance(indexNames, list) and len(indexNames) > 0
         assert "_id" not in condition
 
-        bqry = Q("bool", must=[])
-        condition["kb_id"] = knowledgebaseIds
-        for k, v in condition.items():
-            if k == "available_int":
-                if v == 0:
-                    bqry.filter.append(Q("range", available_int={"lt": 1}))
-                else:
-                    bqry.filter.append(
-                        Q("bool", must_not=Q("range", available_int={"lt": 1})))
-                continue
-            if not v:
-                continue
-            if isinstance(v, list):
-                bqry.filter.append(Q("terms", **{k: v}))
-            elif isinstance(v, str) or isinstance(v, int):
-                bqry.filter.append(Q("term", **{k: v}))
-            else:
-                raise Exception(
-                    f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+        bqry = self.__filterQuery(condition, knowledgebaseIds)
 
         s = Search()
         vector_similarity_weight = 0.5
@@ -257,6 +267,47 @@ class ESConnection(DocStoreConnection):
         logger.error("ESConnection.search timeout for 3 times!")
         raise Exception("ESConnection.search timeout.")
 
+    def scan(self, selectFields: list[str], condition: dict, indexName: str, knowledgebaseIds: list[str],
+             batchSize: int = 1000):
+        """
+        Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/paginate-search-results.html#search-after
+        Pages with search_after over a point in time, so deep pages cost the same as the first one.
+        """
+        if not self.indexExist(indexName):
+            return
+        q = {"query": self.__filterQuery(copy.deepcopy(condition), knowledgebaseIds).to_dict(),
+             "sort": [{"_shard_doc": "asc"}],
+             "size": batchSize,
+             "_source": selectFields}
+        pit = self.es.open_point_in_time(index=indexName, keep_alive="5m")["id"]
+        try:
+            while True:
+                q["pit"] = {"id": pit, "keep_alive": "5m"}
+                for i in range(ATTEMPT_TIME):
+                    try:
+                        res = self.es.search(body=q, timeout="600s")
+                        if str(res.get("timed_out", "")).lower() == "true":
+                            raise Exception("Es Timeout.")
+                        break
+                    except Exception as e:
+                        logger.exception(f"ESConnection.scan {indexName} query: " + str(q))
+                        if str(e).find("Timeout") > 0 and i < ATTEMPT_TIME - 1:
+                            continue
+                        raise e
+                hits = res["hits"]["hits"]
+                for id, row in self.getFields(res, selectFields).items():
+                    row["id"] = id
+                    yield row
+                if len(hits) < batchSize:
+                    break
+                pit = res.get("pit_id", pit)
+                q["search_after"] = hits[-1]["sort"]
+        finally:
+            try:
+                self.es.close_point_in_time(body={"id": pit})
+            except Exception:
+                logger.warning(f"ESConnection.scan failed to close point in time for {indexName}")
+
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         for i in range(ATTEMPT_TIME):
             try:
@@ -277,6 +328,7 @@ class ESConnection(DocStoreConnection):
         logger.error("ESConnection.get timeout for 3 times!")
         raise Exception("ESConnection.get timeout.")
 
+    @bumps_kb_version
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         # Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-bulk.html
         operations = []
@@ -314,6 +366,7 @@ class ESConnection(DocStoreConnection):
                     continue
         return res
 
+    @bumps_kb_version
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         doc = copy.deepcopy(newValue)
         doc.pop("id", None)
@@ -348,6 +401,9 @@ class ESConnection(DocStoreConnection):
             if k == "exists":
                 bqry.filter.append(Q("exists", field=v))
                 continue
+            if k == "id":
+                bqry.filter.append(Q("ids", values=v if isinstance(v, list) else [v]))
+                continue
             if isinstance(v, list):
                 bqry.filter.append(Q("terms", **{k: v}))
             elif isinstance(v, str) or isinstance(v, int):
@@ -405,6 +461,7 @@ class ESConnection(DocStoreConnection):
                 break
         return False
 
+    @bumps_kb_version
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         qry = None
         assert "_id" not in condition
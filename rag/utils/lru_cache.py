@@ -0,0 +1,79 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU bounded by the total size of its values, with an optional TTL.
+
+    The size of a value is given by the caller as it is put. Hits and misses are counted by the
+    caller too, through count(), since a miss here may still be served by a tier behind the cache.
+    """
+
+    def __init__(self, max_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lru = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, k):
+        with self._lock:
+            entry = self._lru.get(k)
+            if entry is None:
+                return None
+            expire_at, size, v = entry
+            if expire_at is not None and expire_at < time.monotonic():
+                del self._lru[k]
+                self._bytes -= size
+                return None
+            self._lru.move_to_end(k)
+            return v
+
+    def put(self, k, v, size):
+        if size > self.max_bytes:
+            return
+        expire_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            old = self._lru.pop(k, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._lru[k] = (expire_at, size, v)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._lru.popitem(last=False)
+                self._bytes -= evicted
+
+    def count(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._lru),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
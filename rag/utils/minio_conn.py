@@ -27,6 +27,8 @@ from rag.utils import singleton
 class RAGFlowMinio:
     def __init__(self):
         self.conn = None
+        # Buckets known to exist, so that put() doesn't ask before every object.
+        self.buckets = set()
         self.__open__()
 
     def __open__(self):
@@ -63,8 +65,10 @@ class RAGFlowMinio:
     def put(self, bucket, fnm, binary):
         for _ in range(3):
             try:
-                if not self.conn.bucket_exists(bucket):
-                    self.conn.make_bucket(bucket)
+                if bucket not in self.buckets:
+                    if not self.conn.bucket_exists(bucket):
+                        self.conn.make_bucket(bucket)
+                    self.buckets.add(bucket)
 
                 r = self.conn.put_object(bucket, fnm,
                                          BytesIO(binary),
@@ -73,6 +77,7 @@ class RAGFlowMinio:
                 return r
             except Exception:
                 logging.exception(f"Fail to put {bucket}/{fnm}:")
+                self.buckets.discard(bucket)
                 self.__open__()
                 time.sleep(1)
 
@@ -27,6 +27,7 @@ from opensearchpy import ConnectionTimeout
 from rag import settings
 from rag.settings import TAG_FLD, PAGERANK_FLD
 from rag.utils import singleton
+from rag.utils.retrieval_cache import bumps_kb_version
 from api.utils.file_utils import get_project_base_directory
 from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
     FusionExpr
@@ -101,6 +102,7 @@ class OSConnection(DocStoreConnection):
         except Exception:
             logger.exception("OSConnection.createIndex error %s" % (indexName))
 
+    @bumps_kb_version
     def deleteIdx(self, indexName: str, knowledgebaseId: str):
         if len(knowledgebaseId) > 0:
             # The index need to be alive after any kb deletion since all kb under this tenant are in one index.
@@ -128,6 +130,32 @@ class OSConnection(DocStoreConnection):
     CRUD operations
     """
 
+    def __filterQuery(self, condition: dict, knowledgebaseIds: list[str]):
+        bqry = Q("bool", must=[])
+        condition["kb_id"] = knowledgebaseIds
+        for k, v in condition.items():
+            if k == "available_int":
+                if v == 0:
+                    bqry.filter.append(Q("range", available_int={"lt": 1}))
+                else:
+                    bqry.filter.append(
+                        Q("bool", must_not=Q("range", available_int={"lt": 1})))
+                continue
+            if not v:
+                continue
+            if k == "id":
+                # Chunk ids are the document _id, not a field.
+                bqry.filter.append(Q("ids", values=v if isinstance(v, list) else [v]))
+                continue
+            if isinstance(v, list):
+                bqry.filter.append(Q("terms", **{k: v}))
+            elif isinstance(v, str) or isinstance(v, int):
+                bqry.filter.append(Q("term", **{k: v}))
+            else:
+                raise Exception(
+                    f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+        return bqry
+
     def search(
             self, selectFields: list[str],
             highlightFields: list[str],
@@ -150,25 +178,7 @@ class OSConnection(DocStoreConnection):
         assert isinstance(indexNames, list) and len(indexNames) > 0
         assert "_id" not in condition
 
-        bqry = Q("bool", must=[])
-        condition["kb_id"] = knowledgebaseIds
-        for k, v in condition.items():
-            if k == "available_int":
-                if v == 0:
-                    bqry.filter.append(Q("range", available_int={"lt": 1}))
-                else:
-                    bqry.filter.append(
-                        Q("bool", must_not=Q("range", available_int={"lt": 1})))
-                continue
-            if not v:
-                continue
-            if isinstance(v, list):
-                bqry.filter.append(Q("terms", **{k: v}))
-            elif isinstance(v, str) or isinstance(v, int):
-                bqry.filter.append(Q("term", **{k: v}))
-            else:
-                raise Exception(
-                    f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+        bqry = self.__filterQuery(condition, knowledgebaseIds)
 
         s = Search()
         vector_similarity_weight = 0.5
@@ -265,6 +275,52 @@ class OSConnection(DocStoreConnection):
         logger.error("OSConnection.search timeout for 3 times!")
         raise Exception("OSConnection.search timeout.")
 
+    def scan(self, selectFields: list[str], condition: dict, indexName: str, knowledgebaseIds: list[str],
+             batchSize: int = 1000):
+        """
+        Refers to https://opensearch.org/docs/latest/search-plugins/searching-data/paginate/#scroll-search
+        Pages with a scroll context, so deep pages cost the same as the first one.
+        """
+        if not self.indexExist(indexName):
+            return
+        q = {"query": self.__filterQuery(copy.deepcopy(condition), knowledgebaseIds).to_dict(),
+             "sort": ["_doc"],
+             "size": batchSize,
+             "_source": selectFields}
+        scroll_id = None
+        try:
+            while True:
+                if scroll_id is None:
+                    for i in range(ATTEMPT_TIME):
+                        try:
+                            res = self.os.search(index=indexName, body=q, scroll="5m", timeout=600)
+                            if str(res.get("timed_out", "")).lower() == "true":
+                                raise Exception("OpenSearch Timeout.")
+                            break
+                        except Exception as e:
+                            logger.exception(f"OSConnection.scan {indexName} query: " + str(q))
+                            if str(e).find("Timeout") > 0 and i < ATTEMPT_TIME - 1:
+                                continue
+                            raise e
+                else:
+                    # Not retried: the scroll may have moved past a page whose response was lost.
+                    res = self.os.scroll(scroll_id=scroll_id, scroll="5m")
+                    if str(res.get("timed_out", "")).lower() == "true":
+                        raise Exception(f"OSConnection.scan {indexName} scroll timed out.")
+                scroll_id = res.get("_scroll_id", scroll_id)
+                hits = res["hits"]["hits"]
+                for id, row in self.getFields(res, selectFields).items():
+                    row["id"] = id
+                    yield row
+                if len(hits) < batchSize:
+                    break
+        finally:
+            if scroll_id:
+                try:
+                    self.os.clear_scroll(scroll_id=scroll_id)
+                except Exception:
+                    logger.warning(f"OSConnection.scan failed to clear scroll for {indexName}")
+
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         for i in range(ATTEMPT_TIME):
             try:
@@ -285,6 +341,7 @@ class OSConnection(DocStoreConnection):
         logger.error("OSConnection.get timeout for 3 times!")
         raise Exception("OSConnection.get timeout.")
 
+    @bumps_kb_version
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         # Refers to https://opensearch.org/docs/latest/api-reference/document-apis/bulk/
         operations = []
@@ -321,6 +378,7 @@ class OSConnection(DocStoreConnection):
                     continue
         return res
 
+    @bumps_kb_version
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         doc = copy.deepcopy(newValue)
         doc.pop("id", None)
@@ -347,6 +405,9 @@ class OSConnection(DocStoreConnection):
             if k == "exists":
                 bqry.filter.append(Q("exists", field=v))
                 continue
+            if k == "id":
+                bqry.filter.append(Q("ids", values=v if isinstance(v, list) else [v]))
+                continue
             if isinstance(v, list):
                 bqry.filter.append(Q("terms", **{k: v}))
             elif isinstance(v, str) or isinstance(v, int):
@@ -404,6 +465,7 @@ class OSConnection(DocStoreConnection):
                 break
         return False
 
+    @bumps_kb_version
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         qry = None
         assert "_id" not in condition
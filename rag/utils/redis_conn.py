@@ -61,6 +61,7 @@ class RedisDB:
 
     def __init__(self):
         self.REDIS = None
+        self.REDIS_RAW = None
         self.config = settings.REDIS
         self.__open__()
 
@@ -78,6 +79,14 @@ class RedisDB:
                 password=self.config.get("password"),
                 decode_responses=True,
             )
+            # binary-safe client for values that are not utf-8 text, e.g. packed vectors
+            self.REDIS_RAW = redis.StrictRedis(
+                host=self.config["host"].split(":")[0],
+                port=int(self.config.get("host", ":6379").split(":")[1]),
+                db=int(self.config.get("db", 1)),
+                password=self.config.get("password"),
+                decode_responses=False,
+            )
             self.register_scripts()
         except Exception:
             logging.warning("Redis can't be connected.")
@@ -112,6 +121,30 @@ class RedisDB:
             logging.warning("RedisDB.get " + str(k) + " got exception: " + str(e))
             self.__open__()
 
+    def mget_raw(self, keys: list[str]) -> list[bytes | None]:
+        if not self.REDIS_RAW or not keys:
+            return [None] * len(keys)
+        try:
+            return self.REDIS_RAW.mget(keys)
+        except Exception as e:
+            logging.warning("RedisDB.mget_raw got exception: " + str(e))
+            self.__open__()
+        return [None] * len(keys)
+
+    def mset_raw(self, mapping: dict[str, bytes], exp=3600):
+        if not self.REDIS_RAW or not mapping:
+            return False
+        try:
+            pipeline = self.REDIS_RAW.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipeline.set(k, v, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.mset_raw got exception: " + str(e))
+            self.__open__()
+        return False
+
     def set_obj(self, k, obj, exp=3600):
         try:
             self.REDIS.set(k, json.dumps(obj, ensure_ascii=False), exp)
@@ -130,6 +163,22 @@ class RedisDB:
             self.__open__()
         return False
 
+    def setnx(self, k, v):
+        try:
+            return bool(self.REDIS.set(k, v, nx=True))
+        except Exception as e:
+            logging.warning("RedisDB.setnx " + str(k) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def incr(self, k):
+        try:
+            return self.REDIS.incr(k)
+        except Exception as e:
+            logging.warning("RedisDB.incr " + str(k) + " got exception: " + str(e))
+            self.__open__()
+        return None
+
     def sadd(self, key: str, member: str):
         try:
             self.REDIS.sadd(key, member)
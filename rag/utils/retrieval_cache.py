@@ -0,0 +1,200 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import copy
+import functools
+import inspect
+import json
+import logging
+import re
+import threading
+import time
+from array import array
+
+import xxhash
+
+from rag import settings
+from rag.utils.lru_cache import LRUCache
+from rag.utils.redis_conn import REDIS_CONN
+
+
+def _version_key(kb_id):
+    return f"kb_version:{kb_id}"
+
+
+def kb_versions(kb_ids: list) -> list | None:
+    """
+    Current version of every knowledge base, or None if one can't be told (Redis unreachable).
+
+    A version that doesn't exist yet starts at the current time in ms rather than at 0, so that
+    a key lost by Redis never comes back with a value that cached results were keyed with.
+    """
+    keys = [_version_key(kb_id) for kb_id in kb_ids]
+    versions = REDIS_CONN.mget_raw(keys)
+    for i, v in enumerate(versions):
+        if v is None:
+            REDIS_CONN.setnx(keys[i], int(time.time() * 1000))
+            versions[i] = REDIS_CONN.get(keys[i])
+            if versions[i] is None:
+                return None
+    return [v.decode() if isinstance(v, bytes) else str(v) for v in versions]
+
+
+def bump_kb_versions(kb_ids):
+    for kb_id in set(kb_ids):
+        if kb_id and REDIS_CONN.incr(_version_key(kb_id)) is None:
+            logging.warning(f"Fail to bump the version of knowledgebase {kb_id}, cached retrievals may be stale for {settings.RETRIEVAL_CACHE_TTL}s")
+
+
+_rebump_due = {}
+_rebump_lock = threading.Lock()
+_rebump_timer = None
+
+
+def _schedule_rebump(delay):
+    global _rebump_timer
+    _rebump_timer = threading.Timer(delay, _rebump)
+    _rebump_timer.daemon = True
+    _rebump_timer.start()
+
+
+def _rebump():
+    global _rebump_timer
+    now = time.monotonic()
+    with _rebump_lock:
+        due = [kb_id for kb_id, t in _rebump_due.items() if t <= now]
+        for kb_id in due:
+            del _rebump_due[kb_id]
+        _rebump_timer = None
+        if _rebump_due:
+            _schedule_rebump(max(0.0, min(_rebump_due.values()) - now))
+    bump_kb_versions(due)
+
+
+def bump_kb_versions_after_refresh(kb_ids):
+    """
+    Bumps the versions again once the write is searchable, RETRIEVAL_CACHE_REBUMP_DELAY after it:
+    a retrieval run between the write and the index refresh reads the new version with the old chunks.
+    Writes to the same KB in the meantime push its bump back and are covered by one INCR.
+    """
+    due = time.monotonic() + settings.RETRIEVAL_CACHE_REBUMP_DELAY
+    with _rebump_lock:
+        for kb_id in kb_ids:
+            if kb_id:
+                _rebump_due[kb_id] = due
+        if _rebump_due and _rebump_timer is None:
+            _schedule_rebump(settings.RETRIEVAL_CACHE_REBUMP_DELAY)
+
+
+def bumps_kb_version(method):
+    """
+    For the DocStoreConnection methods that write chunks: once the write is done (or failed half way),
+    the version of the knowledge bases it touched is bumped so that their cached retrievals go stale,
+    and bumped again after the index refresh that makes the write searchable.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        finally:
+            arguments = signature.bind(*args, **kwargs).arguments
+            kb_id = arguments.get("knowledgebaseId")
+            if kb_id:
+                kb_ids = kb_id if isinstance(kb_id, list) else [kb_id]
+            else:
+                kb_ids = [d.get("kb_id") for d in arguments.get("documents", []) or []]
+            bump_kb_versions(kb_ids)
+            bump_kb_versions_after_refresh(kb_ids)
+
+    return wrapper
+
+
+class RetrievalCache:
+    """
+    In-process LRU of Dealer.retrieval results, bounded by size and with a TTL. KGSearch keeps its
+    query rewrites and entity type samples in instances of its own.
+
+    Keys cover the normalized question, every retrieval parameter, the embedding and rerank models
+    and the version of each knowledge base searched, so any chunk written to one of them through
+    the doc store makes its cached results unreachable.
+
+    Chunk vectors, most of an entry, are kept packed as doubles and unpacked on every hit. The size
+    of an entry is its packed vectors plus the JSON length of the rest.
+    """
+
+    def __init__(self, cache_type=None, max_bytes=None, ttl=None):
+        self.cache_type = cache_type or settings.RETRIEVAL_CACHE_TYPE
+        self.max_bytes = max_bytes if max_bytes is not None else settings.RETRIEVAL_CACHE_MAX_BYTES
+        self.ttl = ttl or settings.RETRIEVAL_CACHE_TTL
+        self._lru = LRUCache(self.max_bytes, self.ttl)
+
+    @property
+    def enabled(self):
+        return self.cache_type == "memory" and self.max_bytes > 0
+
+    @staticmethod
+    def normalize(question):
+        return re.sub(r"\s+", " ", question).strip().lower()
+
+    def key(self, question, tenant_ids, kb_ids, embd_mdl, rerank_mdl, **params):
+        """None when the retrieval can't be cached: a model without a name, or unknown KB versions."""
+        embd_name = getattr(embd_mdl, "cache_model_name", None) or getattr(embd_mdl, "llm_name", None)
+        rerank_name = None
+        if rerank_mdl:
+            rerank_name = getattr(rerank_mdl, "cache_model_name", None) or getattr(rerank_mdl, "llm_name", None)
+            if not rerank_name:
+                return None
+        kb_ids = sorted(kb_ids or [])
+        versions = kb_versions(kb_ids)
+        if not embd_name or versions is None:
+            return None
+        return self.digest("retrieval", [self.normalize(question), sorted(tenant_ids), kb_ids, versions, embd_name, rerank_name,
+                                         {k: sorted(v) if isinstance(v, list) else v for k, v in params.items()}])
+
+    @staticmethod
+    def digest(prefix, parts):
+        hasher = xxhash.xxh64()
+        hasher.update(json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        return prefix + ":" + hasher.hexdigest()
+
+    def get(self, k):
+        entry = self._lru.get(k)
+        self._lru.count(int(entry is not None), int(entry is None))
+        if entry is None:
+            return None
+        value, vectors = entry
+        # Callers extend and trim what they get back.
+        value = copy.deepcopy(value)
+        for chunk, vector in zip(value["chunks"] if vectors else [], vectors):
+            if vector is not None:
+                chunk["vector"] = array("d", vector).tolist()
+        return value
+
+    def set(self, k, value):
+        vectors = []
+        if isinstance(value, dict) and isinstance(value.get("chunks"), list):
+            vectors = [array("d", c["vector"]).tobytes() if c.get("vector") is not None else None for c in value["chunks"]]
+            value = {**value, "chunks": [{f: v for f, v in c.items() if f != "vector"} for c in value["chunks"]]}
+        value = copy.deepcopy(value)
+        size = len(json.dumps(value, ensure_ascii=False, default=str)) + sum(len(v) for v in vectors if v)
+        self._lru.put(k, (value, vectors), size)
+
+    def stats(self):
+        return {"type": self.cache_type, **self._lru.stats()}
+
+
+RETRIEVAL_CACHE = RetrievalCache()
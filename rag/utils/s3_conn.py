@@ -36,6 +36,8 @@ class RAGFlowS3:
         self.addressing_style = self.s3_config.get('addressing_style', None)
         self.bucket = self.s3_config.get('bucket', None)
         self.prefix_path = self.s3_config.get('prefix_path', None)
+        # Buckets known to exist, so that put() doesn't ask before every object.
+        self.buckets = set()
         self.__open__()
 
     @staticmethod
@@ -119,14 +121,17 @@ class RAGFlowS3:
         logging.debug(f"bucket name {bucket}; filename :{fnm}:")
         for _ in range(1):
             try:
-                if not self.bucket_exists(bucket):
-                    self.conn.create_bucket(Bucket=bucket)
-                    logging.info(f"create bucket {bucket} ********")
+                if bucket not in self.buckets:
+                    if not self.bucket_exists(bucket):
+                        self.conn.create_bucket(Bucket=bucket)
+                        logging.info(f"create bucket {bucket} ********")
+                    self.buckets.add(bucket)
                 r = self.conn.upload_fileobj(BytesIO(binary), bucket, fnm)
 
                 return r
             except Exception:
                 logging.exception(f"Fail put {bucket}/{fnm}")
+                self.buckets.discard(bucket)
                 self.__open__()
                 time.sleep(1)
 
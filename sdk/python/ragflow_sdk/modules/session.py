@@ -33,13 +33,16 @@ class Session(Base):
                 self.__session_type = "agent"
         super().__init__(rag, res_dict)
 
-    def ask(self, question="", stream=True, **kwargs):
+    def ask(self, question="", stream=True, delta=False, **kwargs):
+        # In delta mode the events carry the new text only, messages still come out whole.
+        delta = stream and delta
         if self.__session_type == "agent":
-            res = self._ask_agent(question, stream)
+            res = self._ask_agent(question, stream, delta)
         elif self.__session_type == "chat":
-            res = self._ask_chat(question, stream, **kwargs)
+            res = self._ask_chat(question, stream, delta=delta, **kwargs)
 
         if stream:
+            content = ""
             for line in res.iter_lines():
                 line = line.decode("utf-8")
                 if line.startswith("{"):
@@ -50,15 +53,20 @@ class Session(Base):
                 json_data = json.loads(line[5:])
                 if json_data["data"] is True or json_data["data"].get("running_status"):
                     continue
-                answer = json_data["data"]["answer"]
+                if "delta" in json_data["data"]:
+                    content += json_data["data"]["delta"]
+                else:
+                    content = json_data["data"]["answer"]
                 reference = json_data["data"].get("reference", {})
                 temp_dict = {
-                    "content": answer,
+                    "content": content,
                     "role": "assistant"
                 }
                 if reference and "chunks" in reference:
                     chunks = reference["chunks"]
                     temp_dict["reference"] = chunks
+                if "seq" in json_data["data"]:
+                    temp_dict["seq"] = json_data["data"]["seq"]
                 message = Message(self.rag, temp_dict)
                 yield message
         else:
@@ -85,9 +93,9 @@ class Session(Base):
                         json_data, stream=stream)
         return res
 
-    def _ask_agent(self, question: str, stream: bool):
+    def _ask_agent(self, question: str, stream: bool, delta: bool = False):
         res = self.post(f"/agents/{self.agent_id}/completions",
-                        {"question": question, "stream": stream, "session_id": self.id}, stream=stream)
+                        {"question": question, "stream": stream, "delta": delta, "session_id": self.id}, stream=stream)
         return res
 
     def update(self, update_message):
@@ -105,4 +113,6 @@ class Message(Base):
         self.role = "assistant"
         self.prompt = None
         self.id = None
+        # position of the event in a delta-mode stream
+        self.seq = None
         super().__init__(rag, res_dict)
@@ -15,6 +15,7 @@
 #
 
 from ragflow_sdk import RAGFlow
+from ragflow_sdk.modules.chat import Chat
 from common import HOST_ADDRESS
 import pytest
 
@@ -58,6 +59,33 @@ def test_create_conversation_with_success(get_api_key_fixture):
     # assert not ans.content.startswith("**ERROR**"), "Please check this error."
 
 
+def test_create_conversation_with_delta(get_api_key_fixture):
+    API_KEY = get_api_key_fixture
+    rag = RAGFlow(API_KEY, HOST_ADDRESS)
+    kb = rag.create_dataset(name="test_create_conversation_with_delta")
+    display_name = "ragflow.txt"
+    with open("test_data/ragflow.txt", "rb") as file:
+        blob = file.read()
+    document = {"display_name": display_name, "blob": blob}
+    documents = []
+    documents.append(document)
+    docs = kb.upload_documents(documents)
+    for doc in docs:
+        doc.add_chunk("This is a test to add chunk")
+    llm = Chat.LLM(rag, {"model_name": None, "temperature": 0, "top_p": 0.3, "presence_penalty": 0.4,
+                         "frequency_penalty": 0.7, "max_tokens": 512})
+    assistant = rag.create_chat("test_create_conversation_with_delta", dataset_ids=[kb.id], llm=llm)
+    question = "What is AI"
+    for ans in assistant.create_session().ask(question):
+        pass
+    messages = list(assistant.create_session().ask(question, stream=True, delta=True))
+    assert messages, "No message streamed in delta mode."
+    assert messages[-1].content == ans.content
+    seqs = [m.seq for m in messages]
+    assert seqs == sorted(set(seqs)), f"seq does not increase: {seqs}"
+    assert messages[-1].reference is not None, "The final event carries no reference."
+
+
 def test_delete_sessions_with_success(get_api_key_fixture):
     API_KEY = get_api_key_fixture
     rag = RAGFlow(API_KEY, HOST_ADDRESS)